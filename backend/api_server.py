@@ -1,16 +1,34 @@
+import csv
+import io
 import os
 import random
-import time
 import json
+import time
+from contextlib import asynccontextmanager
 from typing import Optional
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
-from fastapi import FastAPI, Depends, HTTPException, status, Header
+from fastapi import FastAPI, Depends, HTTPException, Query, status, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, EmailStr, Field
 import uvicorn
 
-from database import Database, db as database
+from database import Database, IdentifierTaken, db as database, get_db
+from snapshot import SnapshotReplica, admin_snapshot, get_admin_snapshot
+from password_hasher import password_hasher
+from rate_limit import RateLimitMiddleware, RateLimitRule, rate_limit_metrics
+from sweeper import sweeper
+from generation_jobs import job_workers
+from siliconflow import siliconflow
+from provider_keys import (
+    DuplicateKey,
+    KeyAlreadyRotated,
+    ProviderKeyPool,
+    provider_keys,
+)
+from job_queue import job_queue
 from auth import (
     verify_password,
     get_password_hash,
@@ -18,13 +36,66 @@ from auth import (
     create_access_token,
     get_current_user,
     get_current_admin,
+    revocations,
+    token_cache,
 )
 from sms_service import SMSService
 from email_service import EmailService
 
 
-app = FastAPI(title="角度拍摄 API", version="1.0.0")
-
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 进程池要在其他后台线程之前创建
+    password_hasher.start()
+    database.start_background_tasks()
+    revocations.start()
+    admin_snapshot.start()
+    sweeper.start()
+    provider_keys.start()
+    siliconflow.start()
+    job_workers.start()
+    yield
+    job_workers.stop()
+    siliconflow.stop()
+    provider_keys.stop()
+    sweeper.stop()
+    admin_snapshot.stop()
+    revocations.stop()
+    database.stop_background_tasks()
+    password_hasher.stop()
+
+
+app = FastAPI(title="角度拍摄 API", version="1.0.0", lifespan=lifespan)
+
+# 与 API 文档中“速率限制”一节一致；按账号的规则防止换IP撞同一账号，按IP的规则防止遍历账号
+RATE_LIMIT_RULES = [
+    RateLimitRule("send_code", ["/api/v1/auth/send-code"], 1, 60, "body:identifier"),
+    RateLimitRule("send_code_ip", ["/api/v1/auth/send-code"], 20, 60),
+    RateLimitRule("login", ["/api/v1/auth/login"], 5, 60, "body:identifier"),
+    RateLimitRule("admin_login", ["/api/v1/admin/login"], 5, 60, "body:username"),
+    RateLimitRule(
+        "auth_ip",
+        ["/api/v1/auth/login", "/api/v1/auth/register", "/api/v1/admin/login"],
+        20,
+        60,
+    ),
+    RateLimitRule(
+        "generate", ["/api/v1/generate", "/api/v1/generate-360"], 10, 60, "user"
+    ),
+    RateLimitRule(
+        "admin",
+        ["/api/v1/admin/*"],
+        30,
+        60,
+        "user",
+        methods=("GET", "POST", "PUT", "PATCH", "DELETE"),
+    ),
+]
+
+# 先于 CORS 注册，429 响应同样带上 CORS 头
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware, rules=RATE_LIMIT_RULES)
 
 app.add_middleware(
     CORSMiddleware,
@@ -34,6 +105,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 服务端生成的视频（SILICONFLOW_VIDEO=1）下载到此目录，生成记录的 result_url 为 outputs/<任务ID>.mp4
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "outputs")
+app.mount(
+    "/outputs", StaticFiles(directory=OUTPUT_DIR, check_dir=False), name="outputs"
+)
 
 sms_service = SMSService()
 email_service = EmailService()
@@ -66,7 +142,7 @@ class GenerateRequest(BaseModel):
 
 class Generate360Request(BaseModel):
     source_image_b64: str = Field(..., description="base64编码的源图片")
-    frame_count: int = Field(36, description="帧数，默认36帧（每10度一帧）")
+    frame_count: int = Field(36, ge=1, description="帧数，默认36帧（每10度一帧）")
 
 
 class AdminLoginRequest(BaseModel):
@@ -81,9 +157,19 @@ class AdminUpdateUserQuotaRequest(BaseModel):
 
 
 class AdminCreateAPIKeyRequest(BaseModel):
+    key_name: str = Field(..., min_length=1, description="名称")
     provider: str = Field(..., description="服务商: gemini, siliconflow")
-    api_key: str = Field(..., description="API密钥")
-    priority: int = Field(1, description="优先级")
+    api_key: str = Field(..., min_length=1, description="API密钥")
+    priority: int = Field(1, ge=0, description="优先级（选取权重，0 表示不参与选取）")
+    monthly_limit: Optional[int] = Field(10000, ge=0, description="每月调用上限")
+    rate_limit_per_minute: Optional[int] = Field(
+        None, ge=1, description="每分钟请求上限"
+    )
+    is_active: bool = True
+
+
+class AdminRotateAPIKeyRequest(BaseModel):
+    api_key: str = Field(..., min_length=1, description="新的API密钥")
 
 
 class AdminCreatePackageRequest(BaseModel):
@@ -99,6 +185,52 @@ def is_phone_number(identifier: str) -> bool:
     return identifier.isdigit() and len(identifier) == 11
 
 
+def reserve_quota_or_raise(
+    database: Database,
+    user_id: int,
+    n: int,
+    kind: Optional[str] = None,
+    stat_date: Optional[str] = None,
+) -> int:
+    """原子预扣 n 次配额，失败时抛出对应的HTTP错误；返回剩余次数"""
+    remaining = database.reserve_quota(user_id, n, kind, stat_date)
+    if remaining is not None:
+        return remaining
+
+    quota = database.get_user_quota(user_id)
+    if not quota:
+        raise HTTPException(status_code=400, detail="用户配额不存在")
+    if n == 1:
+        raise HTTPException(status_code=403, detail="生成次数已用完，请购买套餐")
+    remaining = (quota["free_generations"] or 0) - (quota["used_generations"] or 0)
+    raise HTTPException(
+        status_code=403,
+        detail=f"需要{n}次生成，您剩余{max(remaining, 0)}次",
+    )
+
+
+def enqueue_or_refund(
+    database: Database, user_id: int, kind: str, payload: dict, quota: int
+) -> str:
+    """
+    为已预扣配额的请求创建任务；源图片先存入 BlobStore，任务里只保存哈希
+
+    payload["quota_date"] 为预扣计入统计的日期，任务失败或取消时从该日退还
+    """
+    try:
+        payload["source_image_hash"] = database.store_source_image(
+            payload.pop("source_image_b64")
+        )
+        return job_queue.enqueue(user_id, kind, payload, quota=quota)
+    except ValueError:
+        # base64 解码失败（binascii.Error 是 ValueError 的子类）
+        database.refund_quota(user_id, quota, kind, payload.get("quota_date"))
+        raise HTTPException(status_code=400, detail="源图片不是有效的base64编码")
+    except Exception:
+        database.refund_quota(user_id, quota, kind, payload.get("quota_date"))
+        raise
+
+
 @app.get("/")
 def read_root():
     return {"service": "角度拍摄 API", "version": "1.0.0", "status": "running"}
@@ -110,12 +242,19 @@ def health_check():
 
 
 @app.post("/api/v1/auth/send-code")
-def send_code(request: SendCodeRequest):
+def send_code(request: SendCodeRequest, database: Database = Depends(get_db)):
     identifier = request.identifier
     code_type = request.type
 
     is_phone = is_phone_number(identifier)
 
+    # 限流中间件关闭时按数据库记录检查频率（1分钟内只能发送1次）
+    if (
+        not RATE_LIMIT_ENABLED
+        and database.count_recent_verification_codes(identifier, seconds=60) >= 1
+    ):
+        raise HTTPException(status_code=429, detail="发送过于频繁，请1分钟后再试")
+
     if is_phone:
         phone_number = identifier
         code = generate_code()
@@ -145,7 +284,7 @@ def send_code(request: SendCodeRequest):
 
 
 @app.post("/api/v1/auth/register")
-def register(request: RegisterRequest):
+def register(request: RegisterRequest, database: Database = Depends(get_db)):
     identifier = request.identifier
     code = request.code
     password = request.password
@@ -166,22 +305,26 @@ def register(request: RegisterRequest):
 
     password_hash = get_password_hash(password)
 
-    if is_phone:
-        user_id = database.create_user(
-            phone_number=identifier,
-            email=None,
-            password_hash=password_hash,
-            country_code="+86",
-            region="CN",
-        )
-    else:
-        user_id = database.create_user(
-            phone_number=None,
-            email=identifier,
-            password_hash=password_hash,
-            country_code="",
-            region="OTHER",
-        )
+    try:
+        if is_phone:
+            user_id = database.create_user(
+                phone_number=identifier,
+                email=None,
+                password_hash=password_hash,
+                country_code="+86",
+                region="CN",
+            )
+        else:
+            user_id = database.create_user(
+                phone_number=None,
+                email=identifier,
+                password_hash=password_hash,
+                country_code="",
+                region="OTHER",
+            )
+    except IdentifierTaken as e:
+        # 并发注册同一账号时，后到的请求在这里失败
+        raise HTTPException(status_code=400, detail=str(e))
 
     database.create_user_quota(user_id, free_generations=8)
 
@@ -198,7 +341,7 @@ def register(request: RegisterRequest):
 
 
 @app.post("/api/v1/auth/login")
-def login(request: LoginRequest):
+def login(request: LoginRequest, database: Database = Depends(get_db)):
     identifier = request.identifier
     password = request.password
 
@@ -226,23 +369,10 @@ def login(request: LoginRequest):
 
 
 @app.get("/api/v1/auth/me")
-def get_me(user_id: int = Depends(get_current_user)):
-    user = database.get_user_by_identifier(str(user_id))
-    if (
-        not user
-        and database.get_connection()
-        .execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        .fetchone()
-    ):
-        conn = database.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        row = cursor.fetchone()
-        if row:
-            columns = [desc[0] for desc in cursor.description]
-            user = dict(zip(columns, row))
-        conn.close()
-
+def get_me(
+    user_id: int = Depends(get_current_user), database: Database = Depends(get_db)
+):
+    user = database.get_user_by_id(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
 
@@ -267,35 +397,49 @@ def get_me(user_id: int = Depends(get_current_user)):
 
 
 @app.get("/api/v1/poses")
-def get_poses(active_only: bool = True):
+def get_poses(active_only: bool = True, database: Database = Depends(get_db)):
     poses = database.get_all_system_poses(active_only=active_only)
     return {"success": True, "data": poses, "count": len(poses)}
 
 
 @app.post("/api/v1/poses/{pose_id}/increment")
-def increment_pose_usage(pose_id: int, user_id: int = Depends(get_current_user)):
+def increment_pose_usage(
+    pose_id: int,
+    user_id: int = Depends(get_current_user),
+    database: Database = Depends(get_db),
+):
     database.increment_pose_usage(pose_id)
     return {"success": True, "message": "使用次数已更新"}
 
 
 @app.post("/api/v1/generate")
-def generate_image(request: GenerateRequest, user_id: int = Depends(get_current_user)):
-    quota = database.get_user_quota(user_id)
-    if not quota:
-        raise HTTPException(status_code=400, detail="用户配额不存在")
-
-    remaining = (quota["free_generations"] or 0) - (quota["used_generations"] or 0)
-    if remaining <= 0:
-        raise HTTPException(status_code=403, detail="生成次数已用完，请购买套餐")
-
+def generate_image(
+    request: GenerateRequest,
+    user_id: int = Depends(get_current_user),
+    database: Database = Depends(get_db),
+):
     poses = database.get_all_system_poses(active_only=True)
     pose = next((p for p in poses if p["id"] == request.pose_id), None)
     if not pose:
         raise HTTPException(status_code=404, detail="姿势不存在")
 
-    database.increment_usage(user_id)
-
-    job_id = f"gen_{int(time.time())}_{user_id}_{request.pose_id}"
+    reserved_on = datetime.utcnow().date().isoformat()
+    reserve_quota_or_raise(database, user_id, 1, "image", reserved_on)
+    job_id = enqueue_or_refund(
+        database,
+        user_id,
+        "image",
+        {
+            "pose_id": request.pose_id,
+            "pose_type": pose["category"],
+            "azimuth": pose["azimuth"],
+            "elevation": pose["elevation"],
+            "distance": pose["distance"],
+            "source_image_b64": request.source_image_b64,
+            "quota_date": reserved_on,
+        },
+        quota=1,
+    )
 
     return {
         "success": True,
@@ -303,7 +447,7 @@ def generate_image(request: GenerateRequest, user_id: int = Depends(get_current_
             "job_id": job_id,
             "pose_id": request.pose_id,
             "pose_name": pose["name"],
-            "status": "processing",
+            "status": "queued",
         },
         "message": "图片生成任务已创建，请在APP本地处理",
     }
@@ -311,52 +455,78 @@ def generate_image(request: GenerateRequest, user_id: int = Depends(get_current_
 
 @app.post("/api/v1/generate-360")
 def generate_360_video(
-    request: Generate360Request, user_id: int = Depends(get_current_user)
+    request: Generate360Request,
+    user_id: int = Depends(get_current_user),
+    database: Database = Depends(get_db),
 ):
-    quota = database.get_user_quota(user_id)
-    if not quota:
-        raise HTTPException(status_code=400, detail="用户配额不存在")
-
-    remaining = (quota["free_generations"] or 0) - (quota["used_generations"] or 0)
-    if remaining < request.frame_count:
-        raise HTTPException(
-            status_code=403,
-            detail=f"需要{request.frame_count}次生成，您剩余{max(remaining, 0)}次",
-        )
-
-    database.increment_usage(user_id)
-
-    job_id = f"360_{int(time.time())}_{user_id}"
+    # 每一帧都消耗一次生成次数
+    reserved_on = datetime.utcnow().date().isoformat()
+    reserve_quota_or_raise(database, user_id, request.frame_count, "video", reserved_on)
+    job_id = enqueue_or_refund(
+        database,
+        user_id,
+        "video",
+        {
+            "frame_count": request.frame_count,
+            "source_image_b64": request.source_image_b64,
+            "quota_date": reserved_on,
+        },
+        quota=request.frame_count,
+    )
 
     return {
         "success": True,
         "data": {
             "job_id": job_id,
             "frame_count": request.frame_count,
-            "status": "processing",
+            "status": "queued",
         },
         "message": "360视频生成任务已创建，请在APP本地处理",
     }
 
 
+def get_own_job(job_id: str, user_id: int) -> dict:
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if job["user_id"] != user_id:
+        raise HTTPException(status_code=403, detail="无权访问此任务")
+    return job
+
+
 @app.get("/api/v1/job/{job_id}")
 def get_job_status(job_id: str, user_id: int = Depends(get_current_user)):
-    job_user_id = int(job_id.split("_")[2])
-    if job_user_id != user_id:
-        raise HTTPException(status_code=403, detail="无权访问此任务")
+    job = get_own_job(job_id, user_id)
+    # 预计完成时间由服务端生成任务按历史耗时给出，超时未完成时随状态查询推后
+    eta = job["eta_ts"] if job["state"] in ("queued", "running") else None
 
     return {
         "success": True,
         "data": {
             "job_id": job_id,
-            "status": "processing",
-            "message": "请在Android APP本地处理AI生成",
+            "kind": job["kind"],
+            "status": job["state"],
+            "attempts": job["attempts"],
+            "result": job["result"],
+            "error": job["error"],
+            "created_at": job["created_ts"],
+            "finished_at": job["finished_ts"],
+            "eta": eta,
+            "eta_seconds": max(0, eta - int(time.time())) if eta else None,
         },
     }
 
 
+@app.post("/api/v1/job/{job_id}/cancel")
+def cancel_job(job_id: str, user_id: int = Depends(get_current_user)):
+    get_own_job(job_id, user_id)
+    if not job_queue.cancel(job_id, user_id):
+        raise HTTPException(status_code=409, detail="任务已结束，无法取消")
+    return {"success": True, "message": "任务已取消，配额已退还"}
+
+
 @app.post("/api/v1/admin/login")
-def admin_login(request: AdminLoginRequest):
+def admin_login(request: AdminLoginRequest, database: Database = Depends(get_db)):
     if request.username == "admin":
         admin_user = database.get_user_by_identifier("admin")
         if not admin_user:
@@ -367,26 +537,23 @@ def admin_login(request: AdminLoginRequest):
                 country_code="",
                 region="ADMIN",
             )
-            conn = database.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("UPDATE users SET is_admin = 1 WHERE id = ?", (admin_id,))
-            conn.commit()
-            conn.close()
+            with database.connection() as conn:
+                conn.execute("UPDATE users SET is_admin = 1 WHERE id = ?", (admin_id,))
             admin_user = database.get_user_by_identifier("admin")
 
         if admin_user and verify_password(
             request.password, admin_user["password_hash"]
         ):
             if not admin_user["is_admin"]:
-                conn = database.get_connection()
-                cursor = conn.cursor()
-                cursor.execute(
-                    "UPDATE users SET is_admin = 1 WHERE id = ?", (admin_user["id"],)
-                )
-                conn.commit()
-                conn.close()
-
-            access_token = create_access_token(data={"sub": admin_user["id"]})
+                with database.connection() as conn:
+                    conn.execute(
+                        "UPDATE users SET is_admin = 1 WHERE id = ?",
+                        (admin_user["id"],),
+                    )
+
+            access_token = create_access_token(
+                data={"sub": admin_user["id"]}, role="admin"
+            )
             return {
                 "success": True,
                 "data": {
@@ -400,38 +567,85 @@ def admin_login(request: AdminLoginRequest):
 
 
 @app.get("/api/v1/admin/users")
-def get_all_users(admin_id: int = Depends(get_current_admin)):
-    conn = database.get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT u.*, q.free_generations, q.used_generations, q.subscription_level
-        FROM users u
-        LEFT JOIN user_quotas q ON u.id = q.user_id
-        ORDER BY u.created_at DESC
-        LIMIT 100
-    """)
-    rows = cursor.fetchall()
-    columns = [desc[0] for desc in cursor.description]
-    users = [dict(zip(columns, row)) for row in rows]
-    conn.close()
+def get_all_users(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    admin_id: int = Depends(get_current_admin),
+    snapshot: SnapshotReplica = Depends(get_admin_snapshot),
+):
+    try:
+        users, next_cursor = snapshot.reader().list_users_page(limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    return {"success": True, "data": users, "count": len(users)}
+    return {
+        "success": True,
+        "data": users,
+        "count": len(users),
+        "next_cursor": next_cursor,
+        "snapshot": snapshot.freshness(),
+    }
 
 
-@app.post("/api/v1/admin/users/{user_id}/block")
-def block_user(user_id: int, admin_id: int = Depends(get_current_admin)):
-    conn = database.get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM users WHERE id = ?", (user_id,))
-    if not cursor.fetchone():
-        conn.close()
-        raise HTTPException(status_code=404, detail="用户不存在")
+@app.get("/api/v1/admin/users/export")
+def export_users(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    admin_id: int = Depends(get_current_admin),
+    snapshot: SnapshotReplica = Depends(get_admin_snapshot),
+):
+    """流式导出全部用户（逐批读取，内存占用与用户数无关）"""
+    database = snapshot.reader()
+    if format == "csv":
+
+        def rows():
+            buffer = io.StringIO()
+            writer = None
+            for user in database.iter_users():
+                if writer is None:
+                    writer = csv.DictWriter(buffer, fieldnames=list(user))
+                    writer.writeheader()
+                writer.writerow(user)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        media_type = "text/csv; charset=utf-8"
+    else:
+
+        def rows():
+            for user in database.iter_users():
+                yield json.dumps(user, ensure_ascii=False) + "\n"
+
+        media_type = "application/x-ndjson"
 
-    cursor.execute(
-        "UPDATE users SET password_hash = 'BLOCKED' WHERE id = ?", (user_id,)
+    return StreamingResponse(
+        rows(),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f"attachment; filename=users.{format}",
+            "X-Snapshot-As-Of": snapshot.freshness()["as_of"],
+        },
     )
-    conn.commit()
-    conn.close()
+
+
+@app.post("/api/v1/admin/users/{user_id}/block")
+def block_user(
+    user_id: int,
+    admin_id: int = Depends(get_current_admin),
+    database: Database = Depends(get_db),
+):
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM users WHERE id = ?", (user_id,))
+        if not cursor.fetchone():
+            raise HTTPException(status_code=404, detail="用户不存在")
+
+        cursor.execute(
+            "UPDATE users SET password_hash = 'BLOCKED' WHERE id = ?", (user_id,)
+        )
+
+    # 已签发的 token 随之失效：本进程立即生效，其他 worker 在下次刷新吊销表时生效
+    revocations.add(user_id, database.revoke_user_tokens(user_id, reason="blocked"))
 
     return {"success": True, "message": "用户已封禁"}
 
@@ -441,145 +655,245 @@ def update_user_quota(
     user_id: int,
     request: AdminUpdateUserQuotaRequest,
     admin_id: int = Depends(get_current_admin),
+    database: Database = Depends(get_db),
 ):
-    conn = database.get_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT * FROM user_quotas WHERE user_id = ?", (user_id,))
-    if not cursor.fetchone():
-        conn.close()
-        raise HTTPException(status_code=404, detail="用户配额不存在")
-
-    updates = []
-    params = []
-    if request.free_generations is not None:
-        updates.append("free_generations = ?")
-        params.append(request.free_generations)
-    if request.subscription_level is not None:
-        updates.append("subscription_level = ?")
-        params.append(request.subscription_level)
-    if request.subscription_expiry is not None:
-        updates.append("subscription_expiry = ?")
-        params.append(request.subscription_expiry)
-
-    if updates:
-        params.append(user_id)
-        cursor.execute(
-            f"UPDATE user_quotas SET {', '.join(updates)} WHERE user_id = ?", params
-        )
-        conn.commit()
+    with database.connection() as conn:
+        cursor = conn.cursor()
 
-    conn.close()
+        cursor.execute("SELECT * FROM user_quotas WHERE user_id = ?", (user_id,))
+        if not cursor.fetchone():
+            raise HTTPException(status_code=404, detail="用户配额不存在")
+
+        updates = []
+        params = []
+        if request.free_generations is not None:
+            updates.append("free_generations = ?")
+            params.append(request.free_generations)
+        if request.subscription_level is not None:
+            updates.append("subscription_level = ?")
+            params.append(request.subscription_level)
+        if request.subscription_expiry is not None:
+            updates.append("subscription_expiry = ?")
+            params.append(request.subscription_expiry)
+
+        if updates:
+            params.append(user_id)
+            cursor.execute(
+                f"UPDATE user_quotas SET {', '.join(updates)} WHERE user_id = ?",
+                params,
+            )
 
     return {"success": True, "message": "用户配额已更新"}
 
 
+def get_provider_keys() -> ProviderKeyPool:
+    return provider_keys
+
+
 @app.get("/api/v1/admin/api-keys")
-def get_all_api_keys(admin_id: int = Depends(get_current_admin)):
-    return {"success": True, "data": [], "message": "API密钥管理功能待实现"}
+def get_all_api_keys(
+    admin_id: int = Depends(get_current_admin),
+    keys: ProviderKeyPool = Depends(get_provider_keys),
+):
+    """密钥列表（不含密钥内容）；runtime 为本进程中的熔断状态和剩余速率额度"""
+    api_keys = keys.list_keys()
+    return {"success": True, "data": api_keys, "count": len(api_keys)}
 
 
 @app.post("/api/v1/admin/api-keys")
 def create_api_key(
-    request: AdminCreateAPIKeyRequest, admin_id: int = Depends(get_current_admin)
+    request: AdminCreateAPIKeyRequest,
+    admin_id: int = Depends(get_current_admin),
+    keys: ProviderKeyPool = Depends(get_provider_keys),
 ):
-    return {"success": True, "message": "API密钥创建功能待实现"}
+    try:
+        key_id = keys.create(
+            provider=request.provider,
+            key_name=request.key_name,
+            secret=request.api_key,
+            created_by=admin_id,
+            priority=request.priority,
+            monthly_limit=request.monthly_limit,
+            rate_limit_per_minute=request.rate_limit_per_minute,
+            is_active=request.is_active,
+        )
+    except DuplicateKey as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    api_key = next(k for k in keys.list_keys() if k["id"] == key_id)
+    return {"success": True, "data": api_key, "message": "API密钥已添加"}
 
 
 @app.post("/api/v1/admin/api-keys/{key_id}/rotate")
-def rotate_api_key(key_id: int, admin_id: int = Depends(get_current_admin)):
-    return {"success": True, "message": "API密钥轮换功能待实现"}
+def rotate_api_key(
+    key_id: int,
+    request: AdminRotateAPIKeyRequest,
+    admin_id: int = Depends(get_current_admin),
+    keys: ProviderKeyPool = Depends(get_provider_keys),
+):
+    """用新密钥替换旧密钥，各 worker 在 API_KEY_RELOAD_INTERVAL 秒内生效，无需重启"""
+    try:
+        new_key_id = keys.rotate(key_id, request.api_key, admin_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="API密钥不存在")
+    except (DuplicateKey, KeyAlreadyRotated) as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    return {
+        "success": True,
+        "message": "API KEY已轮换",
+        "key_id": key_id,
+        "new_key_id": new_key_id,
+        "replaced_by": new_key_id,
+    }
+
+
+def stat_date_range(
+    start_date: Optional[date], end_date: Optional[date]
+) -> tuple[str, str]:
+    """统计查询的日期范围（UTC），默认最近30天"""
+    end = end_date or datetime.utcnow().date()
+    start = start_date or end - timedelta(days=29)
+    if start > end:
+        raise HTTPException(status_code=400, detail="开始日期不能晚于结束日期")
+    return start.isoformat(), end.isoformat()
 
 
 @app.get("/api/v1/admin/statistics/daily")
 def get_daily_statistics(
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
     admin_id: int = Depends(get_current_admin),
+    snapshot: SnapshotReplica = Depends(get_admin_snapshot),
 ):
-    return {"success": True, "data": [], "message": "每日统计功能待实现"}
+    start, end = stat_date_range(start_date, end_date)
+    return {
+        "success": True,
+        "data": snapshot.reader().get_daily_statistics(start, end),
+        "snapshot": snapshot.freshness(),
+    }
 
 
 @app.get("/api/v1/admin/statistics/revenue")
 def get_revenue_statistics(
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
     admin_id: int = Depends(get_current_admin),
+    snapshot: SnapshotReplica = Depends(get_admin_snapshot),
 ):
+    start, end = stat_date_range(start_date, end_date)
+    days = snapshot.reader().get_daily_statistics(start, end)
     return {
         "success": True,
-        "data": {"total_revenue_cents": 0},
-        "message": "收入统计功能待实现",
+        "data": {
+            "start_date": start,
+            "end_date": end,
+            "total_revenue_cents": sum(d["total_revenue_cents"] for d in days),
+            "daily": [
+                {"date": d["stat_date"], "revenue_cents": d["total_revenue_cents"]}
+                for d in days
+            ],
+        },
+        "snapshot": snapshot.freshness(),
     }
 
 
 @app.get("/api/v1/admin/statistics")
-def get_all_statistics(admin_id: int = Depends(get_current_admin)):
-    conn = database.get_connection()
-    cursor = conn.cursor()
+def get_all_statistics(
+    admin_id: int = Depends(get_current_admin),
+    snapshot: SnapshotReplica = Depends(get_admin_snapshot),
+):
+    # 全部来自 daily_statistics 汇总表，耗时与用户表、配额表大小无关
+    database = snapshot.reader()
+    today = datetime.utcnow().date()
+    totals = database.sum_daily_statistics()
+    week = database.sum_daily_statistics((today - timedelta(days=6)).isoformat())
+    today_stats = database.sum_daily_statistics(today.isoformat(), today.isoformat())
 
-    cursor.execute("SELECT COUNT(*) FROM users")
-    total_users = cursor.fetchone()[0]
+    return {
+        "success": True,
+        "data": {
+            "total_users": totals["new_users"],
+            "new_users_week": week["new_users"],
+            "total_generations": totals["image_generations"] + totals["video_frames"],
+            "active_users_today": today_stats["active_users"],
+        },
+        "snapshot": snapshot.freshness(),
+    }
 
-    cursor.execute(
-        "SELECT COUNT(*) FROM users WHERE created_at >= date('now', '-7 days')"
-    )
-    new_users_week = cursor.fetchone()[0]
 
-    cursor.execute("SELECT SUM(used_generations) FROM user_quotas")
-    total_generations = cursor.fetchone()[0] or 0
+@app.get("/api/v1/admin/maintenance/sweeper")
+def get_sweeper_metrics(admin_id: int = Depends(get_current_admin)):
+    return {"success": True, "data": sweeper.metrics()}
+
 
-    conn.close()
+@app.get("/api/v1/admin/maintenance/jobs")
+def get_job_metrics(admin_id: int = Depends(get_current_admin)):
+    return {
+        "success": True,
+        "data": {
+            **job_workers.metrics(),
+            "siliconflow": siliconflow.metrics(),
+            "provider_keys": provider_keys.metrics(),
+        },
+    }
 
+
+@app.get("/api/v1/admin/maintenance/auth")
+def get_auth_metrics(admin_id: int = Depends(get_current_admin)):
     return {
         "success": True,
         "data": {
-            "total_users": total_users,
-            "new_users_week": new_users_week,
-            "total_generations": total_generations,
-            "active_users_today": 0,
+            "token_cache": token_cache.metrics(),
+            "revocations": revocations.metrics(),
+            "password_hasher": password_hasher.metrics(),
+            "rate_limit": rate_limit_metrics(RATE_LIMIT_RULES),
         },
     }
 
 
 @app.get("/api/v1/admin/packages")
-def get_all_packages(admin_id: int = Depends(get_current_admin)):
-    conn = database.get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT * FROM subscription_plans WHERE is_active = 1 ORDER BY price_cents"
-    )
-    rows = cursor.fetchall()
+def get_all_packages(
+    admin_id: int = Depends(get_current_admin),
+    snapshot: SnapshotReplica = Depends(get_admin_snapshot),
+):
+    with snapshot.reader().connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT * FROM subscription_plans WHERE is_active = 1 ORDER BY price_cents"
+        )
+        rows = cursor.fetchall()
     columns = [desc[0] for desc in cursor.description]
     packages = [dict(zip(columns, row)) for row in rows]
-    conn.close()
 
-    return {"success": True, "data": packages}
+    return {"success": True, "data": packages, "snapshot": snapshot.freshness()}
 
 
 @app.post("/api/v1/admin/packages")
 def create_package(
-    request: AdminCreatePackageRequest, admin_id: int = Depends(get_current_admin)
+    request: AdminCreatePackageRequest,
+    admin_id: int = Depends(get_current_admin),
+    database: Database = Depends(get_db),
 ):
-    conn = database.get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        INSERT INTO subscription_plans (name, price_cents, duration_days, free_generations, custom_pose_limit, features)
-        VALUES (?, ?, ?, ?, ?, ?)
-        """,
-        (
-            request.name,
-            request.price_cents,
-            request.duration_days,
-            request.free_generations,
-            request.custom_pose_limit,
-            request.features,
-        ),
-    )
-    package_id = cursor.lastrowid if cursor.lastrowid is not None else 0
-    conn.commit()
-    conn.close()
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT INTO subscription_plans (name, price_cents, duration_days, free_generations, custom_pose_limit, features)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (
+                request.name,
+                request.price_cents,
+                request.duration_days,
+                request.free_generations,
+                request.custom_pose_limit,
+                request.features,
+            ),
+        )
+        package_id = cursor.lastrowid if cursor.lastrowid is not None else 0
 
     return {
         "success": True,
@@ -589,4 +903,10 @@ def create_package(
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # 签名密钥在 worker 间共享，可以按核数启动多个 worker
+    uvicorn.run(
+        "api_server:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("API_WORKERS", "1")),
+    )
@@ -3,13 +3,16 @@
 只包含认证和姿势管理相关的API
 """
 
+import asyncio
 import os
 import random
 import re
 import uvicorn
+from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import Dict, Any, Optional
 from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, EmailStr, constr
@@ -19,13 +22,20 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # 导入自定义模块
-from database import Database, db
+from database import IdentifierTaken, db
+from async_database import AsyncDatabase, async_db, get_async_db
+from password_hasher import password_hasher
+from rate_limit import RateLimitMiddleware, RateLimitRule, rate_limit_metrics
+from sweeper import sweeper
 from auth import (
     create_access_token,
-    verify_password,
-    get_password_hash,
+    verify_password_async,
+    get_password_hash_async,
     validate_password_strength,
     get_current_user,
+    get_current_admin,
+    revocations,
+    token_cache,
 )
 from sms_service import SMSService
 from email_service import EmailService
@@ -36,8 +46,35 @@ OUTPUT_DIR = "outputs"
 # Ensure directories exist
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-app = FastAPI()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 进程池要在其他后台线程之前创建
+    password_hasher.start()
+    db.start_background_tasks()
+    revocations.start()
+    sweeper.start()
+    yield
+    sweeper.stop()
+    async_db.close()
+    revocations.stop()
+    db.stop_background_tasks()
+    password_hasher.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+RATE_LIMIT_RULES = [
+    RateLimitRule("send_code", ["/auth/send-code"], 1, 60, "body:identifier"),
+    RateLimitRule("send_code_ip", ["/auth/send-code"], 20, 60),
+    RateLimitRule("login", ["/auth/login"], 5, 60, "body:identifier"),
+    RateLimitRule("auth_ip", ["/auth/login", "/auth/register"], 20, 60),
+]
+
+# 先于 CORS 注册，429 响应同样带上 CORS 头
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware, rules=RATE_LIMIT_RULES)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -116,7 +153,9 @@ def validate_user_requirements(user: UserRegister) -> tuple[bool, str]:
 
 
 @app.post("/auth/send-code")
-async def send_verification_code(request: SendVerificationCode):
+async def send_verification_code(
+    request: SendVerificationCode, db: AsyncDatabase = Depends(get_async_db)
+):
     """发送验证码（注册或登录）"""
     identifier = request.identifier
     code_type = request.code_type
@@ -129,53 +168,29 @@ async def send_verification_code(request: SendVerificationCode):
         if "@" not in identifier or "." not in identifier:
             raise HTTPException(status_code=400, detail="邮箱格式不正确")
 
-    # 检查频率限制（1分钟内只能发送1次）
-    conn = db.get_connection()
-    cursor = conn.cursor()
-
-    if is_phone:
-        cursor.execute(
-            """
-            SELECT COUNT(*) FROM verification_codes
-            WHERE identifier = ? AND created_at > datetime("now", "-1 minute")
-        """,
-            (identifier,),
-        )
-    else:
-        cursor.execute(
-            """
-            SELECT COUNT(*) FROM verification_codes
-            WHERE identifier = ? AND created_at > datetime("now", "-1 minute")
-        """,
-            (identifier,),
-        )
-
-    count_result = cursor.fetchone()
-    count = count_result[0] if count_result else 0
-    conn.close()
-
-    if count >= 1:
-        raise HTTPException(status_code=429, detail="发送过于频繁，请1分钟后再试")
+    # 限流中间件关闭时按数据库记录检查频率（1分钟内只能发送1次）
+    if not RATE_LIMIT_ENABLED:
+        count = await db.count_recent_verification_codes(identifier, seconds=60)
+        if count >= 1:
+            raise HTTPException(status_code=429, detail="发送过于频繁，请1分钟后再试")
 
     # 生成6位验证码
     code = str(random.randint(100000, 999999))
 
     # 保存验证码（5分钟有效）
-    db.create_verification_code(identifier, code, code_type, expires_minutes=5)
+    await db.create_verification_code(identifier, code, code_type, expires_minutes=5)
 
-    # 发送验证码
+    # 发送验证码（短信/邮件接口是同步HTTP调用，放到线程池中执行）
     if is_phone:
-        sms_service = SMSService()
-        sms_service.send_code(identifier, code)
+        await run_in_threadpool(sms_service.send_code, identifier, code)
         return {"message": "验证码已发送到手机"}
     else:
-        email_service = EmailService()
-        email_service.send_verification_code(identifier, code)
+        await run_in_threadpool(email_service.send_verification_code, identifier, code)
         return {"message": "验证码已发送到邮箱"}
 
 
 @app.post("/auth/register")
-async def register(request: UserRegister):
+async def register(request: UserRegister, db: AsyncDatabase = Depends(get_async_db)):
     """用户注册"""
     # 验证注册要求
     is_valid, reason = validate_user_requirements(request)
@@ -184,28 +199,33 @@ async def register(request: UserRegister):
 
     # 验证验证码
     identifier = request.phone_number or request.email
-    is_code_valid = db.verify_code(identifier, request.verification_code, "register")
+    is_code_valid = await db.verify_code(
+        identifier, request.verification_code, "register"
+    )
 
     if not is_code_valid:
         raise HTTPException(status_code=400, detail="验证码错误或已过期")
 
     # 检查是否已注册
-    existing_user = db.get_user_by_identifier(identifier)
+    existing_user = await db.get_user_by_identifier(identifier)
     if existing_user:
         raise HTTPException(status_code=400, detail="该账号已注册")
 
     # 创建用户
-    password_hash = get_password_hash(request.password)
-    user_id = db.create_user(
-        phone_number=request.phone_number,
-        email=request.email,
-        password_hash=password_hash,
-        country_code=request.country_code,
-        region=request.region,
-    )
+    password_hash = await get_password_hash_async(request.password)
+    try:
+        user_id = await db.create_user(
+            phone_number=request.phone_number,
+            email=request.email,
+            password_hash=password_hash,
+            country_code=request.country_code,
+            region=request.region,
+        )
+    except IdentifierTaken as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     # 创建配额（5次免费）
-    db.create_user_quota(user_id, free_generations=5)
+    await db.create_user_quota(user_id, free_generations=5)
 
     # 生成token
     access_token = create_access_token(data={"sub": user_id})
@@ -222,25 +242,25 @@ async def register(request: UserRegister):
 
 
 @app.post("/auth/login")
-async def login(request: UserLogin):
+async def login(request: UserLogin, db: AsyncDatabase = Depends(get_async_db)):
     """用户登录"""
     # 检查用户是否存在
-    db_user = db.get_user_by_identifier(request.identifier)
+    db_user = await db.get_user_by_identifier(request.identifier)
     if not db_user:
         raise HTTPException(status_code=401, detail="账号或密码错误")
 
     # 验证密码
-    if not verify_password(request.password, db_user["password_hash"]):
+    if not await verify_password_async(request.password, db_user["password_hash"]):
         raise HTTPException(status_code=401, detail="账号或密码错误")
 
     # 更新登录时间
-    db.update_last_login(db_user["id"])
+    await db.update_last_login(db_user["id"])
 
     # 生成token
     access_token = create_access_token(data={"sub": db_user["id"]})
 
     # 获取配额信息
-    quota = db.get_user_quota(db_user["id"])
+    quota = await db.get_user_quota(db_user["id"])
 
     return {
         "access_token": access_token,
@@ -251,25 +271,19 @@ async def login(request: UserLogin):
 
 
 @app.get("/auth/me")
-async def get_current_user_info(user_id: int = Depends(get_current_user)):
+async def get_current_user_info(
+    user_id: int = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_async_db),
+):
     """获取当前用户信息"""
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, phone_number, email, region FROM users WHERE id = ?", (user_id,)
+    user, quota = await asyncio.gather(
+        db.get_user_by_id(user_id), db.get_user_quota(user_id)
     )
-    user = cursor.fetchone()
-
-    # 获取配额
-    quota = db.get_user_quota(user_id)
-
-    conn.close()
 
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
 
-    columns = [desc[0] for desc in cursor.description]
-    user_dict = dict(zip(columns, user))
+    user_dict = {k: user[k] for k in ("id", "phone_number", "email", "region")}
     user_dict["quota"] = quota
 
     return user_dict
@@ -279,22 +293,23 @@ async def get_current_user_info(user_id: int = Depends(get_current_user)):
 
 
 @app.get("/poses")
-async def get_poses(category: Optional[str] = None, active_only: bool = True):
+async def get_poses(
+    category: Optional[str] = None,
+    active_only: bool = True,
+    db: AsyncDatabase = Depends(get_async_db),
+):
     """获取所有姿势"""
+    poses = await db.get_all_system_poses(active_only)
     if category:
-        poses = [
-            p for p in db.get_all_system_poses(active_only) if p["category"] == category
-        ]
-    else:
-        poses = db.get_all_system_poses(active_only)
+        poses = [p for p in poses if p["category"] == category]
 
     return {"poses": poses}
 
 
 @app.post("/poses/{pose_id}/increment")
-async def increment_pose_usage(pose_id: int):
+async def increment_pose_usage(pose_id: int, db: AsyncDatabase = Depends(get_async_db)):
     """增加姿势使用次数"""
-    db.increment_pose_usage(pose_id)
+    await db.increment_pose_usage(pose_id)
     return {"success": True, "message": "使用次数已增加"}
 
 
@@ -307,6 +322,17 @@ async def health_check():
     return {"status": "ok", "service": "angle-photo-api"}
 
 
+@app.get("/admin/metrics")
+async def get_metrics(admin_id: int = Depends(get_current_admin)):
+    """后台任务、密码哈希、token缓存和限流的运行指标（仅管理员）"""
+    return {
+        "sweeper": sweeper.metrics(),
+        "password_hasher": password_hasher.metrics(),
+        "token_cache": token_cache.metrics(),
+        "rate_limit": rate_limit_metrics(RATE_LIMIT_RULES),
+    }
+
+
 # ========== 启动 ==========
 
 # 初始化服务
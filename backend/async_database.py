@@ -0,0 +1,115 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from database import Database, db
+
+
+def _offload(method: Callable) -> Callable:
+    """把 Database 的同步方法包装成在线程池中执行的协程方法"""
+
+    @functools.wraps(method)
+    async def wrapper(self: "AsyncDatabase", *args, **kwargs):
+        return await self.run(method, self.database, *args, **kwargs)
+
+    return wrapper
+
+
+class AsyncDatabase:
+    """
+    Database 的异步版本，数据访问方法与 Database 一一对应
+
+    连接、表结构初始化和后台任务的管理方法不在此列；iter_users 是逐批借用连接的
+    生成器，异步代码请用 list_users_page 按游标分页。
+
+    所有SQLite调用都在专用的有界线程池中执行，不会阻塞事件循环。
+    线程数默认等于连接池大小，线程不会因等待连接而堆积；
+    max_workers=0 时直接在事件循环中同步执行（仅用于基准对比）。
+    """
+
+    def __init__(self, database: Database, max_workers: int | None = None):
+        if max_workers is None:
+            max_workers = int(
+                os.getenv("DATABASE_EXECUTOR_WORKERS", database.pool.max_size or 8)
+            )
+        self.database = database
+        self.max_workers = max_workers
+        self.executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """在数据库线程池中执行任意同步函数（如使用 database.connection() 的临时查询）"""
+        if self.max_workers <= 0:
+            return fn(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor(), functools.partial(fn, *args, **kwargs)
+        )
+
+    def close(self):
+        """关闭线程池（由应用的 lifespan 调用）；之后再有调用时重新创建"""
+        with self._lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="sqlite"
+                )
+            return self.executor
+
+    # 用户相关方法
+    create_user = _offload(Database.create_user)
+    get_user_by_identifier = _offload(Database.get_user_by_identifier)
+    get_user_by_id = _offload(Database.get_user_by_id)
+    list_users_page = _offload(Database.list_users_page)
+    update_last_login = _offload(Database.update_last_login)
+    revoke_user_tokens = _offload(Database.revoke_user_tokens)
+    get_token_revocations = _offload(Database.get_token_revocations)
+
+    # 配额相关方法
+    create_user_quota = _offload(Database.create_user_quota)
+    get_user_quota = _offload(Database.get_user_quota)
+    increment_usage = _offload(Database.increment_usage)
+    reserve_quota = _offload(Database.reserve_quota)
+    refund_quota = _offload(Database.refund_quota)
+
+    # 订单与统计相关方法
+    mark_order_paid = _offload(Database.mark_order_paid)
+    get_daily_statistics = _offload(Database.get_daily_statistics)
+    sum_daily_statistics = _offload(Database.sum_daily_statistics)
+
+    # 验证码相关方法
+    create_verification_code = _offload(Database.create_verification_code)
+    count_recent_verification_codes = _offload(Database.count_recent_verification_codes)
+    verify_code = _offload(Database.verify_code)
+
+    # 系统姿势相关方法
+    get_all_system_poses = _offload(Database.get_all_system_poses)
+    increment_pose_usage = _offload(Database.increment_pose_usage)
+    add_pose_usage_counts = _offload(Database.add_pose_usage_counts)
+
+    # 源图片存储
+    store_source_image = _offload(Database.store_source_image)
+
+    # 用户姿势相关方法
+    create_user_pose = _offload(Database.create_user_pose)
+    get_user_poses = _offload(Database.get_user_poses)
+
+    # 生成记录相关方法
+    create_generation = _offload(Database.create_generation)
+    get_user_generations = _offload(Database.get_user_generations)
+
+
+async_db = AsyncDatabase(db)
+
+
+async def get_async_db() -> AsyncDatabase:
+    """FastAPI依赖：返回进程内共享的 AsyncDatabase 实例"""
+    return async_db
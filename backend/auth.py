@@ -1,28 +1,66 @@
+import os
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-import secrets
 
-# 配置
-SECRET_KEY = secrets.token_urlsafe(32)  # 生产环境应该使用环境变量
+from database import db
+from password_hasher import HasherBusy, password_hasher
+from revocation import RevocationList
+from signing_keys import KeyRing, UnknownKey
+from token_cache import TokenCache
+
+# 配置：签名密钥在所有 worker 间共享，见 signing_keys.py
+key_ring = KeyRing()
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7天
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+revocations = RevocationList(db, retention=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+token_cache = TokenCache(int(os.getenv("TOKEN_CACHE_SIZE", "10000")))
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 
+def _busy(e: HasherBusy) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(e),
+        headers={"Retry-After": "1"},
+    )
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """验证密码"""
-    return pwd_context.verify(plain_password, hashed_password)
+    """验证密码（在密码哈希进程池中执行，繁忙时返回503）"""
+    try:
+        return password_hasher.verify(plain_password, hashed_password)
+    except HasherBusy as e:
+        raise _busy(e)
 
 
 def get_password_hash(password: str) -> str:
-    """加密密码"""
-    return pwd_context.hash(password)
+    """加密密码（在密码哈希进程池中执行，繁忙时返回503）"""
+    try:
+        return password_hasher.hash(password)
+    except HasherBusy as e:
+        raise _busy(e)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password 的异步版本，等待期间不占用线程"""
+    try:
+        return await password_hasher.verify_async(plain_password, hashed_password)
+    except HasherBusy as e:
+        raise _busy(e)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash 的异步版本，等待期间不占用线程"""
+    try:
+        return await password_hasher.hash_async(password)
+    except HasherBusy as e:
+        raise _busy(e)
 
 
 def validate_password_strength(password: str) -> tuple[bool, str]:
@@ -42,26 +80,42 @@ def validate_password_strength(password: str) -> tuple[bool, str]:
     return True, ""
 
 
-def create_access_token(data: dict) -> str:
-    """创建JWT token"""
+def create_access_token(data: dict, role: str = "user") -> str:
+    """创建JWT token；role 写入 token，管理员鉴权不再查库"""
     to_encode = data.copy()
+    # JWT 规定 sub 为字符串，python-jose 校验时会拒绝整数 sub
+    if "sub" in to_encode:
+        to_encode["sub"] = str(to_encode["sub"])
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # iat 用于和吊销时间比较
+    to_encode.update({"exp": expire, "iat": int(time.time()), "role": role})
+    kid, secret = key_ring.signing_key()
+    encoded_jwt = jwt.encode(
+        to_encode, secret, algorithm=ALGORITHM, headers={"kid": kid}
+    )
     return encoded_jwt
 
 
 def verify_token(token: str) -> Optional[dict]:
-    """验证JWT token"""
+    """验证JWT token；验证通过的 token 缓存到 exp 为止"""
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is None:
+            return None
+        payload = jwt.decode(
+            token, key_ring.verification_key(kid), algorithms=[ALGORITHM]
+        )
+        token_cache.put(token, payload, payload.get("exp", 0))
         return payload
-    except JWTError:
+    except (JWTError, UnknownKey):
         return None
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> int:
-    """获取当前用户ID"""
+async def get_token_payload(token: str = Depends(oauth2_scheme)) -> dict:
+    """校验 token 并检查吊销表，返回 payload（sub 已转换为整数）"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="无法验证凭证",
@@ -72,26 +126,26 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> int:
     if payload is None:
         raise credentials_exception
 
-    user_id: int = payload.get("sub")
-    if user_id is None:
+    try:
+        payload["sub"] = int(payload["sub"])
+        issued_at = int(payload.get("iat", 0))
+    except (KeyError, TypeError, ValueError):
         raise credentials_exception
 
-    return user_id
+    if revocations.is_revoked(payload["sub"], issued_at):
+        raise credentials_exception
 
+    return payload
 
-async def get_current_admin(user_id: int = Depends(get_current_user)) -> int:
-    """获取当前管理员ID"""
-    from database import Database
 
-    db = Database()
+async def get_current_user(payload: dict = Depends(get_token_payload)) -> int:
+    """获取当前用户ID"""
+    return payload["sub"]
 
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT is_admin FROM users WHERE id = ?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
 
-    if not row or not row[0]:
+async def get_current_admin(payload: dict = Depends(get_token_payload)) -> int:
+    """获取当前管理员ID（依据 token 中的 role，不查库）"""
+    if payload.get("role") != "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="权限不足")
 
-    return user_id
+    return payload["sub"]
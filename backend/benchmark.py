@@ -0,0 +1,1034 @@
+"""
+后端性能基准脚本
+
+使用方法：
+    python benchmark.py pool        # 连接池前后对比（请求/秒）
+    python benchmark.py wal         # 回滚日志 vs WAL配置下的并发读写吞吐
+    python benchmark.py admin       # 管理员鉴权的每请求开销（每次建库 vs 共享实例 vs token角色声明）
+    python benchmark.py async       # api_simple 并发负载下的尾延迟（同步调用 vs 异步数据层）
+    python benchmark.py quota       # 同一用户大量并发扣配额（先查后扣 vs reserve_quota）
+    python benchmark.py pose-usage  # 姿势使用次数：逐次UPDATE vs 写缓冲合并
+    python benchmark.py snapshot    # 刷新管理后台快照期间的写入延迟（一次性复制 vs 分批复制）
+    python benchmark.py login       # 百万用户下按手机号/邮箱查用户（OR查询 vs 标识表主键查找）
+    python benchmark.py expiry      # 过期/频率限制判断（TEXT时间 vs 整数时间戳）
+    python benchmark.py password    # 登录密码校验吞吐（请求线程内 vs 不同大小的进程池）
+    python benchmark.py token-cache # 每请求鉴权开销（每次解码校验JWT vs 已验证token缓存）
+    python benchmark.py rate-limit  # 限流中间件每请求开销（无限流 vs 内存令牌桶 vs 共享文件令牌桶）
+    python benchmark.py jobs        # 任务队列吞吐（入队 / 多线程领取+完成 / worker池端到端）
+    python benchmark.py video-poll  # 500个并发视频任务的状态查询次数（每任务每3秒 vs 集中调度+学习耗时），加速模拟
+    python benchmark.py download    # 并发下载视频的内存峰值（整体读入内存 vs 分块流式写盘），本地HTTP服务
+    python benchmark.py key-pool    # 多把服务商密钥、其中一把故障时的被拒调用数（轮询 vs 加权密钥池+熔断），模拟时钟
+
+基准数据都写在临时目录中的独立数据库上。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from database import Database
+from identifiers import backfill_user_identifiers
+from migrations import INITIAL_TABLES
+from password_hasher import HasherBusy, PasswordHasher, _hash
+from revocation import RevocationList
+from token_cache import TokenCache
+
+
+def seed_users(database: Database, count: int):
+    """插入测试用户、配额和系统姿势"""
+    with database.connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (phone_number, email, password_hash) VALUES (?, ?, ?)",
+            [(f"138{i:08d}", None, "x") for i in range(count)],
+        )
+        conn.executemany(
+            "INSERT INTO user_quotas (user_id, free_generations) VALUES (?, ?)",
+            [(i + 1, 5) for i in range(count)],
+        )
+        conn.executemany(
+            """
+            INSERT INTO system_poses (id, name, category, azimuth, elevation, distance)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [(str(i), f"pose{i}", "basic", 0.0, 0.0, 1.0) for i in range(8)],
+        )
+        backfill_user_identifiers(conn)
+
+
+def run_threads(threads: int, iterations: int, work) -> float:
+    """用 threads 个线程各执行 iterations 次 work(i)，返回每秒完成次数"""
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(offset: int):
+        barrier.wait()
+        for i in range(iterations):
+            work(offset + i)
+
+    pool = [
+        threading.Thread(target=worker, args=(t * iterations,)) for t in range(threads)
+    ]
+    for t in pool:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return threads * iterations / elapsed
+
+
+def bench_pool(args):
+    users = 1000
+
+    def request(database: Database):
+        # 模拟一次登录 + 姿势浏览请求
+        def work(i: int):
+            user_id = i % users + 1
+            database.get_user_by_identifier(f"138{user_id - 1:08d}")
+            database.get_user_quota(user_id)
+            database.get_all_system_poses()
+
+        return work
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for label, pool_size in (("无连接池", 0), ("连接池", args.pool_size)):
+            database = Database(str(Path(tmp) / f"{label}.db"), pool_size=pool_size)
+            seed_users(database, users)
+            results[label] = run_threads(
+                args.threads, args.iterations, request(database)
+            )
+            database.close()
+
+    for label, rps in results.items():
+        print(f"{label:<8} {rps:10.0f} 请求/秒")
+    print(f"提升: {results['连接池'] / results['无连接池']:.2f}x")
+
+
+def bench_wal(args):
+    users = 1000
+    profiles = {
+        "回滚日志": {"journal_mode": "DELETE", "synchronous": "FULL"},
+        "WAL配置": {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, pragmas in profiles.items():
+            database = Database(
+                str(Path(tmp) / f"{label}.db"),
+                pool_size=args.readers + args.writers,
+                pragmas=pragmas,
+            )
+            seed_users(database, users)
+            counts = {"read": 0, "write": 0}
+            lock = threading.Lock()
+            stop = threading.Event()
+
+            def reader(n: int):
+                done = 0
+                while not stop.is_set():
+                    user_id = (n + done) % users + 1
+                    database.get_all_system_poses()
+                    database.get_user_by_id(user_id)
+                    done += 1
+                with lock:
+                    counts["read"] += done
+
+            def writer(n: int):
+                done = 0
+                while not stop.is_set():
+                    user_id = (n + done) % users + 1
+                    database.increment_usage(user_id)
+                    database.update_last_login(user_id)
+                    done += 1
+                with lock:
+                    counts["write"] += done
+
+            workers = [
+                threading.Thread(target=reader, args=(i,)) for i in range(args.readers)
+            ] + [
+                threading.Thread(target=writer, args=(i,)) for i in range(args.writers)
+            ]
+            for t in workers:
+                t.start()
+            time.sleep(args.seconds)
+            stop.set()
+            for t in workers:
+                t.join()
+            database.close()
+
+            print(
+                f"{label:<8} 读 {counts['read'] / args.seconds:10.0f} 次/秒"
+                f"  写 {counts['write'] / args.seconds:10.0f} 次/秒"
+            )
+
+
+def bench_admin(args):
+    def is_admin(database: Database, user_id: int) -> bool:
+        with database.connection() as conn:
+            row = conn.execute(
+                "SELECT is_admin FROM users WHERE id = ?", (user_id,)
+            ).fetchone()
+        return bool(row and row[0])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "admin.db")
+
+        start = time.perf_counter()
+        shared = Database(path)
+        startup = time.perf_counter() - start
+        seed_users(shared, 10)
+
+        # 旧实现：每个管理员请求 new Database()，重跑建表DDL后再查 is_admin
+        def legacy():
+            conn = sqlite3.connect(path)
+            for step in INITIAL_TABLES:
+                conn.execute(step)
+            conn.commit()
+            row = conn.execute("SELECT is_admin FROM users WHERE id = ?", (1,))
+            row.fetchone()
+            conn.close()
+
+        # 当前实现：角色在 token 中，每请求只查内存吊销表
+        revoked = RevocationList(shared, retention=86400)
+        revoked.start()
+        payload = {"sub": 1, "iat": int(time.time()), "role": "admin"}
+
+        def claims():
+            if revoked.is_revoked(payload["sub"], payload["iat"]):
+                raise PermissionError
+            return payload["role"] == "admin"
+
+        results = {}
+        for label, work in (
+            ("每次建库", legacy),
+            ("再次构造", lambda: is_admin(Database(path), 1)),
+            ("共享实例", lambda: is_admin(shared, 1)),
+            ("token声明", claims),
+        ):
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                work()
+            results[label] = (time.perf_counter() - start) / args.iterations
+        revoked.stop()
+        shared.close()
+
+    print(f"首次初始化（含迁移）: {startup * 1000:.2f} ms")
+    for label, seconds in results.items():
+        print(f"{label:<8} {seconds * 1e6:10.1f} 微秒/请求")
+
+
+def percentiles(samples: list[float]) -> str:
+    samples = sorted(samples)
+
+    def at(p: float) -> float:
+        return samples[min(int(len(samples) * p), len(samples) - 1)] * 1000
+
+    return (
+        f"p50 {at(0.5):7.2f}ms  p99 {at(0.99):7.2f}ms  max {samples[-1] * 1000:7.2f}ms"
+    )
+
+
+def bench_async(args):
+    import httpx
+
+    import api_simple
+    from async_database import AsyncDatabase, get_async_db
+
+    async def load(database: AsyncDatabase) -> tuple[list[float], list[float]]:
+        api_simple.app.dependency_overrides[get_async_db] = lambda: database
+        transport = httpx.ASGITransport(app=api_simple.app)
+        poses, lag = [], []
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as c:
+
+            async def client():
+                for _ in range(args.requests):
+                    start = time.perf_counter()
+                    # 不存在的分类：查询全表但响应为空，耗时集中在数据库
+                    await c.get("/poses", params={"category": "-"})
+                    poses.append(time.perf_counter() - start)
+
+            async def probe():
+                # 事件循环延迟：sleep 实际耗时超出预期的部分，循环被阻塞时会明显变大
+                while not done.is_set():
+                    start = time.perf_counter()
+                    await asyncio.sleep(0.005)
+                    lag.append(time.perf_counter() - start - 0.005)
+
+            done = asyncio.Event()
+            prober = asyncio.create_task(probe())
+            await asyncio.gather(*(client() for _ in range(args.concurrency)))
+            done.set()
+            await prober
+        api_simple.app.dependency_overrides.clear()
+        return poses, lag
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(str(Path(tmp) / "async.db"), pool_size=args.workers)
+        seed_users(database, 10)
+        # 放大姿势表，让单次查询耗时达到毫秒级
+        with database.connection() as conn:
+            conn.executemany(
+                """
+                INSERT INTO system_poses (id, name, description, category, azimuth, elevation, distance)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (f"bulk{i}", f"pose{i}", "x" * 200, f"c{i % 10}", 0.0, 0.0, 1.0)
+                    for i in range(2000)
+                ],
+            )
+
+        for label, workers in (("同步调用", 0), ("异步数据层", args.workers)):
+            async_database = AsyncDatabase(database, max_workers=workers)
+            poses, lag = asyncio.run(load(async_database))
+            async_database.close()
+            print(f"[{label}]")
+            print(f"  /poses   {percentiles(poses)}")
+            print(f"  循环延迟 {percentiles(lag)}")
+        database.close()
+
+
+def bench_quota(args):
+    users, quota = 4, 200
+
+    # 旧实现：先查剩余次数，再在另一个连接上扣减
+    def check_then_increment(database: Database, user_id: int) -> bool:
+        row = database.get_user_quota(user_id)
+        if row["free_generations"] - row["used_generations"] <= 0:
+            return False
+        database.increment_usage(user_id)
+        return True
+
+    def reserve(database: Database, user_id: int) -> bool:
+        return database.reserve_quota(user_id, 1) is not None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, attempt in (
+            ("先查后扣", check_then_increment),
+            ("原子预扣", reserve),
+        ):
+            database = Database(str(Path(tmp) / f"{label}.db"), pool_size=args.threads)
+            seed_users(database, users)
+            with database.connection() as conn:
+                conn.execute("UPDATE user_quotas SET free_generations = ?", (quota,))
+
+            granted = [0] * args.threads
+
+            def work(i: int):
+                if attempt(database, i % users + 1):
+                    granted[i // args.iterations] += 1
+
+            rps = run_threads(args.threads, args.iterations, work)
+            used = sum(
+                database.get_user_quota(u + 1)["used_generations"] for u in range(users)
+            )
+            database.close()
+            print(
+                f"{label:<8} {rps:8.0f} 次/秒  批准 {sum(granted):5d} 次"
+                f"  实际扣减 {used:5d}  上限 {users * quota}"
+                f"  超发 {max(sum(granted) - users * quota, 0)}"
+            )
+
+
+def bench_pose_usage(args):
+    poses = 8
+    expected = args.threads * args.iterations
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, buffered in (("逐次UPDATE", False), ("写缓冲", True)):
+            database = Database(str(Path(tmp) / f"{label}.db"), pool_size=args.threads)
+            seed_users(database, 1)
+            if buffered:
+                database.pose_usage.start()
+
+            rps = run_threads(
+                args.threads,
+                args.iterations,
+                lambda i: database.increment_pose_usage(str(i % poses)),
+            )
+            database.close()
+
+            total = sum(
+                p["usage_count"]
+                for p in Database(database.db_path).get_all_system_poses()
+            )
+            print(
+                f"{label:<10} {rps:10.0f} 次/秒  写入总数 {total}"
+                f"（期望 {expected}，{'一致' if total == expected else '不一致'}）"
+            )
+
+
+def bench_snapshot(args):
+    from snapshot import SnapshotReplica
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(str(Path(tmp) / "snapshot.db"), pool_size=args.threads)
+        seed_users(database, args.users)
+        with database.connection() as conn:
+            pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        print(f"数据库 {pages} 页，{args.users} 个用户")
+
+        for label, batch in (
+            ("无快照", None),
+            ("一次性复制", -1),
+            ("分批复制", args.pages),
+        ):
+            replica = SnapshotReplica(
+                database, str(Path(tmp) / f"{label}.snapshot.db"), pages=batch or -1
+            )
+            latencies = []
+            refreshes = []
+            stop = threading.Event()
+
+            def refresher():
+                while not stop.is_set():
+                    refreshes.append(replica.refresh())
+
+            thread = threading.Thread(target=refresher) if batch else None
+            if thread:
+                thread.start()
+
+            def work(i: int):
+                start = time.perf_counter()
+                database.update_last_login(i % args.users + 1)
+                latencies.append(time.perf_counter() - start)
+
+            rps = run_threads(args.threads, args.iterations, work)
+            stop.set()
+            if thread:
+                thread.join()
+            line = f"{label:<8} 写 {rps:8.0f} 次/秒  {percentiles(latencies)}"
+            if refreshes:
+                line += f"  快照 {len(refreshes)} 次，平均 {sum(refreshes) / len(refreshes) * 1000:.0f}ms"
+            print(line)
+        database.close()
+
+
+def bench_login(args):
+    import random
+
+    queries = {
+        "OR查询": "SELECT * FROM users WHERE phone_number = ? OR email = ?",
+        "标识表": """
+            SELECT u.* FROM user_identifiers i JOIN users u ON u.id = i.user_id
+            WHERE i.identifier = ?
+        """,
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(str(Path(tmp) / "login.db"))
+        # 一半手机号、一半邮箱注册
+        with database.connection() as conn:
+            conn.executemany(
+                "INSERT INTO users (phone_number, email, password_hash) VALUES (?, ?, 'x')",
+                (
+                    (f"138{i:08d}", None) if i % 2 else (None, f"user{i}@example.com")
+                    for i in range(args.users)
+                ),
+            )
+            backfill_user_identifiers(conn)
+
+        rng = random.Random(0)
+        identifiers = [
+            f"138{i:08d}" if i % 2 else f"user{i}@example.com"
+            for i in (rng.randrange(args.users) for _ in range(args.iterations))
+        ]
+        # 另有一成查询是未注册的账号（注册前的重复检查）
+        identifiers += [f"139{i:08d}" for i in range(args.iterations // 10)]
+
+        with database.connection() as conn:
+            for label, sql in queries.items():
+                plan = conn.execute(
+                    f"EXPLAIN QUERY PLAN {sql}",
+                    (identifiers[0],) * sql.count("?"),
+                ).fetchall()
+                start = time.perf_counter()
+                for identifier in identifiers:
+                    conn.execute(sql, (identifier,) * sql.count("?")).fetchone()
+                per = (time.perf_counter() - start) / len(identifiers)
+                print(f"{label:<6} {per * 1e6:8.1f} 微秒/次  {1 / per:8.0f} 次/秒")
+                for row in plan:
+                    print(f"         {row[3]}")
+        database.close()
+
+
+def bench_expiry(args):
+    queries = {
+        "生成记录": (
+            """
+            SELECT COUNT(*) FROM generations INDEXED BY idx_generations_user_expires
+            WHERE user_id = ? AND expires_at > datetime('now')
+            """,
+            """
+            SELECT COUNT(*) FROM generations
+            WHERE user_id = ? AND expires_ts > ?
+            """,
+        ),
+        "频率限制": (
+            """
+            SELECT COUNT(*) FROM verification_codes INDEXED BY idx_verification_codes_lookup
+            WHERE identifier = ? AND code_type = 'sms'
+            AND created_at > datetime('now', '-1 hour')
+            """,
+            """
+            SELECT COUNT(*) FROM verification_codes
+            WHERE identifier = ? AND created_ts > ?
+            """,
+        ),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(str(Path(tmp) / "expiry.db"))
+        now = int(time.time())
+        # 每个用户/账号有 rows 条记录，时间均匀分布在过去14天，约一半已过期
+        with database.connection() as conn:
+            conn.executemany(
+                """
+                INSERT INTO generations (user_id, created_at, expires_at, created_ts, expires_ts)
+                VALUES (?1, datetime(?2, 'unixepoch'), datetime(?2 + 604800, 'unixepoch'), ?2, ?2 + 604800)
+                """,
+                (
+                    (u, now - 14 * 86400 + i * 14 * 86400 // args.rows)
+                    for u in range(args.users)
+                    for i in range(args.rows)
+                ),
+            )
+            conn.executemany(
+                """
+                INSERT INTO verification_codes
+                (identifier, code, code_type, created_at, expires_at, created_ts, expires_ts)
+                VALUES (?1, '000000', 'sms', datetime(?2, 'unixepoch'),
+                        datetime(?2 + 300, 'unixepoch'), ?2, ?2 + 300)
+                """,
+                (
+                    (f"138{u:08d}", now - 14 * 86400 + i * 14 * 86400 // args.rows)
+                    for u in range(args.users)
+                    for i in range(args.rows)
+                ),
+            )
+            # 迁移006之前的TEXT列索引，用于对比
+            conn.execute(
+                "CREATE INDEX idx_generations_user_expires ON generations(user_id, expires_at)"
+            )
+            conn.execute("""
+                CREATE INDEX idx_verification_codes_lookup
+                ON verification_codes(identifier, code_type, created_at)
+                """)
+
+        with database.connection() as conn:
+            for label, (text_sql, epoch_sql) in queries.items():
+                key = (
+                    (lambda u: u) if label == "生成记录" else (lambda u: f"138{u:08d}")
+                )
+                since = now if label == "生成记录" else now - 3600
+                results = {}
+                for name, sql, extra in (
+                    ("TEXT", text_sql, ()),
+                    ("整数", epoch_sql, (since,)),
+                ):
+                    start = time.perf_counter()
+                    for i in range(args.iterations):
+                        results[name] = conn.execute(
+                            sql, (key(i % args.users), *extra)
+                        ).fetchone()[0]
+                    per = (time.perf_counter() - start) / args.iterations
+                    print(
+                        f"{label} {name:<4} {per * 1e6:8.1f} 微秒/次  命中 {results[name]} 行"
+                    )
+        database.close()
+
+
+def bench_password(args):
+    hashed = _hash("Password123", args.rounds)
+    workers = [0]
+    while workers[-1] < (os.cpu_count() or 1):
+        workers.append(max(1, workers[-1] * 2))
+
+    for count in workers:
+        hasher = PasswordHasher(
+            workers=count, max_pending=args.threads, rounds=args.rounds
+        )
+        hasher.start()
+        rate = run_threads(
+            args.threads, args.logins, lambda i: hasher.verify("Password123", hashed)
+        )
+        hasher.stop()
+        label = "请求线程内" if count == 0 else f"{count} 个进程"
+        print(f"{label:<10} {rate:8.1f} 次校验/秒")
+
+    # 在途上限小于并发数时，多出的请求立即被拒绝而不是排队
+    hasher = PasswordHasher(workers=1, max_pending=2, rounds=args.rounds)
+    hasher.start()
+    rejected = []
+
+    def attempt(i):
+        try:
+            hasher.verify("Password123", hashed)
+        except HasherBusy:
+            rejected.append(i)
+
+    run_threads(args.threads, 1, attempt)
+    hasher.stop()
+    print(f"在途上限 2、并发 {args.threads}：拒绝 {len(rejected)} 个请求")
+
+
+def bench_token_cache(args):
+    import auth
+
+    tokens = [auth.create_access_token(data={"sub": i + 1}) for i in range(args.tokens)]
+
+    async def authenticate():
+        for i in range(args.iterations):
+            payload = await auth.get_token_payload(tokens[i % len(tokens)])
+            assert payload["sub"] == i % len(tokens) + 1
+
+    for label, size in (("无缓存", 0), ("LRU缓存", args.tokens)):
+        auth.token_cache = TokenCache(size)
+        start = time.perf_counter()
+        asyncio.run(authenticate())
+        per = (time.perf_counter() - start) / args.iterations
+        print(f"{label:<8} {per * 1e6:8.1f} 微秒/请求  {auth.token_cache.metrics()}")
+
+
+def bench_rate_limit(args):
+    from rate_limit import FileStore, MemoryStore, RateLimitMiddleware, RateLimitRule
+
+    async def app(scope, receive, send):
+        await receive()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        pass
+
+    def request(i: int, with_body: bool):
+        body = json.dumps({"identifier": f"138{i % args.clients:08d}"}).encode()
+        scope = {
+            "type": "http",
+            "method": "POST",
+            "path": "/login" if with_body else "/ping",
+            "headers": [],
+            "client": (f"10.0.{i % args.clients // 256}.{i % 256}", 1234),
+        }
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return scope, receive
+
+    # 限额足够大，只测开销不触发 429
+    rules = [
+        RateLimitRule("ping", ["/ping"], 10**9, 60),
+        RateLimitRule("login", ["/login"], 10**9, 60, "body:identifier"),
+    ]
+
+    async def run(handler, with_body: bool) -> float:
+        requests = [request(i, with_body) for i in range(args.iterations)]
+        start = time.perf_counter()
+        for scope, receive in requests:
+            await handler(scope, receive, send)
+        return (time.perf_counter() - start) / args.iterations
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, handler in (
+            ("无限流", app),
+            ("内存", RateLimitMiddleware(app, rules, MemoryStore())),
+            ("共享文件", RateLimitMiddleware(app, rules, FileStore(f"{tmp}/rl"))),
+        ):
+            by_ip = asyncio.run(run(handler, False))
+            by_account = asyncio.run(run(handler, True))
+            print(
+                f"{label:<6} 按IP {by_ip * 1e6:6.1f} 微秒/请求  "
+                f"按账号(解析请求体) {by_account * 1e6:6.1f} 微秒/请求"
+            )
+
+
+def bench_jobs(args):
+    from job_queue import JobQueue, JobWorkers
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(str(Path(tmp) / "jobs.db"))
+        seed_users(database, 1)
+        queue = JobQueue(database)
+
+        # 每个任务一个事务，与接口中的用法一致
+        start = time.perf_counter()
+        for i in range(args.jobs):
+            queue.enqueue(1, "image", {"pose_id": i % 8})
+        elapsed = time.perf_counter() - start
+        print(f"入队        {args.jobs / elapsed:8.0f} 个/秒")
+
+        def claim_and_complete(i: int):
+            owner = f"bench:{i % args.threads}"
+            for job in queue.claim(owner, ["image"], lease=60):
+                queue.complete(job["id"], owner, {})
+
+        rate = run_threads(args.threads, args.jobs // args.threads, claim_and_complete)
+        print(f"领取+完成   {rate:8.0f} 个/秒（{args.threads} 线程）")
+
+        for i in range(args.jobs):
+            queue.enqueue(1, "image", {"pose_id": i % 8})
+        done = threading.Event()
+        finished = [0]
+        lock = threading.Lock()
+
+        def handler(job):
+            with lock:
+                finished[0] += 1
+                if finished[0] >= args.jobs:
+                    done.set()
+            return {}
+
+        workers = JobWorkers(queue, {"image": handler}, workers=args.threads)
+        start = time.perf_counter()
+        workers.start()
+        done.wait(120)
+        elapsed = time.perf_counter() - start
+        workers.stop()
+        print(
+            f"worker池    {args.jobs / elapsed:8.0f} 个/秒（{args.threads} 个worker）"
+        )
+        print(queue.counts())
+        database.close()
+
+
+def bench_video_poll(args):
+    import random
+
+    from poll_scheduler import DurationModel, PollScheduler
+    from siliconflow import estimate_seconds
+
+    # 按 scale 倍加速的模拟：1 秒真实时间代表 scale 秒
+    scale = args.scale
+    fallback = estimate_seconds(args.frames, "1280x720")
+    rng = random.Random(args.seed)
+
+    class Provider:
+        def __init__(self):
+            self.finish_at: dict[str, float] = {}
+            self.calls: dict[str, int] = {}
+
+        def submit(self, request_id: str):
+            duration = args.mean * rng.uniform(0.8, 1.2) / scale
+            self.finish_at[request_id] = time.time() + duration
+
+        async def status(self, request_id: str):
+            self.calls[request_id] = self.calls.get(request_id, 0) + 1
+            done = time.time() >= self.finish_at[request_id]
+            return type("Status", (), {"status": "Succeed" if done else "InProgress"})
+
+    async def fixed(provider: Provider, request_id: str) -> float:
+        # 原测试脚本的做法：每个任务一个协程，每3秒查询一次
+        while True:
+            await asyncio.sleep(3 / scale)
+            status = await provider.status(request_id)
+            if status.status == "Succeed":
+                return time.time() - provider.finish_at[request_id]
+
+    async def scheduled(provider, scheduler, request_id: str) -> float:
+        await scheduler.track(request_id, "bench", fallback / scale, time.time())
+        return time.time() - provider.finish_at[request_id]
+
+    async def run(name: str, make_waiter, rounds: int = 1):
+        """任务在 rounds 个平均耗时内陆续提交，同时进行中的任务数接近 jobs"""
+        provider = Provider()
+        total = args.jobs * rounds
+
+        async def job(i: int) -> float:
+            await asyncio.sleep(args.mean / scale * i / args.jobs)
+            provider.submit(f"r{i}")
+            return await make_waiter(provider, f"r{i}")
+
+        lags = await asyncio.gather(*(job(i) for i in range(total)))
+        # 按最先/最后提交的 jobs 个任务分别统计：前者还没有历史数据，后者为稳定状态
+        phases = {name: 0}
+        if rounds > 1:
+            phases = {f"{name}(首轮)": 0, f"{name}(稳定)": total - args.jobs}
+        for label, start in phases.items():
+            polls = sum(
+                provider.calls[f"r{i}"] for i in range(start, start + args.jobs)
+            )
+            lag = sum(lags[start : start + args.jobs]) / args.jobs
+            print(
+                f"{label:<18}{polls:>10}{polls / args.jobs:>10.1f}{lag * scale:>14.1f}"
+            )
+
+    async def main():
+        durations = DurationModel()
+        scheduler = PollScheduler(
+            None, durations, min_interval=2 / scale, max_interval=5 / scale
+        )
+
+        def with_scheduler(provider, request_id):
+            scheduler.status = provider.status
+            return scheduled(provider, scheduler, request_id)
+
+        print(
+            f"约 {args.jobs} 个任务同时进行，实际耗时 {args.mean:.0f}±20% 秒，"
+            f"无历史时的静态估计 {fallback:.0f} 秒"
+        )
+        print(f"{'方式':<18}{'查询次数':>8}{'每任务':>8}{'发现延迟(秒)':>10}")
+        await run("每任务每3秒查询", fixed)
+        await run("调度器", with_scheduler, rounds=3)
+        await scheduler.close()
+
+    asyncio.run(main())
+
+
+def bench_key_pool(args):
+    import itertools
+    import random
+
+    from cryptography.fernet import Fernet
+
+    os.environ.setdefault("API_KEY_ENCRYPTION_KEY", Fernet.generate_key().decode())
+    from provider_keys import NoKeyAvailable, ProviderKeyPool
+
+    # 每把密钥在服务端的每分钟限额；最后一把在 outage 时间段内返回 503
+    limits = [60, 30, 30]
+    outage = (args.duration * 0.2, args.duration * 0.5)
+
+    class Provider:
+        def __init__(self):
+            self.buckets = {}
+
+        def call(self, key: int, now: float) -> int:
+            if key == len(limits) - 1 and outage[0] <= now < outage[1]:
+                return 503
+            rate = limits[key] / 60
+            tokens, at = self.buckets.get(key, (limits[key], now))
+            tokens = min(limits[key], tokens + (now - at) * rate)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                return 429
+            self.buckets[key] = (tokens - 1, now)
+            return 200
+
+    def simulate(name: str, choose, report):
+        provider = Provider()
+        # 两种方式使用相同的请求到达序列
+        rng = random.Random(args.seed)
+        ok = errors = gave_up = 0
+        now = 0.0
+        while now < args.duration:
+            now += rng.expovariate(args.rate / 60)
+            # 与客户端一致：最多 MAX_RETRIES+1 次尝试，每次重新选择密钥
+            for _ in range(4):
+                key = choose(now)
+                if key is None:
+                    gave_up += 1
+                    break
+                code = provider.call(key, now)
+                report(key, code)
+                if code == 200:
+                    ok += 1
+                    break
+                errors += 1
+            else:
+                gave_up += 1
+        total = ok + gave_up
+        print(f"{name:<12}{total:>8}{ok:>8}{errors:>12}{gave_up:>10}")
+
+    print(
+        f"{len(limits)} 把密钥（每分钟 {limits}），平均每分钟 {args.rate:.0f} 个请求，"
+        f"模拟 {args.duration:.0f} 秒，最后一把在 {outage[0]:.0f}~{outage[1]:.0f} 秒故障"
+    )
+    print(f"{'方式':<10}{'请求':>6}{'成功':>6}{'被拒调用':>8}{'失败/推迟':>6}")
+
+    cycle = itertools.cycle(range(len(limits)))
+    simulate("轮询", lambda now: next(cycle), lambda key, code: None)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(str(Path(tmp) / "keys.db"))
+        admin = database.create_user(
+            phone_number=None,
+            email="bench@example.com",
+            password_hash="x",
+            country_code="",
+            region="CN",
+        )
+        clock = {"now": 0.0}
+        pool = ProviderKeyPool(database, clock=lambda: clock["now"])
+        ids = [
+            pool.create(
+                "siliconflow", f"k{i}", f"sk-{i}", admin, rate_limit_per_minute=limit
+            )
+            for i, limit in enumerate(limits)
+        ]
+        index = {key_id: i for i, key_id in enumerate(ids)}
+        keys = {}
+
+        def choose(now):
+            clock["now"] = now
+            try:
+                key = pool.acquire("siliconflow")
+            except NoKeyAvailable:
+                return None
+            keys[index[key.id]] = key
+            return index[key.id]
+
+        simulate("密钥池+熔断", choose, lambda key, code: pool.report(keys[key], code))
+        database.close()
+
+
+def bench_download(args):
+    import hashlib
+    import tracemalloc
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    import httpx
+
+    from siliconflow import SiliconFlowClient
+
+    data = os.urandom(args.size_mb * 1024 * 1024)
+    sha256 = hashlib.sha256(data).hexdigest()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *a):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/video.mp4"
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        async def buffered():
+            async with httpx.AsyncClient() as client:
+
+                async def one(i):
+                    response = await client.get(url)
+                    Path(tmp, f"b{i}.mp4").write_bytes(response.content)
+
+                await asyncio.gather(*(one(i) for i in range(args.concurrency)))
+
+        client = SiliconFlowClient(api_key="bench", max_downloads=args.max_downloads)
+
+        async def streamed():
+            results = await asyncio.gather(
+                *(
+                    client.download(url, Path(tmp, f"s{i}.mp4"), sha256=sha256)
+                    for i in range(args.concurrency)
+                )
+            )
+            assert all(r.sha256 == sha256 for r in results)
+
+        print(f"{args.concurrency} 个并发下载，每个 {args.size_mb} MB")
+        for name, run in (
+            ("整体读入内存", lambda: asyncio.run(buffered())),
+            (f"流式写盘(并发{args.max_downloads})", lambda: client.run(streamed())),
+        ):
+            tracemalloc.start()
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{name:<20} 内存峰值 {peak / 1e6:8.1f} MB  耗时 {elapsed:6.2f} 秒")
+        client.stop()
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="后端性能基准")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=2000)
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    pool = sub.add_parser("pool", help="连接池前后对比")
+    pool.add_argument("--pool-size", type=int, default=8)
+    pool.set_defaults(func=bench_pool)
+
+    wal = sub.add_parser("wal", help="回滚日志 vs WAL 并发读写")
+    wal.add_argument("--readers", type=int, default=6)
+    wal.add_argument("--writers", type=int, default=2)
+    wal.add_argument("--seconds", type=float, default=5.0)
+    wal.set_defaults(func=bench_wal)
+
+    admin = sub.add_parser("admin", help="管理员鉴权每请求开销")
+    admin.set_defaults(func=bench_admin)
+
+    load = sub.add_parser("async", help="api_simple 并发负载尾延迟")
+    load.add_argument("--concurrency", type=int, default=50)
+    load.add_argument("--requests", type=int, default=20)
+    load.add_argument("--workers", type=int, default=4)
+    load.set_defaults(func=bench_async)
+
+    reserve = sub.add_parser("quota", help="并发扣配额")
+    reserve.set_defaults(func=bench_quota)
+
+    usage = sub.add_parser("pose-usage", help="姿势使用次数写缓冲")
+    usage.set_defaults(func=bench_pose_usage)
+
+    snap = sub.add_parser("snapshot", help="快照刷新期间的写入延迟")
+    snap.add_argument("--users", type=int, default=200000)
+    snap.add_argument("--pages", type=int, default=256)
+    snap.set_defaults(func=bench_snapshot)
+
+    login = sub.add_parser("login", help="按手机号/邮箱查用户")
+    login.add_argument("--users", type=int, default=1000000)
+    login.set_defaults(func=bench_login)
+
+    expiry = sub.add_parser("expiry", help="TEXT时间 vs 整数时间戳")
+    expiry.add_argument("--users", type=int, default=100)
+    expiry.add_argument("--rows", type=int, default=2000)
+    expiry.set_defaults(func=bench_expiry)
+
+    password = sub.add_parser("password", help="密码校验进程池吞吐")
+    password.add_argument("--rounds", type=int, default=12)
+    password.add_argument("--logins", type=int, default=8, help="每个线程的校验次数")
+    password.set_defaults(func=bench_password)
+
+    cache = sub.add_parser("token-cache", help="已验证token缓存")
+    cache.add_argument("--tokens", type=int, default=100, help="活跃token数")
+    cache.set_defaults(func=bench_token_cache)
+
+    limiter = sub.add_parser("rate-limit", help="限流中间件开销")
+    limiter.add_argument("--clients", type=int, default=10000, help="不同IP/账号数")
+    limiter.set_defaults(func=bench_rate_limit)
+
+    jobs = sub.add_parser("jobs", help="任务队列吞吐")
+    jobs.add_argument("--jobs", type=int, default=5000)
+    jobs.set_defaults(func=bench_jobs)
+
+    poll = sub.add_parser("video-poll", help="视频生成状态轮询策略")
+    poll.add_argument("--jobs", type=int, default=500)
+    poll.add_argument("--mean", type=float, default=300.0, help="实际平均耗时（秒）")
+    poll.add_argument("--frames", type=int, default=144)
+    poll.add_argument("--scale", type=float, default=50.0)
+    poll.add_argument("--seed", type=int, default=1)
+    poll.set_defaults(func=bench_video_poll)
+
+    download = sub.add_parser("download", help="并发下载视频的内存峰值")
+    download.add_argument("--size-mb", type=int, default=20)
+    download.add_argument("--concurrency", type=int, default=8)
+    download.add_argument("--max-downloads", type=int, default=4)
+    download.set_defaults(func=bench_download)
+
+    key_pool = sub.add_parser("key-pool", help="服务商密钥池")
+    key_pool.add_argument("--rate", type=float, default=100.0, help="每分钟请求数")
+    key_pool.add_argument("--duration", type=float, default=1800.0, help="模拟秒数")
+    key_pool.add_argument("--seed", type=int, default=1)
+    key_pool.set_defaults(func=bench_key_pool)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import base64
+import hashlib
+import mmap
+import os
+import re
+import sqlite3
+import tempfile
+from pathlib import Path
+from typing import Iterator
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+
+
+def default_blob_root(db_path: str) -> Path:
+    """数据库对应的默认存储目录：与数据库文件同目录下的 blobs/"""
+    root = os.getenv("BLOB_STORE_DIR")
+    if root:
+        return Path(root)
+    return Path(db_path).resolve().parent / "blobs"
+
+
+def decode_b64_image(value: str) -> bytes:
+    """解码base64图片，兼容 data:image/jpeg;base64, 前缀"""
+    if value.startswith("data:") and "," in value:
+        value = value.split(",", 1)[1]
+    return base64.b64decode(value)
+
+
+class BlobStore:
+    """
+    按SHA-256寻址的本地文件存储
+
+    内容以原始字节保存在 root/ab/cd/<sha256> 中，相同内容只存一份；
+    写入先落临时文件再原子改名，读取通过mmap映射，不整体复制到内存。
+    没有被任何记录引用的内容由 sweeper 按修改时间加宽限期回收，
+    put() 复用已有内容时会刷新修改时间。
+    """
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+
+    def path(self, digest: str) -> Path:
+        if not _DIGEST.match(digest):
+            raise ValueError(f"无效的内容哈希: {digest}")
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        try:
+            # 刷新修改时间，引用它的记录提交之前不会被当作无引用内容回收
+            os.utime(path)
+            return digest
+        except FileNotFoundError:
+            pass
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return digest
+
+    def put_b64(self, value: str) -> str:
+        return self.put(decode_b64_image(value))
+
+    def exists(self, digest: str) -> bool:
+        return self.path(digest).exists()
+
+    def open(self, digest: str) -> mmap.mmap | bytes:
+        """以只读mmap方式打开内容（空文件返回 b""）"""
+        with open(self.path(digest), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get(self, digest: str) -> bytes:
+        data = self.open(digest)
+        if isinstance(data, mmap.mmap):
+            with data:
+                return data[:]
+        return data
+
+    def get_b64(self, digest: str) -> str:
+        data = self.open(digest)
+        if isinstance(data, mmap.mmap):
+            with data:
+                return base64.b64encode(data).decode("ascii")
+        return ""
+
+    def delete(self, digest: str, older_than: float | None = None) -> int:
+        """
+        删除内容，返回释放的字节数
+
+        指定 older_than 时只删除修改时间早于它的文件（期间被 put() 复用的内容保留）。
+        """
+        path = self.path(digest)
+        try:
+            stat = path.stat()
+            if older_than is not None and stat.st_mtime >= older_than:
+                return 0
+            path.unlink()
+        except FileNotFoundError:
+            return 0
+        return stat.st_size
+
+    def scan(self) -> Iterator[os.DirEntry]:
+        """遍历存储中的所有文件，包括写入中断留下的 .tmp- 临时文件"""
+        if not self.root.is_dir():
+            return
+        for level1 in os.scandir(self.root):
+            if not level1.is_dir():
+                continue
+            for level2 in os.scandir(level1.path):
+                if not level2.is_dir():
+                    continue
+                with os.scandir(level2.path) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            yield entry
+
+
+def move_inline_images(conn: sqlite3.Connection, batch_size: int = 200):
+    """迁移步骤：把 generations / user_poses 中内联的base64图片搬到 BlobStore"""
+    db_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    store = BlobStore(default_blob_root(db_file or "."))
+
+    for table in ("generations", "user_poses"):
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                f"""
+                SELECT id, source_image_b64 FROM {table}
+                WHERE id > ? AND source_image_b64 IS NOT NULL
+                ORDER BY id LIMIT ?
+                """,
+                (last_id, batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            moved = []
+            for row_id, b64 in rows:
+                try:
+                    moved.append((store.put_b64(b64), row_id))
+                except ValueError:
+                    # 不是合法的base64，保留原样
+                    continue
+            conn.executemany(
+                f"""
+                UPDATE {table} SET source_image_hash = ?, source_image_b64 = NULL
+                WHERE id = ?
+                """,
+                moved,
+            )
+            last_id = rows[-1][0]
@@ -0,0 +1,69 @@
+import sqlite3
+
+# daily_statistics 中可以增量累加的列
+DAILY_COLUMNS = (
+    "new_users",
+    "active_users",
+    "logins",
+    "image_generations",
+    "video_generations",
+    "video_frames",
+    "api_calls",
+    "total_revenue_cents",
+)
+
+
+def bump_daily(conn: sqlite3.Connection, stat_date: str | None = None, **deltas: int):
+    """
+    在调用方的事务中累加当天（UTC）的统计值，例如 bump_daily(conn, logins=1)
+
+    与业务写入在同一事务内提交，统计和业务数据不会出现不一致。
+    """
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    unknown = set(deltas) - set(DAILY_COLUMNS)
+    if unknown:
+        raise ValueError(f"未知的统计列: {', '.join(sorted(unknown))}")
+
+    columns = ", ".join(deltas)
+    placeholders = ", ".join("?" for _ in deltas)
+    updates = ", ".join(f"{c} = {c} + excluded.{c}" for c in deltas)
+    conn.execute(
+        f"""
+        INSERT INTO daily_statistics (stat_date, {columns})
+        VALUES (COALESCE(?, date('now')), {placeholders})
+        ON CONFLICT(stat_date) DO UPDATE SET {updates}
+        """,
+        (stat_date, *deltas.values()),
+    )
+
+
+def backfill_daily_statistics(conn: sqlite3.Connection):
+    """迁移步骤：用已有数据回填历史统计"""
+    for stat_date, count in conn.execute(
+        "SELECT date(created_at), COUNT(*) FROM users GROUP BY date(created_at)"
+    ).fetchall():
+        bump_daily(conn, stat_date, new_users=count)
+
+    for stat_date, count in conn.execute(
+        "SELECT date(last_login), COUNT(*) FROM users "
+        "WHERE last_login IS NOT NULL GROUP BY date(last_login)"
+    ).fetchall():
+        bump_daily(conn, stat_date, active_users=count, logins=count)
+
+    for stat_date, count in conn.execute(
+        "SELECT date(created_at), COUNT(*) FROM generations GROUP BY date(created_at)"
+    ).fetchall():
+        bump_daily(conn, stat_date, image_generations=count)
+
+    for stat_date, cents in conn.execute(
+        "SELECT date(paid_at), SUM(amount_cents) FROM orders "
+        "WHERE status = 'paid' AND paid_at IS NOT NULL GROUP BY date(paid_at)"
+    ).fetchall():
+        bump_daily(conn, stat_date, total_revenue_cents=cents)
+
+    # 早期配额扣减没有时间记录，无法按天还原；差额记在迁移当天，保证累计总数一致
+    used = conn.execute("SELECT SUM(used_generations) FROM user_quotas").fetchone()[0]
+    recorded = conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+    bump_daily(conn, image_generations=max((used or 0) - recorded, 0))
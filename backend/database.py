@@ -1,182 +1,399 @@
+import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
-from typing import Optional
+from typing import Callable, Iterator, Optional
+import base64
 import json
 
+from blob_store import BlobStore, default_blob_root
+from daily_stats import DAILY_COLUMNS, bump_daily
+from identifiers import identifier_rows, normalize_identifier
+from migrations import LATEST_VERSION, current_version, migrate
+from write_buffer import CounterBuffer
+
+# 默认性能配置，可通过环境变量 DATABASE_<PRAGMA名大写> 覆盖，例如 DATABASE_SYNCHRONOUS=FULL
+DEFAULT_PRAGMAS = {
+    # 必须在切换WAL之前设置，且只对新建的数据库生效；已有数据库需执行一次 python sweeper.py --vacuum
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64000,  # 负数表示KB，约64MB
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+    "journal_size_limit": 64 * 1024 * 1024,
+}
+
+# journal_mode、auto_vacuum 写入数据库文件本身，只需在 init_db 中设置一次；其余按连接生效
+DATABASE_PRAGMAS = ("auto_vacuum", "journal_mode")
+
+# 生成记录保留时间（秒）
+GENERATION_TTL = 7 * 24 * 3600
+
+
+def load_pragmas(overrides: dict | None = None) -> dict:
+    """合并默认配置、环境变量和调用方传入的配置"""
+    pragmas = dict(DEFAULT_PRAGMAS)
+    for name in DEFAULT_PRAGMAS:
+        value = os.getenv(f"DATABASE_{name.upper()}")
+        if value:
+            pragmas[name] = value
+    if overrides:
+        pragmas.update(overrides)
+    return pragmas
+
+
+def apply_pragmas(conn: sqlite3.Connection, pragmas: dict):
+    for name, value in pragmas.items():
+        value = str(value)
+        # PRAGMA 不支持参数绑定，只允许简单的标识符或整数
+        if not name.isidentifier() or not value.lstrip("-").isalnum():
+            raise ValueError(f"无效的PRAGMA配置: {name}={value}")
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+class CheckpointScheduler:
+    """
+    WAL检查点后台线程
+
+    每隔 interval 秒执行一次 PASSIVE 检查点（不阻塞读写）；
+    WAL 文件超过 truncate_bytes 时改用 TRUNCATE，把文件截回 0。
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        interval: float = 30.0,
+        truncate_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.db_path = db_path
+        self.interval = interval
+        self.truncate_bytes = truncate_bytes
+        self.last_result: tuple[int, int, int] | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="sqlite-checkpoint", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float | None = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def checkpoint(self) -> tuple[int, int, int]:
+        """执行一次检查点，返回 (busy, wal页数, 已写回页数)"""
+        wal_path = Path(self.db_path + "-wal")
+        wal_size = wal_path.stat().st_size if wal_path.exists() else 0
+        mode = "TRUNCATE" if wal_size > self.truncate_bytes else "PASSIVE"
+
+        conn = sqlite3.connect(self.db_path, timeout=1.0)
+        try:
+            row = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        finally:
+            conn.close()
+        self.last_result = tuple(row)
+        return self.last_result
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.checkpoint()
+            except sqlite3.Error as e:
+                print(f"WAL检查点失败: {e}")
+
+
+def generation_stats(kind: Optional[str], n: int) -> dict:
+    """预扣 n 次配额对应的每日生成统计增量"""
+    if kind == "image":
+        return {"image_generations": n}
+    if kind == "video":
+        return {"video_generations": 1, "video_frames": n}
+    return {}
+
+
+def release_quota(
+    conn: sqlite3.Connection,
+    user_id: int,
+    n: int,
+    kind: Optional[str] = None,
+    stat_date: Optional[str] = None,
+):
+    """
+    在调用方的事务中退还预扣的配额，并撤销对应的生成统计
+
+    stat_date 为预扣时计入统计的日期（UTC），跨过零点退还时从当天扣回；不传时按今天
+    """
+    cursor = conn.execute(
+        """
+        UPDATE user_quotas
+        SET used_generations = MAX(COALESCE(used_generations, 0) - ?, 0)
+        WHERE user_id = ?
+    """,
+        (n, user_id),
+    )
+    if cursor.rowcount:
+        stats = generation_stats(kind, n)
+        bump_daily(conn, stat_date, **{k: -v for k, v in stats.items()})
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """连接池在超时时间内没有可用连接"""
+
+
+class IdentifierTaken(ValueError):
+    """手机号或邮箱已被其他用户注册"""
+
+
+class ConnectionPool:
+    """
+    SQLite连接池
+
+    - 同一线程内嵌套获取连接时复用同一个连接（事务也随之共享）
+    - 空闲连接按LIFO复用，连接总数不超过 max_size
+    - 空闲超过 health_check_interval 的连接在取出前做一次 SELECT 1 检查
+    - max_size <= 0 时不做池化，每次获取都新建连接、用完即关
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], sqlite3.Connection],
+        max_size: int = 8,
+        timeout: float = 10.0,
+        health_check_interval: float = 30.0,
+    ):
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle: list[tuple[sqlite3.Connection, float]] = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._closed = False
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    def acquire(self) -> sqlite3.Connection:
+        if self.max_size <= 0:
+            return self._connect()
+
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise sqlite3.ProgrammingError("连接池已关闭")
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"等待数据库连接超时（{self.timeout}秒）")
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except BaseException:
+                    self._forget()
+                    raise
+
+            if time.monotonic() - last_used < self.health_check_interval:
+                return conn
+            if self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn: sqlite3.Connection, broken: bool = False):
+        if self.max_size <= 0:
+            conn.close()
+            return
+
+        if not broken and conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
+
+        with self._cond:
+            if not broken and not self._closed:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+                return
+        self._discard(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """获取连接；最外层正常退出时提交，异常时回滚"""
+        local = self._local
+        conn = getattr(local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self.acquire()
+        local.conn = conn
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
+            raise
+        finally:
+            local.conn = None
+            self.release(conn, broken)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            conn.close()
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        self._forget()
+
+    def _forget(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+
+# 本进程内已完成表结构初始化的数据库文件
+_bootstrapped: set[str] = set()
+_bootstrap_lock = threading.Lock()
+
 
 class Database:
-    def __init__(self, db_path: str | None = None):
+    def __init__(
+        self,
+        db_path: str | None = None,
+        pool_size: int | None = None,
+        pragmas: dict | None = None,
+    ):
         if db_path is None:
             db_path = str(Path(__file__).parent / "app.db")
+        if pool_size is None:
+            pool_size = int(os.getenv("DATABASE_POOL_SIZE", "8"))
         self.db_path = db_path
-        self.init_db()
+        self.pragmas = load_pragmas(pragmas)
+        self.pool = ConnectionPool(self.get_connection, max_size=pool_size)
+        self.checkpointer = CheckpointScheduler(
+            db_path,
+            interval=float(os.getenv("DATABASE_CHECKPOINT_INTERVAL", "30")),
+            truncate_bytes=int(self.pragmas["journal_size_limit"]),
+        )
+        self.blobs = BlobStore(default_blob_root(db_path))
+        # 姿势使用次数写缓冲：后台任务运行时按 pose_id 合并后批量写入
+        self.pose_usage = CounterBuffer(
+            self.add_pose_usage_counts,
+            interval=float(os.getenv("POSE_USAGE_FLUSH_INTERVAL", "1")),
+            max_pending=int(os.getenv("POSE_USAGE_FLUSH_THRESHOLD", "1000")),
+        )
+        self.ensure_schema()
+
+    def ensure_schema(self):
+        """每个进程每个数据库文件只初始化一次"""
+        key = os.path.abspath(self.db_path)
+        if key in _bootstrapped:
+            return
+        with _bootstrap_lock:
+            if key in _bootstrapped:
+                return
+            self.init_db()
+            _bootstrapped.add(key)
 
     def init_db(self):
-        """初始化数据库表"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # 用户表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                phone_number TEXT,
-                email TEXT,
-                password_hash TEXT NOT NULL,
-                country_code TEXT DEFAULT '+86',
-                region TEXT DEFAULT 'CN',
-                is_admin BOOLEAN DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_login TIMESTAMP,
-                UNIQUE(phone_number, email)
-            )
-        """)
-
-        # 用户配额表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_quotas (
-                user_id INTEGER PRIMARY KEY,
-                free_generations INTEGER DEFAULT 5,
-                used_generations INTEGER DEFAULT 0,
-                subscription_level TEXT DEFAULT 'free',
-                subscription_expiry TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        """)
-
-        # 系统姿势预设表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS system_poses (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                name_en TEXT,
-                description TEXT,
-                description_en TEXT,
-                category TEXT,
-                category_en TEXT,
-                azimuth FLOAT NOT NULL,
-                elevation FLOAT NOT NULL,
-                distance FLOAT NOT NULL,
-                preview_image_url TEXT,
-                is_active BOOLEAN DEFAULT 1,
-                usage_count INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # 用户自定义姿势表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_poses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                name TEXT NOT NULL,
-                source_image_b64 TEXT,
-                azimuth FLOAT,
-                elevation FLOAT,
-                distance FLOAT,
-                is_public BOOLEAN DEFAULT 0,
-                price_cents INTEGER DEFAULT 99,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        """)
-
-        # 用户姿势购买记录
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_pose_purchases (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                pose_id INTEGER,
-                purchase_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                price_cents INTEGER,
-                FOREIGN KEY (user_id) REFERENCES users(id),
-                FOREIGN KEY (pose_id) REFERENCES user_poses(id)
-            )
-        """)
-
-        # 验证码表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS verification_codes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                identifier TEXT NOT NULL,
-                code TEXT NOT NULL,
-                code_type TEXT NOT NULL,
-                expires_at TIMESTAMP NOT NULL,
-                used BOOLEAN DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # 生成记录表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS generations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                pose_id INTEGER,
-                pose_type TEXT,
-                azimuth FLOAT,
-                elevation FLOAT,
-                distance FLOAT,
-                source_image_b64 TEXT,
-                result_url TEXT,
-                face_similarity FLOAT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                expires_at TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        """)
-
-        # 订单表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                order_type TEXT NOT NULL,
-                amount_cents INTEGER NOT NULL,
-                status TEXT DEFAULT 'pending',
-                payment_method TEXT,
-                payment_id TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                paid_at TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        """)
-
-        # 套餐表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS subscription_plans (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                price_cents INTEGER NOT NULL,
-                duration_days INTEGER,
-                free_generations INTEGER,
-                custom_pose_limit INTEGER,
-                features TEXT,
-                is_active BOOLEAN DEFAULT 1
-            )
-        """)
-
-        # 用户订阅表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_subscriptions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                plan_id INTEGER,
-                start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                expiry_date TIMESTAMP,
-                is_active BOOLEAN DEFAULT 1,
-                FOREIGN KEY (user_id) REFERENCES users(id),
-                FOREIGN KEY (plan_id) REFERENCES subscription_plans(id)
+        """设置持久化的PRAGMA（如WAL模式），表结构不是最新版本时执行迁移"""
+        conn = self.get_connection()
+        try:
+            apply_pragmas(
+                conn,
+                {k: v for k, v in self.pragmas.items() if k in DATABASE_PRAGMAS},
             )
-        """)
+            if self.schema_version(conn) < LATEST_VERSION:
+                migrate(conn)
+        finally:
+            conn.close()
 
-        conn.commit()
-        conn.close()
+    @staticmethod
+    def schema_version(conn: sqlite3.Connection) -> int:
+        try:
+            return current_version(conn)
+        except sqlite3.OperationalError:
+            # 还没有 schema_version 表
+            return 0
+
+    def get_connection(self) -> sqlite3.Connection:
+        """新建一个独立连接（连接池内部使用，业务代码请使用 connection()）"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        apply_pragmas(
+            conn,
+            {k: v for k, v in self.pragmas.items() if k not in DATABASE_PRAGMAS},
+        )
+        return conn
 
-    def get_connection(self):
-        return sqlite3.connect(self.db_path)
+    def connection(self):
+        """从连接池获取连接的上下文管理器"""
+        return self.pool.connection()
+
+    def start_background_tasks(self):
+        """启动后台任务（WAL检查点、计数器写缓冲）；由应用的 lifespan 调用"""
+        if str(self.pragmas["journal_mode"]).upper() == "WAL":
+            self.checkpointer.start()
+        if os.getenv("POSE_USAGE_BUFFERED", "1") == "1":
+            self.pose_usage.start()
+
+    def stop_background_tasks(self):
+        self.pose_usage.stop()
+        self.checkpointer.stop()
+
+    def close(self):
+        self.stop_background_tasks()
+        self.pool.close()
 
     # 用户相关方法
     def create_user(
@@ -187,118 +404,345 @@ class Database:
         country_code: str,
         region: str,
     ) -> int:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO users (phone_number, email, password_hash, country_code, region)
-            VALUES (?, ?, ?, ?, ?)
-        """,
-            (phone_number, email, password_hash, country_code, region),
-        )
-        user_id = cursor.lastrowid if cursor.lastrowid is not None else 0
-        conn.commit()
-        conn.close()
-        return user_id
+        """
+        创建用户并登记其手机号/邮箱
+
+        标识已被注册时抛出 IdentifierTaken，用户不会被创建。
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO users (phone_number, email, password_hash, country_code, region)
+                VALUES (?, ?, ?, ?, ?)
+            """,
+                (phone_number, email, password_hash, country_code, region),
+            )
+            user_id = cursor.lastrowid if cursor.lastrowid is not None else 0
+            try:
+                conn.executemany(
+                    """
+                    INSERT INTO user_identifiers (identifier, kind, user_id)
+                    VALUES (?, ?, ?)
+                """,
+                    identifier_rows(user_id, phone_number, email),
+                )
+            except sqlite3.IntegrityError:
+                raise IdentifierTaken("该账号已注册")
+            bump_daily(conn, new_users=1)
+            return user_id
 
     def get_user_by_identifier(self, identifier: str) -> Optional[dict]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT * FROM users
-            WHERE phone_number = ? OR email = ?
-        """,
-            (identifier, identifier),
-        )
-        row = cursor.fetchone()
-        conn.close()
+        """按手机号或邮箱查找用户（user_identifiers 主键查找）"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT u.* FROM user_identifiers i
+                JOIN users u ON u.id = i.user_id
+                WHERE i.identifier = ?
+            """,
+                (normalize_identifier(identifier),),
+            )
+            row = cursor.fetchone()
         if row:
             columns = [desc[0] for desc in cursor.description]
             return dict(zip(columns, row))
         return None
 
+    def get_user_by_id(self, user_id: int) -> Optional[dict]:
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+            row = cursor.fetchone()
+        if row:
+            columns = [desc[0] for desc in cursor.description]
+            return dict(zip(columns, row))
+        return None
+
+    # 管理后台用户列表的返回字段（不包含 password_hash）
+    ADMIN_USER_COLUMNS = (
+        "u.id, u.phone_number, u.email, u.country_code, u.region, u.is_admin, "
+        "u.created_at, u.last_login, "
+        "q.free_generations, q.used_generations, q.subscription_level"
+    )
+
+    @staticmethod
+    def encode_user_cursor(created_at: str, user_id: int) -> str:
+        raw = json.dumps([created_at, user_id]).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    @staticmethod
+    def decode_user_cursor(cursor: str) -> tuple[str, int]:
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            created_at, user_id = json.loads(raw)
+            return str(created_at), int(user_id)
+        except (ValueError, TypeError) as e:
+            raise ValueError("无效的分页游标") from e
+
+    def list_users_page(
+        self, limit: int = 50, cursor: Optional[str] = None
+    ) -> tuple[list[dict], Optional[str]]:
+        """
+        按 (created_at, id) 倒序的键集分页
+
+        Returns:
+            (本页用户, 下一页游标)；没有下一页时游标为 None
+        """
+        sql = f"""
+            SELECT {self.ADMIN_USER_COLUMNS}
+            FROM users u
+            LEFT JOIN user_quotas q ON u.id = q.user_id
+        """
+        params: list = []
+        if cursor:
+            sql += " WHERE (u.created_at, u.id) < (?, ?)"
+            params.extend(self.decode_user_cursor(cursor))
+        sql += " ORDER BY u.created_at DESC, u.id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        with self.connection() as conn:
+            result = conn.execute(sql, params)
+            rows = result.fetchall()
+        columns = [desc[0] for desc in result.description]
+        users = [dict(zip(columns, row)) for row in rows[:limit]]
+
+        next_cursor = None
+        if len(rows) > limit:
+            last = users[-1]
+            next_cursor = self.encode_user_cursor(last["created_at"], last["id"])
+        return users, next_cursor
+
+    def iter_users(self, batch_size: int = 500) -> Iterator[dict]:
+        """逐批遍历全部用户（内存占用与用户总数无关），每批单独借用连接"""
+        cursor = None
+        while True:
+            users, cursor = self.list_users_page(batch_size, cursor)
+            yield from users
+            if cursor is None:
+                return
+
     def update_last_login(self, user_id: int):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?
-        """,
-            (user_id,),
-        )
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            # 当天首次登录才计入活跃用户
+            row = conn.execute(
+                """
+                SELECT last_login IS NULL OR date(last_login) < date('now')
+                FROM users WHERE id = ?
+            """,
+                (user_id,),
+            ).fetchone()
+            conn.execute(
+                """
+                UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?
+            """,
+                (user_id,),
+            )
+            if row:
+                bump_daily(conn, logins=1, active_users=row[0])
+
+    def revoke_user_tokens(self, user_id: int, reason: Optional[str] = None) -> int:
+        """作废用户此前签发的全部 token，返回吊销时间戳"""
+        revoked_ts = int(time.time())
+        with self.connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO token_revocations (user_id, revoked_ts, reason)
+                VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    revoked_ts = excluded.revoked_ts, reason = excluded.reason
+            """,
+                (user_id, revoked_ts, reason),
+            )
+        return revoked_ts
+
+    def get_token_revocations(self, since_ts: int = 0) -> list[tuple[int, int]]:
+        """吊销时间不早于 since_ts 的 (user_id, revoked_ts)"""
+        with self.connection() as conn:
+            return conn.execute(
+                """
+                SELECT user_id, revoked_ts FROM token_revocations
+                WHERE revoked_ts >= ?
+            """,
+                (since_ts,),
+            ).fetchall()
 
     # 配额相关方法
     def create_user_quota(self, user_id: int, free_generations: int = 5):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO user_quotas (user_id, free_generations)
-            VALUES (?, ?)
-        """,
-            (user_id, free_generations),
-        )
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO user_quotas (user_id, free_generations)
+                VALUES (?, ?)
+            """,
+                (user_id, free_generations),
+            )
 
     def get_user_quota(self, user_id: int) -> dict | None:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM user_quotas WHERE user_id = ?", (user_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM user_quotas WHERE user_id = ?", (user_id,))
+            row = cursor.fetchone()
         if row:
             columns = [desc[0] for desc in cursor.description]
             return dict(zip(columns, row))
         return None
 
     def increment_usage(self, user_id: int):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            UPDATE user_quotas
-            SET used_generations = used_generations + 1
-            WHERE user_id = ?
-        """,
-            (user_id,),
-        )
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            conn.execute(
+                """
+                UPDATE user_quotas
+                SET used_generations = used_generations + 1
+                WHERE user_id = ?
+            """,
+                (user_id,),
+            )
+
+    def reserve_quota(
+        self,
+        user_id: int,
+        n: int = 1,
+        kind: Optional[str] = None,
+        stat_date: Optional[str] = None,
+    ) -> Optional[int]:
+        """
+        原子地预扣 n 次生成配额（检查与扣减在同一条UPDATE中完成）
+
+        Args:
+            kind: "image" 或 "video"，成功时同时计入当天的生成统计
+            stat_date: 计入统计的日期（UTC，YYYY-MM-DD），默认今天；退还时传入同一日期
+
+        Returns:
+            扣减后的剩余次数；配额不存在或不足时返回 None，不做任何扣减
+        """
+        if n < 1:
+            raise ValueError("预扣次数必须大于0")
+        with self.connection() as conn:
+            row = conn.execute(
+                """
+                UPDATE user_quotas
+                SET used_generations = COALESCE(used_generations, 0) + ?
+                WHERE user_id = ?
+                AND COALESCE(free_generations, 0) - COALESCE(used_generations, 0) >= ?
+                RETURNING free_generations - used_generations
+            """,
+                (n, user_id, n),
+            ).fetchone()
+            if row:
+                bump_daily(conn, stat_date, **generation_stats(kind, n))
+        return row[0] if row else None
+
+    def refund_quota(
+        self,
+        user_id: int,
+        n: int = 1,
+        kind: Optional[str] = None,
+        stat_date: Optional[str] = None,
+    ):
+        """退还预扣的配额（任务失败时调用），并从预扣当天的生成统计中撤销"""
+        with self.connection() as conn:
+            release_quota(conn, user_id, n, kind, stat_date)
+
+    # 订单相关方法
+    def mark_order_paid(self, order_id: int, payment_id: Optional[str] = None) -> bool:
+        """把待支付订单标记为已支付，并计入当天收入"""
+        with self.connection() as conn:
+            row = conn.execute(
+                """
+                UPDATE orders
+                SET status = 'paid', paid_at = CURRENT_TIMESTAMP,
+                    payment_id = COALESCE(?, payment_id)
+                WHERE id = ? AND status = 'pending'
+                RETURNING amount_cents
+            """,
+                (payment_id, order_id),
+            ).fetchone()
+            if row:
+                bump_daily(conn, total_revenue_cents=row[0])
+        return row is not None
+
+    # 统计相关方法
+    def get_daily_statistics(self, start_date: str, end_date: str) -> list:
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT stat_date, {columns} FROM daily_statistics
+                WHERE stat_date BETWEEN ? AND ? ORDER BY stat_date
+            """.format(columns=", ".join(DAILY_COLUMNS)),
+                (start_date, end_date),
+            )
+            rows = cursor.fetchall()
+        columns = [desc[0] for desc in cursor.description]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def sum_daily_statistics(
+        self, start_date: Optional[str] = None, end_date: Optional[str] = None
+    ) -> dict:
+        """汇总日期范围内（默认全部）的统计值"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT {sums} FROM daily_statistics
+                WHERE stat_date BETWEEN COALESCE(?, '0000-00-00') AND COALESCE(?, '9999-12-31')
+            """.format(
+                    sums=", ".join(
+                        f"COALESCE(SUM({c}), 0) AS {c}" for c in DAILY_COLUMNS
+                    )
+                ),
+                (start_date, end_date),
+            )
+            row = cursor.fetchone()
+        columns = [desc[0] for desc in cursor.description]
+        return dict(zip(columns, row))
 
     # 验证码相关方法
     def create_verification_code(
         self, identifier: str, code: str, code_type: str, expires_minutes: int = 5
     ):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO verification_codes (identifier, code, code_type, expires_at)
-            VALUES (?, ?, ?, datetime('now', '+' || ? || ' minutes'))
-        """,
-            (identifier, code, code_type, expires_minutes),
-        )
-        conn.commit()
-        conn.close()
+        now = int(time.time())
+        expires = now + expires_minutes * 60
+        with self.connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO verification_codes
+                (identifier, code, code_type, created_at, expires_at, created_ts, expires_ts)
+                VALUES (?, ?, ?, datetime(?, 'unixepoch'), datetime(?, 'unixepoch'), ?, ?)
+            """,
+                (identifier, code, code_type, now, expires, now, expires),
+            )
+
+    def count_recent_verification_codes(
+        self, identifier: str, seconds: int = 60
+    ) -> int:
+        with self.connection() as conn:
+            row = conn.execute(
+                """
+                SELECT COUNT(*) FROM verification_codes
+                WHERE identifier = ? AND created_ts > ?
+            """,
+                (identifier, int(time.time()) - seconds),
+            ).fetchone()
+        return row[0] if row else 0
 
     def verify_code(self, identifier: str, code: str, code_type: str) -> bool:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT id FROM verification_codes
-            WHERE identifier = ? AND code = ? AND code_type = ?
-            AND used = 0 AND expires_at > datetime('now')
-        """,
-            (identifier, code, code_type),
-        )
-        row = cursor.fetchone()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT id FROM verification_codes
+                WHERE identifier = ? AND code = ? AND code_type = ?
+                AND used = 0 AND expires_ts > ?
+            """,
+                (identifier, code, code_type, int(time.time())),
+            )
+            row = cursor.fetchone()
+            if not row:
+                return False
 
-        if row:
             # 标记为已使用
             cursor.execute(
                 """
@@ -306,41 +750,43 @@ class Database:
             """,
                 (row[0],),
             )
-            conn.commit()
-            conn.close()
             return True
 
-        conn.close()
-        return False
-
     # 系统姿势相关方法
     def get_all_system_poses(self, active_only: bool = True) -> list:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        if active_only:
-            cursor.execute(
-                "SELECT * FROM system_poses WHERE is_active = 1 ORDER BY category, id"
-            )
-        else:
-            cursor.execute("SELECT * FROM system_poses ORDER BY category, id")
-        rows = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if active_only:
+                cursor.execute(
+                    "SELECT * FROM system_poses WHERE is_active = 1 ORDER BY category, id"
+                )
+            else:
+                cursor.execute("SELECT * FROM system_poses ORDER BY category, id")
+            rows = cursor.fetchall()
         if rows:
             columns = [desc[0] for desc in cursor.description]
             return [dict(zip(columns, row)) for row in rows]
         return []
 
     def increment_pose_usage(self, pose_id: int):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            UPDATE system_poses SET usage_count = usage_count + 1 WHERE id = ?
-        """,
-            (pose_id,),
-        )
-        conn.commit()
-        conn.close()
+        # 写缓冲在运行时只记内存，由后台线程合并写入；否则直接更新
+        self.pose_usage.add(pose_id)
+
+    def add_pose_usage_counts(self, counts: dict):
+        """在一个事务中批量累加姿势使用次数 {pose_id: 增量}"""
+        with self.connection() as conn:
+            conn.executemany(
+                """
+                UPDATE system_poses SET usage_count = usage_count + ? WHERE id = ?
+            """,
+                [(n, pose_id) for pose_id, n in counts.items()],
+            )
+
+    # 源图片存储（按SHA-256存放在 BlobStore，数据库行只保存哈希）
+    def store_source_image(self, source_image_b64: Optional[str]) -> Optional[str]:
+        if not source_image_b64:
+            return None
+        return self.blobs.put_b64(source_image_b64)
 
     # 用户姿势相关方法
     def create_user_pose(
@@ -354,38 +800,38 @@ class Database:
         is_public: bool = False,
         price_cents: int = 99,
     ) -> int:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO user_poses (user_id, name, source_image_b64, azimuth, elevation, distance, is_public, price_cents)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-            (
-                user_id,
-                name,
-                source_image_b64,
-                azimuth,
-                elevation,
-                distance,
-                is_public,
-                price_cents,
-            ),
-        )
-        pose_id = cursor.lastrowid if cursor.lastrowid is not None else 0
-        conn.commit()
-        conn.close()
-        return pose_id
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO user_poses (user_id, name, source_image_hash, azimuth, elevation, distance, is_public, price_cents)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+                (
+                    user_id,
+                    name,
+                    self.store_source_image(source_image_b64),
+                    azimuth,
+                    elevation,
+                    distance,
+                    is_public,
+                    price_cents,
+                ),
+            )
+            return cursor.lastrowid if cursor.lastrowid is not None else 0
 
     def get_user_poses(self, user_id: int) -> list:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM user_poses WHERE user_id = ? ORDER BY created_at DESC",
-            (user_id,),
-        )
-        rows = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT id, user_id, name, source_image_hash, azimuth, elevation, distance,
+                       is_public, price_cents, created_at
+                FROM user_poses WHERE user_id = ? ORDER BY created_at DESC
+            """,
+                (user_id,),
+            )
+            rows = cursor.fetchall()
         if rows:
             columns = [desc[0] for desc in cursor.description]
             return [dict(zip(columns, row)) for row in rows]
@@ -401,45 +847,51 @@ class Database:
         elevation: float,
         distance: float,
         source_image_b64: Optional[str],
-        result_url: str,
+        result_url: Optional[str],
         face_similarity: Optional[float] = None,
+        source_image_hash: Optional[str] = None,
     ) -> int:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO generations (user_id, pose_id, pose_type, azimuth, elevation, distance, source_image_b64, result_url, face_similarity, expires_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now', '+7 days'))
-        """,
-            (
-                user_id,
-                pose_id,
-                pose_type,
-                azimuth,
-                elevation,
-                distance,
-                source_image_b64,
-                result_url,
-                face_similarity,
-            ),
-        )
-        gen_id = cursor.lastrowid if cursor.lastrowid is not None else 0
-        conn.commit()
-        conn.close()
-        return gen_id
+        now = int(time.time())
+        expires = now + GENERATION_TTL
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO generations (user_id, pose_id, pose_type, azimuth, elevation, distance, source_image_hash, result_url, face_similarity,
+                                         created_at, expires_at, created_ts, expires_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, datetime(?, 'unixepoch'), datetime(?, 'unixepoch'), ?, ?)
+            """,
+                (
+                    user_id,
+                    pose_id,
+                    pose_type,
+                    azimuth,
+                    elevation,
+                    distance,
+                    source_image_hash or self.store_source_image(source_image_b64),
+                    result_url,
+                    face_similarity,
+                    now,
+                    expires,
+                    now,
+                    expires,
+                ),
+            )
+            return cursor.lastrowid if cursor.lastrowid is not None else 0
 
     def get_user_generations(self, user_id: int) -> list:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT * FROM generations WHERE user_id = ? AND expires_at > datetime('now')
-            ORDER BY created_at DESC LIMIT 50
-        """,
-            (user_id,),
-        )
-        rows = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT id, user_id, pose_id, pose_type, azimuth, elevation, distance,
+                       source_image_hash, result_url, face_similarity, created_at, expires_at
+                FROM generations WHERE user_id = ? AND expires_ts > ?
+                ORDER BY created_ts DESC LIMIT 50
+            """,
+                (user_id, int(time.time())),
+            )
+            rows = cursor.fetchall()
         if rows:
             columns = [desc[0] for desc in cursor.description]
             return [dict(zip(columns, row)) for row in rows]
@@ -448,3 +900,8 @@ class Database:
 
 # 初始化数据库
 db = Database()
+
+
+async def get_db() -> Database:
+    """FastAPI依赖：返回进程内共享的 Database 实例"""
+    return db
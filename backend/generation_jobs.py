@@ -0,0 +1,148 @@
+"""
+生成任务的处理函数
+
+图片和360视频默认由 Android APP 在本地调用模型生成，服务端任务负责
+生成记录的落库；任务结果中 processing 为 "local" 表示需要 APP 本地处理。
+生成记录与任务状态在同一事务中写入，任务被取消或租约过期重新排队时不会留下记录。
+设置 SILICONFLOW_VIDEO=1 后，360视频改由服务端调用硅基流动生成，
+视频下载到 OUTPUT_DIR 后记为生成结果。
+"""
+
+import os
+
+from database import db
+from job_queue import Completion, JobFailed, JobWorkers, job_queue
+from siliconflow import (
+    GenerationFailed,
+    SiliconFlowError,
+    Submission,
+    SubmitUncertain,
+    VideoRequest,
+    siliconflow,
+)
+
+SILICONFLOW_VIDEO = os.getenv("SILICONFLOW_VIDEO", "0") == "1"
+SILICONFLOW_VIDEO_SIZE = os.getenv("SILICONFLOW_VIDEO_SIZE", "1280x720")
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "outputs")
+VIDEO_PROMPT = "smooth 360 degree orbit around the subject, stable camera motion"
+
+
+def handle_image(job: dict) -> Completion:
+    payload = job["payload"]
+
+    def commit() -> dict:
+        generation_id = db.create_generation(
+            user_id=job["user_id"],
+            pose_id=payload["pose_id"],
+            pose_type=payload["pose_type"],
+            azimuth=payload["azimuth"],
+            elevation=payload["elevation"],
+            distance=payload["distance"],
+            source_image_b64=None,
+            result_url=None,
+            source_image_hash=payload["source_image_hash"],
+        )
+        return {"generation_id": generation_id}
+
+    return Completion({"processing": "local"}, commit)
+
+
+def handle_video(job: dict) -> Completion:
+    payload = job["payload"]
+    result = {"frame_count": payload["frame_count"], "processing": "local"}
+    if SILICONFLOW_VIDEO:
+        result.update(generate_video_remote(job), processing="siliconflow")
+
+    def commit() -> dict:
+        generation_id = db.create_generation(
+            user_id=job["user_id"],
+            pose_id=None,
+            pose_type="360",
+            azimuth=0.0,
+            elevation=0.0,
+            distance=1.0,
+            source_image_b64=None,
+            result_url=result.get("result_url"),
+            source_image_hash=payload["source_image_hash"],
+        )
+        return {"generation_id": generation_id}
+
+    return Completion(result, commit)
+
+
+def generate_video_remote(job: dict) -> dict:
+    """
+    调用硅基流动生成视频并下载到输出目录
+
+    提交成功后立即把 request_id、提交时间、所用密钥和预计完成时间写回任务，生成完成后写回视频链接；
+    任务因超时或网络错误重试时从中断处继续：不会重复提交，
+    已生成的视频直接下载，下载到一半的文件从断点续传。
+    """
+    payload = job["payload"]
+    if "video_url" not in payload:
+        payload["video_url"] = _generate(job)
+        job_queue.update_payload(job["id"], job["owner"], payload)
+    name = f"{job['id']}.mp4"
+    try:
+        siliconflow.run(
+            siliconflow.download(payload["video_url"], os.path.join(OUTPUT_DIR, name))
+        )
+    except SiliconFlowError as e:
+        if not e.retryable:
+            raise JobFailed(str(e)) from e
+        raise
+    return {
+        "request_id": payload["siliconflow_request_id"],
+        "video_url": payload["video_url"],
+        "result_url": f"outputs/{name}",
+    }
+
+
+def _generate(job: dict) -> str:
+    payload = job["payload"]
+    image = db.blobs.get_b64(payload["source_image_hash"])
+    mime = "image/png" if image.startswith("iVBORw0KGgo") else "image/jpeg"
+    request = VideoRequest(
+        image=f"data:{mime};base64,{image}",
+        prompt=VIDEO_PROMPT,
+        image_size=SILICONFLOW_VIDEO_SIZE,
+        num_frames=payload["frame_count"],
+    )
+
+    def remember(submission: Submission):
+        payload["siliconflow_request_id"] = submission.request_id
+        payload["siliconflow_submitted_ts"] = submission.submitted_at
+        payload["siliconflow_key_id"] = submission.key_id
+        eta_ts = submission.submitted_at + siliconflow.estimate(request)
+        job_queue.update_payload(job["id"], job["owner"], payload, eta_ts=eta_ts)
+
+    def extend_eta(eta_ts: float):
+        # 超过预计时间仍未完成时推后，客户端查询到的剩余时间不会一直是0
+        job_queue.update_eta(job["id"], job["owner"], eta_ts)
+
+    submission = None
+    if "siliconflow_request_id" in payload:
+        submission = Submission(
+            payload["siliconflow_request_id"],
+            payload["siliconflow_submitted_ts"],
+            payload.get("siliconflow_key_id"),
+        )
+    try:
+        video = siliconflow.run(
+            siliconflow.generate(
+                request, submission, on_submit=remember, on_eta=extend_eta
+            )
+        )
+    except (SubmitUncertain, GenerationFailed) as e:
+        # 提交结果未知时重试可能重复生成，按失败处理并退还配额
+        raise JobFailed(str(e)) from e
+    except SiliconFlowError as e:
+        if not e.retryable:
+            raise JobFailed(str(e)) from e
+        raise
+    return video.video_url
+
+
+GENERATION_HANDLERS = {"image": handle_image, "video": handle_video}
+
+job_workers = JobWorkers(job_queue, GENERATION_HANDLERS)
@@ -0,0 +1,45 @@
+import sqlite3
+
+
+def normalize_identifier(identifier: str) -> str:
+    """登录标识的规范形式：去掉首尾空白，邮箱不区分大小写"""
+    identifier = identifier.strip()
+    if "@" in identifier:
+        return identifier.lower()
+    return identifier
+
+
+def identifier_rows(
+    user_id: int, phone_number: str | None, email: str | None
+) -> list[tuple[str, str, int]]:
+    """用户的 (identifier, kind, user_id) 行，用于写入 user_identifiers"""
+    rows = []
+    if phone_number:
+        rows.append((normalize_identifier(phone_number), "phone", user_id))
+    if email:
+        rows.append((normalize_identifier(email), "email", user_id))
+    return rows
+
+
+def backfill_user_identifiers(conn: sqlite3.Connection, batch_size: int = 5000):
+    """
+    迁移步骤：为已有用户写入登录标识
+
+    按用户id顺序写入，同一标识对应多个用户时保留最早注册的用户。
+    """
+    last_id = 0
+    while True:
+        users = conn.execute(
+            """
+            SELECT id, phone_number, email FROM users
+            WHERE id > ? ORDER BY id LIMIT ?
+            """,
+            (last_id, batch_size),
+        ).fetchall()
+        if not users:
+            break
+        conn.executemany(
+            "INSERT OR IGNORE INTO user_identifiers (identifier, kind, user_id) VALUES (?, ?, ?)",
+            [row for user in users for row in identifier_rows(*user)],
+        )
+        last_id = users[-1][0]
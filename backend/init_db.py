@@ -1,48 +1,38 @@
-import sqlite3
 import json
 from pathlib import Path
 from database import Database
 
 
-def init_database():
+def init_database(db_path: str | Path | None = None):
     """初始化数据库，插入系统预设姿势"""
-    db_path = Path(__file__).parent / "app.db"
+    if db_path is None:
+        db_path = Path(__file__).parent / "app.db"
 
-    Database(db_path=str(db_path)).init_db()
-
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    database = Database(db_path=str(db_path))
 
     # 读取系统预设姿势数据
     poses_file = Path(__file__).parent / "poses.json"
     with open(poses_file, "r", encoding="utf-8") as f:
         poses_data = json.load(f)
 
-    # 插入系统预设姿势
-    for pose in poses_data["presets"]:
-        cursor.execute(
-            """
-            INSERT OR IGNORE INTO system_poses
-            (id, name, name_en, description, description_en, category, category_en,
-             azimuth, elevation, distance, preview_image_url, is_active, usage_count)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-            (
-                str(pose.get("id", "")),
-                pose["name"],
-                pose.get("name_en", ""),
-                pose["description"],
-                pose.get("description_en", ""),
-                pose["category"],
-                pose.get("category_en", ""),
-                pose["azimuth"],
-                pose["elevation"],
-                pose["distance"],
-                pose.get("preview_image_url", ""),
-                1 if pose.get("is_active", True) else 0,
-                pose.get("usage_count", 0),
-            ),
+    poses = [
+        (
+            str(pose.get("id", "")),
+            pose["name"],
+            pose.get("name_en", ""),
+            pose["description"],
+            pose.get("description_en", ""),
+            pose["category"],
+            pose.get("category_en", ""),
+            pose["azimuth"],
+            pose["elevation"],
+            pose["distance"],
+            pose.get("preview_image_url", ""),
+            1 if pose.get("is_active", True) else 0,
+            pose.get("usage_count", 0),
         )
+        for pose in poses_data["presets"]
+    ]
 
     # 创建初始套餐
     subscription_plans = [
@@ -84,26 +74,27 @@ def init_database():
         },
     ]
 
-    for plan in subscription_plans:
-        cursor.execute(
+    # 所有写入在同一个事务中批量执行
+    with database.connection() as conn:
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO system_poses
+            (id, name, name_en, description, description_en, category, category_en,
+             azimuth, elevation, distance, preview_image_url, is_active, usage_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            poses,
+        )
+        conn.executemany(
             """
             INSERT OR IGNORE INTO subscription_plans
             (name, price_cents, duration_days, free_generations, custom_pose_limit, features, is_active)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+            VALUES (:name, :price_cents, :duration_days, :free_generations,
+                    :custom_pose_limit, :features, :is_active)
         """,
-            (
-                plan["name"],
-                plan["price_cents"],
-                plan["duration_days"],
-                plan["free_generations"],
-                plan["custom_pose_limit"],
-                plan["features"],
-                plan["is_active"],
-            ),
+            subscription_plans,
         )
-
-    conn.commit()
-    conn.close()
+    database.close()
 
     print("数据库初始化完成！")
     print(f"- 插入了 {len(poses_data['presets'])} 个系统预设姿势")
@@ -0,0 +1,493 @@
+"""
+生成任务队列
+
+任务保存在 jobs 表中，状态机：
+    queued -> running -> succeeded
+                      -> failed      （重试次数用完或不可重试的错误）
+                      -> queued      （可重试的错误，退避后重新排队；租约过期同样处理）
+    queued/running -> cancelled      （用户取消）
+
+worker 领取任务时写入租约（lease_owner + lease_expires_ts），执行期间定期续约；
+进程崩溃后租约过期，任务会被重新排队。任务最终失败或被取消时，
+在同一个事务中退还预扣的配额。任务成功时需要写入的业务数据（如生成记录）
+与状态更新在同一个事务中提交，租约已失效的执行不会留下任何写入。
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from database import GENERATION_TTL, Database, db, release_quota
+
+STATES = ("queued", "running", "succeeded", "failed", "cancelled")
+FINISHED_STATES = ("succeeded", "failed", "cancelled")
+
+
+class JobFailed(Exception):
+    """任务处理函数抛出此异常表示不可重试的失败"""
+
+
+@dataclass
+class Completion:
+    """
+    处理函数的返回值：result 为任务结果
+
+    commit 在标记任务成功的同一事务中、确认租约仍属于当前 worker 之后执行，
+    返回值合并进任务结果；租约已失效（任务被取消或重新排队）时不执行。
+    """
+
+    result: dict
+    commit: Optional[Callable[[], dict]] = None
+
+
+class JobQueue:
+    """基于SQLite的任务队列"""
+
+    def __init__(self, database: Database, retry_backoff: float = 5.0):
+        self.database = database
+        self.retry_backoff = retry_backoff
+        # 同一进程内入队后唤醒空闲的 worker，不必等到下一次轮询
+        self.wakeup = threading.Event()
+
+    def enqueue(
+        self,
+        user_id: int,
+        kind: str,
+        payload: dict,
+        quota: int = 0,
+        max_attempts: int = 3,
+    ) -> str:
+        """
+        新建排队中的任务，返回任务ID
+
+        Args:
+            quota: 已为该任务预扣的配额次数，任务失败或取消时退还；
+                payload["quota_date"] 为预扣计入统计的日期，退还时从该日扣回
+        """
+        job_id = uuid.uuid4().hex
+        now = int(time.time())
+        with self.database.connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO jobs (id, user_id, kind, payload, quota, max_attempts,
+                                  available_ts, created_ts, updated_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+                (
+                    job_id,
+                    user_id,
+                    kind,
+                    json.dumps(payload),
+                    quota,
+                    max_attempts,
+                    now,
+                    now,
+                    now,
+                ),
+            )
+        self.wakeup.set()
+        return job_id
+
+    def claim(
+        self, owner: str, kinds: list[str], lease: float, limit: int = 1
+    ) -> list[dict]:
+        """领取最多 limit 个到期的排队任务，检查与改状态在同一条UPDATE中完成"""
+        now = int(time.time())
+        placeholders = ", ".join("?" * len(kinds))
+        with self.database.connection() as conn:
+            rows = conn.execute(
+                f"""
+                UPDATE jobs
+                SET state = 'running', lease_owner = ?, lease_expires_ts = ?,
+                    attempts = attempts + 1, updated_ts = ?
+                WHERE id IN (
+                    SELECT id FROM jobs
+                    WHERE state = 'queued' AND available_ts <= ? AND kind IN ({placeholders})
+                    ORDER BY available_ts LIMIT ?
+                )
+                RETURNING id, user_id, kind, payload, attempts, max_attempts, quota
+            """,
+                (owner, now + int(lease), now, now, *kinds, limit),
+            ).fetchall()
+        columns = (
+            "id",
+            "user_id",
+            "kind",
+            "payload",
+            "attempts",
+            "max_attempts",
+            "quota",
+        )
+        jobs = []
+        for row in rows:
+            job = dict(zip(columns, row))
+            job["payload"] = json.loads(job["payload"])
+            jobs.append(job)
+        return jobs
+
+    def heartbeat(self, job_ids: list[str], owner: str, lease: float) -> int:
+        """为仍在执行的任务续约，返回续约成功的任务数"""
+        if not job_ids:
+            return 0
+        now = int(time.time())
+        placeholders = ", ".join("?" * len(job_ids))
+        with self.database.connection() as conn:
+            return conn.execute(
+                f"""
+                UPDATE jobs SET lease_expires_ts = ?, updated_ts = ?
+                WHERE id IN ({placeholders}) AND state = 'running' AND lease_owner = ?
+            """,
+                (now + int(lease), now, *job_ids, owner),
+            ).rowcount
+
+    def update_eta(self, job_id: str, owner: str, eta_ts: float) -> bool:
+        """更新执行中任务的预计完成时间；租约已不属于 owner 时返回 False"""
+        with self.database.connection() as conn:
+            return bool(
+                conn.execute(
+                    """
+                    UPDATE jobs SET eta_ts = ?, updated_ts = ?
+                    WHERE id = ? AND state = 'running' AND lease_owner = ?
+                """,
+                    (int(eta_ts), int(time.time()), job_id, owner),
+                ).rowcount
+            )
+
+    def update_payload(
+        self, job_id: str, owner: str, payload: dict, eta_ts: float | None = None
+    ) -> bool:
+        """
+        执行中保存进度（如外部服务返回的请求ID），任务重试时处理函数能从中断处继续
+
+        Args:
+            eta_ts: 预计完成时间，查询任务状态时返回给客户端；不传时保持原值
+
+        租约已不属于 owner 时返回 False
+        """
+        with self.database.connection() as conn:
+            return bool(
+                conn.execute(
+                    """
+                    UPDATE jobs SET payload = ?, eta_ts = COALESCE(?, eta_ts),
+                        updated_ts = ?
+                    WHERE id = ? AND state = 'running' AND lease_owner = ?
+                """,
+                    (
+                        json.dumps(payload),
+                        int(eta_ts) if eta_ts is not None else None,
+                        int(time.time()),
+                        job_id,
+                        owner,
+                    ),
+                ).rowcount
+            )
+
+    def complete(
+        self,
+        job_id: str,
+        owner: str,
+        result: dict,
+        commit: Callable[[], dict] | None = None,
+    ) -> bool:
+        """
+        标记任务成功；租约已不属于 owner（过期后被重新领取或已取消）时返回 False
+
+        Args:
+            commit: 见 Completion，通过 database.connection() 写入即加入同一事务
+        """
+        now = int(time.time())
+        with self.database.connection() as conn:
+            completed = conn.execute(
+                """
+                UPDATE jobs
+                SET state = 'succeeded', result = ?, error = NULL,
+                    lease_owner = NULL, lease_expires_ts = NULL,
+                    updated_ts = ?, finished_ts = ?, expires_ts = ?
+                WHERE id = ? AND state = 'running' AND lease_owner = ?
+            """,
+                (
+                    json.dumps(result),
+                    now,
+                    now,
+                    now + GENERATION_TTL,
+                    job_id,
+                    owner,
+                ),
+            ).rowcount
+            if completed and commit is not None:
+                # 先确认租约再写业务数据；commit 抛出异常时整个事务回滚，任务仍在执行中
+                result = {**result, **commit()}
+                conn.execute(
+                    "UPDATE jobs SET result = ? WHERE id = ?",
+                    (json.dumps(result), job_id),
+                )
+        return bool(completed)
+
+    def fail(self, job_id: str, owner: str, error: str, retry: bool = True) -> bool:
+        """
+        记录一次失败：可重试且次数未用完时退避后重新排队，否则标记失败并退还配额
+
+        Returns:
+            租约已不属于 owner 时返回 False
+        """
+        now = int(time.time())
+        with self.database.connection() as conn:
+            if retry:
+                # 退避时间随失败次数翻倍
+                requeued = conn.execute(
+                    """
+                    UPDATE jobs
+                    SET state = 'queued', error = ?, lease_owner = NULL,
+                        lease_expires_ts = NULL, updated_ts = ?,
+                        available_ts = ? + CAST(? * (1 << (attempts - 1)) AS INTEGER)
+                    WHERE id = ? AND state = 'running' AND lease_owner = ?
+                    AND attempts < max_attempts
+                """,
+                    (error, now, now, self.retry_backoff, job_id, owner),
+                ).rowcount
+                if requeued:
+                    return True
+            finished = self._finish(
+                conn,
+                "failed",
+                error,
+                now,
+                "id = ? AND state = 'running' AND lease_owner = ?",
+                (job_id, owner),
+            )
+        return bool(finished)
+
+    def cancel(self, job_id: str, user_id: int) -> bool:
+        """取消用户尚未结束的任务并退还配额；任务不存在或已结束时返回 False"""
+        with self.database.connection() as conn:
+            finished = self._finish(
+                conn,
+                "cancelled",
+                "用户取消",
+                int(time.time()),
+                "id = ? AND user_id = ? AND state IN ('queued', 'running')",
+                (job_id, user_id),
+            )
+        return bool(finished)
+
+    def reap(self) -> int:
+        """租约过期的任务（worker 崩溃或卡死）重新排队，次数用完的标记失败"""
+        now = int(time.time())
+        with self.database.connection() as conn:
+            requeued = conn.execute(
+                """
+                UPDATE jobs
+                SET state = 'queued', error = '租约过期', lease_owner = NULL,
+                    lease_expires_ts = NULL, available_ts = ?, updated_ts = ?
+                WHERE state = 'running' AND lease_expires_ts < ?
+                AND attempts < max_attempts
+            """,
+                (now, now, now),
+            ).rowcount
+            failed = self._finish(
+                conn,
+                "failed",
+                "租约过期",
+                now,
+                "state = 'running' AND lease_expires_ts < ?",
+                (now,),
+            )
+        if requeued:
+            self.wakeup.set()
+        return requeued + failed
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self.database.connection() as conn:
+            cursor = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            columns = [desc[0] for desc in cursor.description]
+        job = dict(zip(columns, row))
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def counts(self) -> dict:
+        """各状态的任务数"""
+        with self.database.connection() as conn:
+            rows = conn.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall()
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(rows)
+        return counts
+
+    @staticmethod
+    def _finish(
+        conn, state: str, error: str, now: int, where: str, params: tuple
+    ) -> int:
+        """
+        结束满足 where 条件的任务（失败或取消），在同一事务中退还预扣的配额
+
+        条件写在同一条UPDATE中，任务状态在此期间被其他 worker 改变时不会误改。
+        返回结束的任务数。
+        """
+        rows = conn.execute(
+            f"""
+            UPDATE jobs
+            SET state = ?, error = ?, lease_owner = NULL, lease_expires_ts = NULL,
+                updated_ts = ?, finished_ts = ?, expires_ts = ?
+            WHERE {where}
+            RETURNING user_id, kind, quota, json_extract(payload, '$.quota_date')
+        """,
+            (state, error, now, now, now + GENERATION_TTL, *params),
+        ).fetchall()
+        for user_id, kind, quota, quota_date in rows:
+            if quota:
+                release_quota(conn, user_id, quota, kind, quota_date)
+        return len(rows)
+
+
+class JobWorkers:
+    """
+    任务 worker 线程池，由应用的 lifespan 启停
+
+    每个线程循环领取一个任务并调用 handlers[kind](job)，返回值（dict 或 Completion）
+    作为任务结果（job["owner"] 为当前租约持有者，可用于 update_payload）；
+    另有一个维护线程为执行中的任务续约，并回收租约过期的任务。
+    多个进程、多台机器可以同时运行 worker，依靠租约保证一个任务同一时刻只被一个 worker 执行。
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handlers: dict[str, Callable[[dict], dict | Completion]],
+        workers: int | None = None,
+        lease: float | None = None,
+        poll_interval: float = 1.0,
+    ):
+        if workers is None:
+            workers = int(os.getenv("JOB_WORKERS", "2"))
+        if lease is None:
+            lease = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = workers
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.succeeded = 0
+        self.failed = 0
+        # 执行结束时租约已不属于自己（过期后被其他 worker 领取或已取消），结果被丢弃
+        self.lost = 0
+        self._active: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    @property
+    def running(self) -> bool:
+        return any(t.is_alive() for t in self._threads)
+
+    def start(self):
+        if self.running or self.workers <= 0 or not self.handlers:
+            return
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(
+                target=self._work,
+                args=(f"{self.owner}:{i}",),
+                name=f"job-worker-{i}",
+                daemon=True,
+            )
+            for i in range(self.workers)
+        ]
+        self._threads.append(
+            threading.Thread(target=self._maintain, name="job-leases", daemon=True)
+        )
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float | None = 30.0):
+        """停止领取新任务，等待执行中的任务结束；超时未结束的任务在租约过期后由其他 worker 接手"""
+        self._stop.set()
+        self.queue.wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def metrics(self) -> dict:
+        return {
+            "running": self.running,
+            "workers": self.workers,
+            "active": len(self._active),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "lost": self.lost,
+            "jobs": self.queue.counts(),
+        }
+
+    def _work(self, owner: str):
+        kinds = list(self.handlers)
+        while not self._stop.is_set():
+            try:
+                jobs = self.queue.claim(owner, kinds, self.lease)
+            except Exception as e:
+                print(f"领取任务失败: {e}")
+                jobs = []
+            if not jobs:
+                self.queue.wakeup.wait(self.poll_interval)
+                self.queue.wakeup.clear()
+                continue
+            self._run(owner, jobs[0])
+
+    def _run(self, owner: str, job: dict):
+        with self._lock:
+            self._active[job["id"]] = owner
+        job["owner"] = owner
+        try:
+            outcome = self.handlers[job["kind"]](job)
+            if not isinstance(outcome, Completion):
+                outcome = Completion(outcome or {})
+            completed = self.queue.complete(
+                job["id"], owner, outcome.result, outcome.commit
+            )
+        except JobFailed as e:
+            self._failed(job, owner, str(e), retry=False)
+        except Exception as e:
+            self._failed(job, owner, f"{type(e).__name__}: {e}", retry=True)
+        else:
+            if completed:
+                self.succeeded += 1
+            else:
+                self._lost(job, owner)
+        finally:
+            with self._lock:
+                self._active.pop(job["id"], None)
+
+    def _failed(self, job: dict, owner: str, error: str, retry: bool):
+        if self.queue.fail(job["id"], owner, error, retry):
+            self.failed += 1
+        else:
+            self._lost(job, owner)
+
+    def _lost(self, job: dict, owner: str):
+        self.lost += 1
+        print(f"任务 {job['id']} 的租约已不属于 {owner}，丢弃本次执行结果")
+
+    def _maintain(self):
+        while not self._stop.wait(self.lease / 3):
+            try:
+                with self._lock:
+                    by_owner: dict[str, list[str]] = {}
+                    for job_id, owner in self._active.items():
+                        by_owner.setdefault(owner, []).append(job_id)
+                for owner, job_ids in by_owner.items():
+                    self.queue.heartbeat(job_ids, owner, self.lease)
+                self.queue.reap()
+            except Exception as e:
+                print(f"任务续约失败: {e}")
+
+
+job_queue = JobQueue(db)
@@ -0,0 +1,623 @@
+"""
+数据库版本迁移
+
+每个迁移是 (版本号, 描述, 步骤列表)，步骤可以是SQL语句或接收连接的函数。
+已执行的版本记录在 schema_version 表中，init_db 时按顺序补齐未执行的迁移。
+
+使用方法：
+    python migrations.py            # 迁移 app.db 到最新版本
+    python migrations.py --check    # 检查热点查询的执行计划，出现全表扫描时返回非0
+"""
+
+import argparse
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Callable, Union
+
+from blob_store import move_inline_images
+from daily_stats import backfill_daily_statistics
+from identifiers import backfill_user_identifiers
+
+Step = Union[str, Callable[[sqlite3.Connection], None]]
+
+
+# 001: 初始表结构（与早期 init_db 相同，已有数据库上执行是幂等的）
+INITIAL_TABLES: list[Step] = [
+    # 用户表
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        phone_number TEXT,
+        email TEXT,
+        password_hash TEXT NOT NULL,
+        country_code TEXT DEFAULT '+86',
+        region TEXT DEFAULT 'CN',
+        is_admin BOOLEAN DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_login TIMESTAMP,
+        UNIQUE(phone_number, email)
+    )
+    """,
+    # 用户配额表
+    """
+    CREATE TABLE IF NOT EXISTS user_quotas (
+        user_id INTEGER PRIMARY KEY,
+        free_generations INTEGER DEFAULT 5,
+        used_generations INTEGER DEFAULT 0,
+        subscription_level TEXT DEFAULT 'free',
+        subscription_expiry TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """,
+    # 系统姿势预设表
+    """
+    CREATE TABLE IF NOT EXISTS system_poses (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        name_en TEXT,
+        description TEXT,
+        description_en TEXT,
+        category TEXT,
+        category_en TEXT,
+        azimuth FLOAT NOT NULL,
+        elevation FLOAT NOT NULL,
+        distance FLOAT NOT NULL,
+        preview_image_url TEXT,
+        is_active BOOLEAN DEFAULT 1,
+        usage_count INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # 用户自定义姿势表
+    """
+    CREATE TABLE IF NOT EXISTS user_poses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        name TEXT NOT NULL,
+        source_image_b64 TEXT,
+        azimuth FLOAT,
+        elevation FLOAT,
+        distance FLOAT,
+        is_public BOOLEAN DEFAULT 0,
+        price_cents INTEGER DEFAULT 99,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """,
+    # 用户姿势购买记录
+    """
+    CREATE TABLE IF NOT EXISTS user_pose_purchases (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        pose_id INTEGER,
+        purchase_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        price_cents INTEGER,
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (pose_id) REFERENCES user_poses(id)
+    )
+    """,
+    # 验证码表
+    """
+    CREATE TABLE IF NOT EXISTS verification_codes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        identifier TEXT NOT NULL,
+        code TEXT NOT NULL,
+        code_type TEXT NOT NULL,
+        expires_at TIMESTAMP NOT NULL,
+        used BOOLEAN DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    # 生成记录表
+    """
+    CREATE TABLE IF NOT EXISTS generations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        pose_id INTEGER,
+        pose_type TEXT,
+        azimuth FLOAT,
+        elevation FLOAT,
+        distance FLOAT,
+        source_image_b64 TEXT,
+        result_url TEXT,
+        face_similarity FLOAT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        expires_at TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """,
+    # 订单表
+    """
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        order_type TEXT NOT NULL,
+        amount_cents INTEGER NOT NULL,
+        status TEXT DEFAULT 'pending',
+        payment_method TEXT,
+        payment_id TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        paid_at TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """,
+    # 套餐表
+    """
+    CREATE TABLE IF NOT EXISTS subscription_plans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        price_cents INTEGER NOT NULL,
+        duration_days INTEGER,
+        free_generations INTEGER,
+        custom_pose_limit INTEGER,
+        features TEXT,
+        is_active BOOLEAN DEFAULT 1
+    )
+    """,
+    # 用户订阅表
+    """
+    CREATE TABLE IF NOT EXISTS user_subscriptions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        plan_id INTEGER,
+        start_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        expiry_date TIMESTAMP,
+        is_active BOOLEAN DEFAULT 1,
+        FOREIGN KEY (user_id) REFERENCES users(id),
+        FOREIGN KEY (plan_id) REFERENCES subscription_plans(id)
+    )
+    """,
+]
+
+# 002: 热点查询索引（参见 docs/DATABASE_DESIGN.md 索引优化）
+HOT_PATH_INDEXES: list[Step] = [
+    "CREATE INDEX IF NOT EXISTS idx_users_phone ON users(phone_number)",
+    "CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)",
+    "CREATE INDEX IF NOT EXISTS idx_users_region ON users(region)",
+    "CREATE INDEX IF NOT EXISTS idx_users_last_login ON users(last_login)",
+    "CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at)",
+    """
+    CREATE INDEX IF NOT EXISTS idx_verification_codes_lookup
+    ON verification_codes(identifier, code_type, created_at)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_generations_user_expires
+    ON generations(user_id, expires_at)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_user_poses_user_created
+    ON user_poses(user_id, created_at)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_system_poses_active
+    ON system_poses(is_active, category, id)
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id)",
+    """
+    CREATE INDEX IF NOT EXISTS idx_user_subscriptions_user_id
+    ON user_subscriptions(user_id)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_user_pose_purchases_user_id
+    ON user_pose_purchases(user_id)
+    """,
+]
+
+# 003: 源图片改为按SHA-256存放在 BlobStore，行内只保留哈希
+BLOB_STORE_IMAGES: list[Step] = [
+    "ALTER TABLE generations ADD COLUMN source_image_hash TEXT",
+    "ALTER TABLE user_poses ADD COLUMN source_image_hash TEXT",
+    move_inline_images,
+]
+
+# 004: 按天增量维护的统计汇总表（参见 docs/DATABASE_DESIGN.md daily_statistics）
+DAILY_STATISTICS: list[Step] = [
+    """
+    CREATE TABLE IF NOT EXISTS daily_statistics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        stat_date DATE NOT NULL UNIQUE,
+        new_users INTEGER DEFAULT 0,
+        active_users INTEGER DEFAULT 0,
+        logins INTEGER DEFAULT 0,
+        image_generations INTEGER DEFAULT 0,
+        video_generations INTEGER DEFAULT 0,
+        video_frames INTEGER DEFAULT 0,
+        api_calls INTEGER DEFAULT 0,
+        total_revenue_cents INTEGER DEFAULT 0
+    )
+    """,
+    backfill_daily_statistics,
+]
+
+# 005: 登录标识查找表，登录和注册检查只需一次主键查找
+USER_IDENTIFIERS: list[Step] = [
+    """
+    CREATE TABLE IF NOT EXISTS user_identifiers (
+        identifier TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_user_identifiers_user_id
+    ON user_identifiers(user_id)
+    """,
+    backfill_user_identifiers,
+]
+
+# 006: 过期和频率限制判断改用整数时间戳（UNIX秒），原TEXT列保留供展示
+EPOCH_TIMESTAMPS: list[Step] = [
+    "ALTER TABLE verification_codes ADD COLUMN created_ts INTEGER",
+    "ALTER TABLE verification_codes ADD COLUMN expires_ts INTEGER",
+    """
+    UPDATE verification_codes
+    SET created_ts = CAST(strftime('%s', created_at) AS INTEGER),
+        expires_ts = CAST(strftime('%s', expires_at) AS INTEGER)
+    """,
+    "ALTER TABLE generations ADD COLUMN created_ts INTEGER",
+    "ALTER TABLE generations ADD COLUMN expires_ts INTEGER",
+    """
+    UPDATE generations
+    SET created_ts = CAST(strftime('%s', created_at) AS INTEGER),
+        expires_ts = CAST(strftime('%s', expires_at) AS INTEGER)
+    """,
+    "DROP INDEX IF EXISTS idx_verification_codes_lookup",
+    "DROP INDEX IF EXISTS idx_generations_user_expires",
+    """
+    CREATE INDEX IF NOT EXISTS idx_verification_codes_expires
+    ON verification_codes(identifier, code_type, expires_ts)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_verification_codes_sent
+    ON verification_codes(identifier, created_ts)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_generations_user_expires_ts
+    ON generations(user_id, expires_ts)
+    """,
+]
+
+# 007: 过期数据清理按过期时间分批删除
+EXPIRY_INDEXES: list[Step] = [
+    """
+    CREATE INDEX IF NOT EXISTS idx_verification_codes_expires_ts
+    ON verification_codes(expires_ts)
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_generations_expires_ts ON generations(expires_ts)",
+]
+
+# 008: 按用户吊销 token，签发时间不晚于吊销时间的 token 全部拒绝
+TOKEN_REVOCATIONS: list[Step] = [
+    """
+    CREATE TABLE IF NOT EXISTS token_revocations (
+        user_id INTEGER PRIMARY KEY,
+        revoked_ts INTEGER NOT NULL,
+        reason TEXT
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_token_revocations_revoked_ts
+    ON token_revocations(revoked_ts)
+    """,
+    # 已封禁用户此前签发的 token 一并作废
+    """
+    INSERT OR IGNORE INTO token_revocations (user_id, revoked_ts, reason)
+    SELECT id, CAST(strftime('%s', 'now') AS INTEGER), 'blocked'
+    FROM users WHERE password_hash = 'BLOCKED'
+    """,
+]
+
+# 009: 持久化的生成任务队列，worker 按租约领取
+GENERATION_JOBS: list[Step] = [
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        state TEXT NOT NULL DEFAULT 'queued'
+            CHECK (state IN ('queued', 'running', 'succeeded', 'failed', 'cancelled')),
+        payload TEXT NOT NULL DEFAULT '{}',
+        result TEXT,
+        error TEXT,
+        quota INTEGER NOT NULL DEFAULT 0,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 3,
+        lease_owner TEXT,
+        lease_expires_ts INTEGER,
+        available_ts INTEGER NOT NULL,
+        created_ts INTEGER NOT NULL,
+        updated_ts INTEGER NOT NULL,
+        finished_ts INTEGER,
+        expires_ts INTEGER,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """,
+    # 部分索引只包含排队中/运行中的任务，已结束的任务不会拖慢领取
+    """
+    CREATE INDEX IF NOT EXISTS idx_jobs_queued
+    ON jobs(available_ts) WHERE state = 'queued'
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_jobs_leases
+    ON jobs(lease_expires_ts) WHERE state = 'running'
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(user_id, created_ts)",
+    "CREATE INDEX IF NOT EXISTS idx_jobs_expires_ts ON jobs(expires_ts)",
+]
+
+# 010: 外部生成服务的耗时统计，任务增加预计完成时间
+PROVIDER_DURATIONS: list[Step] = [
+    # 外部生成服务按 (模型, 帧数, 分辨率) 学到的耗时，用于安排状态查询和预计完成时间
+    """
+    CREATE TABLE IF NOT EXISTS provider_durations (
+        key TEXT PRIMARY KEY,
+        samples INTEGER NOT NULL,
+        mean_seconds REAL NOT NULL,
+        deviation_seconds REAL NOT NULL,
+        updated_ts INTEGER NOT NULL
+    )
+    """,
+    "ALTER TABLE jobs ADD COLUMN eta_ts INTEGER",
+]
+
+# 011: 服务商API密钥表（加密保存，支持轮换和密钥池）
+API_KEYS: list[Step] = [
+    # 按 DATABASE_DESIGN.md 的设计，另加密钥池需要的列：
+    # priority/rate_limit_per_minute 用于加权选择，usage_month 标记 current_usage 所属月份，
+    # replaced_by 指向轮换后的新密钥，updated_ts 用于各进程发现变更
+    """
+    CREATE TABLE IF NOT EXISTS api_keys (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        key_name TEXT NOT NULL,
+        provider TEXT NOT NULL,
+        encrypted_key TEXT NOT NULL,
+        key_hash TEXT NOT NULL UNIQUE,
+        is_active BOOLEAN DEFAULT 1,
+        priority INTEGER NOT NULL DEFAULT 1,
+        monthly_limit INTEGER DEFAULT 10000,
+        rate_limit_per_minute INTEGER,
+        current_usage INTEGER DEFAULT 0,
+        usage_month TEXT,
+        replaced_by INTEGER REFERENCES api_keys(id),
+        last_rotated_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        created_by INTEGER NOT NULL,
+        updated_ts INTEGER NOT NULL,
+        FOREIGN KEY (created_by) REFERENCES users(id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_api_keys_provider ON api_keys(provider, is_active)",
+]
+
+# 012: 按源图片哈希查找引用，sweeper 回收无引用的 BlobStore 内容时使用
+BLOB_REFERENCE_INDEXES: list[Step] = [
+    """
+    CREATE INDEX IF NOT EXISTS idx_generations_source_image_hash
+    ON generations(source_image_hash)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_user_poses_source_image_hash
+    ON user_poses(source_image_hash)
+    """,
+]
+
+MIGRATIONS: list[tuple[int, str, list[Step]]] = [
+    (1, "初始表结构", INITIAL_TABLES),
+    (2, "热点查询索引", HOT_PATH_INDEXES),
+    (3, "源图片移入BlobStore", BLOB_STORE_IMAGES),
+    (4, "每日统计汇总表", DAILY_STATISTICS),
+    (5, "登录标识查找表", USER_IDENTIFIERS),
+    (6, "整数时间戳", EPOCH_TIMESTAMPS),
+    (7, "过期清理索引", EXPIRY_INDEXES),
+    (8, "令牌吊销表", TOKEN_REVOCATIONS),
+    (9, "生成任务队列", GENERATION_JOBS),
+    (10, "生成耗时统计与任务预计完成时间", PROVIDER_DURATIONS),
+    (11, "服务商API密钥表", API_KEYS),
+    (12, "源图片引用索引", BLOB_REFERENCE_INDEXES),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# 热点查询：名称 -> (SQL, 参数)，用于 EXPLAIN QUERY PLAN 检查
+HOT_QUERIES: dict[str, tuple[str, tuple]] = {
+    "get_user_by_identifier": (
+        """
+        SELECT u.* FROM user_identifiers i JOIN users u ON u.id = i.user_id
+        WHERE i.identifier = ?
+        """,
+        ("13800138000",),
+    ),
+    "verify_code": (
+        """
+        SELECT id FROM verification_codes
+        WHERE identifier = ? AND code = ? AND code_type = ?
+        AND used = 0 AND expires_ts > ?
+        """,
+        ("13800138000", "123456", "sms", 1735689600),
+    ),
+    "send_code_rate_limit": (
+        """
+        SELECT COUNT(*) FROM verification_codes
+        WHERE identifier = ? AND created_ts > ?
+        """,
+        ("13800138000", 1735689600),
+    ),
+    "get_user_generations": (
+        """
+        SELECT * FROM generations WHERE user_id = ? AND expires_ts > ?
+        ORDER BY created_ts DESC LIMIT 50
+        """,
+        (1, 1735689600),
+    ),
+    "sweep_expired_codes": (
+        """
+        SELECT rowid FROM verification_codes WHERE expires_ts < ? LIMIT 500
+        """,
+        (1735689600,),
+    ),
+    "sweep_expired_generations": (
+        "SELECT id FROM generations WHERE expires_ts < ? LIMIT 500",
+        (1735689600,),
+    ),
+    "token_revocations_since": (
+        "SELECT user_id, revoked_ts FROM token_revocations WHERE revoked_ts >= ?",
+        (1735689600,),
+    ),
+    "claim_jobs": (
+        """
+        SELECT id FROM jobs
+        WHERE state = 'queued' AND available_ts <= ? AND kind IN ('image', 'video')
+        ORDER BY available_ts LIMIT 1
+        """,
+        (1735689600,),
+    ),
+    "reap_job_leases": (
+        "SELECT id FROM jobs WHERE state = 'running' AND lease_expires_ts < ?",
+        (1735689600,),
+    ),
+    "get_user_poses": (
+        "SELECT * FROM user_poses WHERE user_id = ? ORDER BY created_at DESC",
+        (1,),
+    ),
+    "get_all_system_poses": (
+        "SELECT * FROM system_poses WHERE is_active = 1 ORDER BY category, id",
+        (),
+    ),
+    "daily_statistics_range": (
+        """
+        SELECT * FROM daily_statistics
+        WHERE stat_date BETWEEN ? AND ? ORDER BY stat_date
+        """,
+        ("2025-01-01", "2025-01-31"),
+    ),
+    "admin_list_users_page": (
+        """
+        SELECT u.id, u.email, q.free_generations
+        FROM users u
+        LEFT JOIN user_quotas q ON u.id = q.user_id
+        WHERE (u.created_at, u.id) < (?, ?)
+        ORDER BY u.created_at DESC, u.id DESC
+        LIMIT 51
+        """,
+        ("2025-01-01 00:00:00", 1),
+    ),
+    "blob_references": (
+        """
+        SELECT source_image_hash FROM generations WHERE source_image_hash IN (?, ?)
+        UNION
+        SELECT source_image_hash FROM user_poses WHERE source_image_hash IN (?, ?)
+        """,
+        ("a" * 64, "b" * 64, "a" * 64, "b" * 64),
+    ),
+    "live_job_images": (
+        """
+        SELECT json_extract(payload, '$.source_image_hash') FROM jobs
+        WHERE state = 'queued'
+        UNION ALL
+        SELECT json_extract(payload, '$.source_image_hash') FROM jobs
+        WHERE state = 'running'
+        """,
+        (),
+    ),
+}
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn: sqlite3.Connection) -> list[int]:
+    """执行所有未执行的迁移，返回本次执行的版本号"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        if version <= current_version(conn):
+            continue
+
+        # BEGIN IMMEDIATE 拿到写锁后再确认一次版本，避免多个进程重复执行同一迁移
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= current_version(conn):
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description),
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def explain(conn: sqlite3.Connection, sql: str, params: tuple = ()) -> list[str]:
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def full_scans(plan: list[str]) -> list[str]:
+    """找出执行计划中的全表扫描（按索引顺序扫描不算）"""
+    return [
+        step
+        for step in plan
+        if step.startswith("SCAN")
+        and "USING" not in step
+        and "CONSTANT ROW" not in step
+    ]
+
+
+def check_query_plans(conn: sqlite3.Connection) -> dict[str, list[str]]:
+    """返回出现全表扫描的热点查询及其扫描步骤"""
+    failures = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        scans = full_scans(explain(conn, sql, params))
+        if scans:
+            failures[name] = scans
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数据库迁移")
+    parser.add_argument("--db", default=str(Path(__file__).parent / "app.db"))
+    parser.add_argument("--check", action="store_true", help="检查热点查询是否走索引")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        applied = migrate(conn)
+        print(f"当前版本: {current_version(conn)}，本次执行: {applied or '无'}")
+
+        if args.check:
+            failures = check_query_plans(conn)
+            for name in HOT_QUERIES:
+                print(f"[{'FAIL' if name in failures else 'OK'}] {name}")
+                for step in failures.get(name, []):
+                    print(f"       {step}")
+            if failures:
+                sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
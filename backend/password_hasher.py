@@ -0,0 +1,176 @@
+"""
+密码哈希进程池
+
+bcrypt 每次计算要占满一个CPU几百毫秒，放在请求线程里会拖住同步线程池
+（api_simple 中甚至会阻塞事件循环）。这里把哈希和校验交给专用进程池执行：
+同时在途的任务数有上限，超过上限立即抛出 HasherBusy，由接口返回 503，
+不让请求在队列里无限堆积。bcrypt 轮数按本机速度校准到延迟预算以内。
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from passlib.hash import bcrypt
+
+# 轮数下限：再低就不值得用 bcrypt 了；上限避免慢机器误测后轮数过高
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+
+class HasherBusy(RuntimeError):
+    """在途的哈希任务已达上限"""
+
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.using(rounds=rounds).hash(password)
+
+
+def _verify(password: str, hashed: str) -> bool:
+    # 轮数保存在哈希值中，已有的哈希按生成时的轮数校验
+    try:
+        return bcrypt.verify(password, hashed)
+    except ValueError:
+        # 非 bcrypt 格式（如被封禁用户的 'BLOCKED'）视为校验失败
+        return False
+
+
+def calibrate_rounds(target_ms: float, samples: int = 3) -> int:
+    """
+    返回耗时不超过 target_ms 的最大 bcrypt 轮数
+
+    轮数每加 1 耗时翻倍，只需测一次最低轮数的耗时即可推算。
+    """
+    elapsed = min(_timed_hash(MIN_ROUNDS) for _ in range(samples))
+    rounds = MIN_ROUNDS
+    while rounds < MAX_ROUNDS and elapsed * 2 * 1000 <= target_ms:
+        elapsed *= 2
+        rounds += 1
+    return rounds
+
+
+def _timed_hash(rounds: int) -> float:
+    started = time.perf_counter()
+    _hash("calibration", rounds)
+    return time.perf_counter() - started
+
+
+class PasswordHasher:
+    """
+    在进程池中执行 bcrypt 的哈希器，由应用的 lifespan 启停
+
+    workers=0 时在调用线程中直接计算（仅用于基准对比）；未启动时首次使用会自动启动。
+    """
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        max_pending: int | None = None,
+        target_ms: float | None = None,
+        rounds: int | None = None,
+    ):
+        if workers is None:
+            workers = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+        if max_pending is None:
+            max_pending = int(os.getenv("PASSWORD_HASH_MAX_PENDING", workers * 8 or 8))
+        if target_ms is None:
+            target_ms = float(os.getenv("PASSWORD_HASH_TARGET_MS", "250"))
+        if rounds is None and os.getenv("BCRYPT_ROUNDS"):
+            rounds = int(os.getenv("BCRYPT_ROUNDS"))
+
+        self.workers = workers
+        self.max_pending = max_pending
+        self.target_ms = target_ms
+        self.rounds = rounds
+        self.pending = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._executor: ProcessPoolExecutor | None = None
+
+    def start(self):
+        """创建进程池并校准轮数；校准在工作进程中执行，顺带预热进程池"""
+        with self._lock:
+            if self._executor is not None or self.workers <= 0:
+                return
+            # Linux 下进程池以 fork 方式一次性创建全部工作进程，应在其他后台线程启动前调用
+            self._executor = ProcessPoolExecutor(self.workers)
+        if self.rounds is None:
+            self.rounds = self._executor.submit(
+                calibrate_rounds, self.target_ms
+            ).result()
+            print(f"bcrypt 轮数校准为 {self.rounds}（目标 {self.target_ms:.0f}ms）")
+
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def hash(self, password: str) -> str:
+        return self._submit(_hash, password, self._rounds()).result()
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self._submit(_verify, password, hashed).result()
+
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.wrap_future(self._submit(_hash, password, self._rounds()))
+
+    async def verify_async(self, password: str, hashed: str) -> bool:
+        return await asyncio.wrap_future(self._submit(_verify, password, hashed))
+
+    def metrics(self) -> dict:
+        return {
+            "workers": self.workers,
+            "rounds": self.rounds,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+        }
+
+    def _rounds(self) -> int:
+        if self.rounds is None:
+            self.start()
+        if self.rounds is None:
+            # workers=0 且未指定轮数
+            self.rounds = calibrate_rounds(self.target_ms)
+        return self.rounds
+
+    def _submit(self, fn, *args) -> Future:
+        if self.workers <= 0:
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+        if self._executor is None:
+            self.start()
+
+        with self._lock:
+            # 在锁内取进程池的引用，并发的 stop() 不会在检查之后把它置为 None
+            executor = self._executor
+            if executor is None:
+                raise HasherBusy("密码校验服务已停止，请稍后重试")
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HasherBusy("密码校验繁忙，请稍后重试")
+            self.pending += 1
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            # 进程池已关闭或损坏（BrokenProcessPool）时任务没有提交，计数要退回
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future: Future | None):
+        with self._lock:
+            self.pending -= 1
+
+
+password_hasher = PasswordHasher()
+
+
+if __name__ == "__main__":
+    target = float(os.getenv("PASSWORD_HASH_TARGET_MS", "250"))
+    print(f"本机 bcrypt 轮数: {calibrate_rounds(target)}（目标 {target:.0f}ms）")
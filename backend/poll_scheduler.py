@@ -0,0 +1,331 @@
+"""
+外部生成任务的集中轮询
+
+所有进行中的请求ID由一个调度协程统一管理：按下一次查询时间排成小顶堆，
+只在堆顶到期时发起查询，并发查询数有上限。首次查询安排在按历史耗时
+预测的完成时间附近，未完成时再按抖动退避继续查询。
+
+耗时按 (模型, 帧数, 分辨率) 分别学习：均值和平均偏差都是指数滑动平均，
+保存在 provider_durations 表中，重启后和其他 worker 进程都能沿用。
+"""
+
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+from database import Database
+
+
+def duration_key(model: str, num_frames: int, image_size: str) -> str:
+    return f"{model}|{num_frames}|{image_size}"
+
+
+class DurationModel:
+    """
+    各类请求的耗时估计：key -> [样本数, 均值, 平均偏差]
+
+    没有历史数据时使用调用方给出的静态估计。
+    """
+
+    # 指数滑动平均的权重，越大越快跟上服务端的变化；样本不足 1/ALPHA 个时按算术平均
+    ALPHA = 0.05
+
+    def __init__(self, database: Database | None = None):
+        self.database = database
+        self._stats: dict[str, list[float]] = {}
+        self._loaded = database is None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self):
+        if self._loaded:
+            return
+        with self.database.connection() as conn:
+            rows = conn.execute(
+                "SELECT key, samples, mean_seconds, deviation_seconds FROM provider_durations"
+            ).fetchall()
+        for key, samples, mean, deviation in rows:
+            self._stats[key] = [samples, mean, deviation]
+        self._loaded = True
+
+    def estimate(self, key: str, fallback: float) -> tuple[float, float]:
+        """返回 (预计耗时, 平均偏差)，单位秒"""
+        self.load()
+        stats = self._stats.get(key)
+        if stats is None:
+            return fallback, fallback / 2
+        # 偏差不低于均值的5%，首次查询总是略早于预计完成时间
+        return stats[1], max(stats[2], stats[1] / 20)
+
+    def observe(self, key: str, seconds: float):
+        self.load()
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = [1, seconds, seconds / 4]
+        else:
+            samples = stats[0] + 1
+            alpha = max(self.ALPHA, 1 / samples)
+            error = seconds - stats[1]
+            stats = [
+                samples,
+                stats[1] + alpha * error,
+                stats[2] + alpha * (abs(error) - stats[2]),
+            ]
+        self._stats[key] = stats
+        if self.database is not None:
+            with self.database.connection() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO provider_durations
+                        (key, samples, mean_seconds, deviation_seconds, updated_ts)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET
+                        samples = excluded.samples,
+                        mean_seconds = excluded.mean_seconds,
+                        deviation_seconds = excluded.deviation_seconds,
+                        updated_ts = excluded.updated_ts
+                """,
+                    (key, int(stats[0]), stats[1], stats[2], int(time.time())),
+                )
+
+    def metrics(self) -> dict:
+        return {
+            key: {
+                "samples": int(samples),
+                "mean_seconds": round(mean, 1),
+                "deviation_seconds": round(deviation, 1),
+            }
+            for key, (samples, mean, deviation) in self._stats.items()
+        }
+
+
+@dataclass
+class _Tracked:
+    request_id: str
+    key: str
+    submitted_at: Optional[float]  # 本进程不知道提交时间（续等别处提交的请求）时为 None
+    eta: float
+    deadline: float
+    cap: float
+    future: asyncio.Future
+    due: float = 0.0
+    delay: float = 0.0
+    polls: int = 0
+    last_pending: Optional[float] = None
+    expected: float = 0.0
+    deviation: float = 0.0
+    on_eta: Optional[Callable[[float], None]] = None
+    reported_eta: float = 0.0
+
+
+class PollScheduler:
+    """
+    单个协程负责所有请求的状态查询，在客户端的事件循环中运行
+
+    track() 登记一个请求并等待其结束，返回 (最终状态, 查询次数)；
+    status 为查询函数，返回带 status 字段（InQueue/InProgress/Succeed/Failed）的对象。
+    """
+
+    def __init__(
+        self,
+        status: Callable[[str], Awaitable],
+        durations: DurationModel,
+        max_concurrent_polls: int = 8,
+        min_interval: float = 2.0,
+        max_interval: float = 5.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.status = status
+        self.durations = durations
+        self.max_concurrent_polls = max_concurrent_polls
+        # 首次查询后退避的起点；退避上限取预计耗时的1/10与平均偏差的一半中较小者，
+        # 且不小于 max_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.clock = clock
+        self.polls = 0
+        self.completed = 0
+        self._heap: list[tuple[float, int, str]] = []
+        self._tracked: dict[str, _Tracked] = {}
+        self._seq = itertools.count()
+        self._changed: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._slots: asyncio.Semaphore | None = None
+
+    def eta(self, request_id: str) -> float | None:
+        tracked = self._tracked.get(request_id)
+        return tracked.eta if tracked else None
+
+    def estimate(self, key: str, fallback: float) -> float:
+        return self.durations.estimate(key, fallback)[0]
+
+    async def track(
+        self,
+        request_id: str,
+        key: str,
+        fallback: float,
+        submitted_at: float | None = None,
+        deadline: float | None = None,
+        on_eta: Callable[[float], None] | None = None,
+    ) -> tuple[object, int]:
+        """
+        Args:
+            fallback: 该类请求没有历史数据时的静态耗时估计
+            submitted_at: 提交时间（time.time()），用于安排首次查询和学习耗时
+            deadline: 从现在起最长等待的秒数，默认为预计耗时的4倍（不少于5分钟）
+            on_eta: 超过预计时间、预计完成时间被推后时以新的时间调用（在线程池中执行），
+                用于持久化给客户端查询
+        """
+        self._ensure_running()
+        if not self.durations.loaded:
+            # 首次使用时从数据库读取历史耗时，不阻塞事件循环
+            await asyncio.to_thread(self.durations.load)
+        now = self.clock()
+        expected, deviation = self.durations.estimate(key, fallback)
+        start = submitted_at if submitted_at is not None else now
+        if deadline is None:
+            deadline = max(300.0, 4 * expected)
+        tracked = _Tracked(
+            request_id=request_id,
+            key=key,
+            submitted_at=submitted_at,
+            eta=start + expected,
+            deadline=now + deadline,
+            cap=max(self.max_interval, min(expected / 10, deviation / 2)),
+            future=asyncio.get_running_loop().create_future(),
+            delay=self.min_interval,
+            expected=expected,
+            deviation=deviation,
+            on_eta=on_eta,
+        )
+        tracked.reported_eta = tracked.eta
+        # 首次查询在预计完成时间前两个平均偏差处（至少过半），已经过了就尽快查询
+        first = start + max(expected - 2 * deviation, expected / 2)
+        self._tracked[request_id] = tracked
+        self._schedule(tracked, max(first, now))
+        try:
+            return await tracked.future
+        finally:
+            self._tracked.pop(request_id, None)
+
+    def metrics(self) -> dict:
+        return {
+            "tracked": len(self._tracked),
+            "polls": self.polls,
+            "completed": self.completed,
+            "polls_per_request": (
+                round(self.polls / self.completed, 2) if self.completed else None
+            ),
+            "durations": self.durations.metrics(),
+        }
+
+    async def close(self):
+        """停止调度协程；仍在等待的调用方收到 CancelledError"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for tracked in list(self._tracked.values()):
+            tracked.future.cancel()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._changed = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_concurrent_polls)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def _schedule(self, tracked: _Tracked, due: float):
+        tracked.due = due
+        heapq.heappush(self._heap, (due, next(self._seq), tracked.request_id))
+        self._changed.set()
+
+    async def _run(self):
+        while True:
+            self._changed.clear()
+            if not self._heap:
+                await self._changed.wait()
+                continue
+            due, _, request_id = self._heap[0]
+            wait = due - self.clock()
+            if wait > 0:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            tracked = self._tracked.get(request_id)
+            # 调用方已放弃等待，或是被重新安排后留下的旧条目
+            if tracked is None or tracked.future.done() or tracked.due != due:
+                continue
+            await self._slots.acquire()
+            asyncio.get_running_loop().create_task(self._poll(tracked))
+
+    async def _poll(self, tracked: _Tracked):
+        try:
+            status = await self.status(tracked.request_id)
+        except Exception as e:
+            if getattr(e, "retryable", False) and self.clock() < tracked.deadline:
+                self._next(tracked)
+                await self._report_eta(tracked)
+            elif not tracked.future.done():
+                tracked.future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        self.polls += 1
+        tracked.polls += 1
+        now = self.clock()
+        if status.status in ("Succeed", "Failed"):
+            if status.status == "Succeed" and tracked.submitted_at is not None:
+                await self._learn(tracked, now)
+            self.completed += 1
+            if not tracked.future.done():
+                tracked.future.set_result((status, tracked.polls))
+            return
+        tracked.last_pending = now
+        if now >= tracked.deadline:
+            if not tracked.future.done():
+                tracked.future.set_exception(TimeoutError(tracked.request_id))
+            return
+        self._next(tracked)
+        await self._report_eta(tracked)
+
+    async def _report_eta(self, tracked: _Tracked):
+        # 只在推后至少1秒时通知，预计完成时间以整秒保存
+        if tracked.on_eta is None or tracked.eta < tracked.reported_eta + 1:
+            return
+        tracked.reported_eta = tracked.eta
+        try:
+            await asyncio.to_thread(tracked.on_eta, tracked.eta)
+        except Exception as e:
+            print(f"保存预计完成时间失败: {e}")
+
+    async def _learn(self, tracked: _Tracked, now: float):
+        if tracked.last_pending is not None:
+            # 完成时间在上一次“未完成”和这一次之间，取中点
+            finished = (tracked.last_pending + now) / 2
+        else:
+            # 首次查询就已完成，只知道完成得比预计早；按早一个偏差（至少预计耗时的10%）计，
+            # 否则估计偏大时首次查询总能命中，估计值再也降不下来
+            finished = now - max(tracked.deviation, tracked.expected / 10)
+        try:
+            await asyncio.to_thread(
+                self.durations.observe,
+                tracked.key,
+                max(0.0, finished - tracked.submitted_at),
+            )
+        except Exception as e:
+            print(f"保存生成耗时失败: {e}")
+
+    def _next(self, tracked: _Tracked):
+        # 超过预计时间后从 min_interval 起按1.5倍退避，取 [d/2, d] 内的随机值
+        wait = random.uniform(tracked.delay / 2, tracked.delay)
+        tracked.delay = min(tracked.cap, tracked.delay * 1.5)
+        tracked.eta = max(tracked.eta, self.clock() + wait)
+        self._schedule(tracked, min(self.clock() + wait, tracked.deadline))
@@ -0,0 +1,579 @@
+"""
+服务商API密钥池
+
+api_keys 表中的密钥用 Fernet 加密保存，加密密钥来自环境变量 API_KEY_ENCRYPTION_KEY，
+未设置时使用 API_KEY_ENCRYPTION_KEY_PATH（默认 backend/api_key_secret.key），不存在时自动生成。
+每个进程在内存中持有解密后的密钥，后台线程每隔 interval 秒重新读取，
+管理后台新增、停用、轮换的密钥无需重启即可生效。
+
+选取密钥时在可用的密钥中按 优先级 × 本分钟剩余请求数 加权随机，
+跳过熔断中、速率额度或本月额度用完的密钥。每把密钥一个熔断器：
+429 立即熔断（有 Retry-After 时按其时长），5xx 连续 failure_threshold（默认3）次后熔断；
+冷却结束后放行一个试探请求，成功则恢复，失败则冷却时间翻倍。
+某个服务商在表中没有启用的密钥时，使用环境变量中配置的密钥（id 为 0）。
+"""
+
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from database import Database, db
+from write_buffer import CounterBuffer
+
+PROVIDERS = ("siliconflow", "gemini")
+
+
+class NoKeyAvailable(RuntimeError):
+    """没有可用的密钥；retry_after 为最早有密钥恢复可用的秒数（未知时为 None）"""
+
+    def __init__(self, provider: str, retry_after: float | None = None):
+        super().__init__(f"没有可用的 {provider} API密钥")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class DuplicateKey(ValueError):
+    """密钥已存在（key_hash 重复）"""
+
+
+class KeyAlreadyRotated(ValueError):
+    """密钥已被轮换，只能轮换最新的密钥"""
+
+
+def key_hash(secret: str) -> str:
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+_cipher = None
+_cipher_lock = threading.Lock()
+
+
+def cipher():
+    """加密 api_keys.encrypted_key 用的 Fernet 实例，首次使用时加载"""
+    global _cipher
+    with _cipher_lock:
+        if _cipher is None:
+            from cryptography.fernet import Fernet
+
+            secret = os.getenv("API_KEY_ENCRYPTION_KEY")
+            if not secret:
+                path = Path(
+                    os.getenv(
+                        "API_KEY_ENCRYPTION_KEY_PATH",
+                        str(Path(__file__).parent / "api_key_secret.key"),
+                    )
+                )
+                if not path.exists():
+                    _create_secret(path, Fernet.generate_key())
+                secret = path.read_text(encoding="utf-8").strip()
+            _cipher = Fernet(secret)
+        return _cipher
+
+
+def _create_secret(path: Path, secret: bytes):
+    """多个 worker 同时启动时只有一个能创建成功，与 signing_keys 的做法相同"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(secret)
+    try:
+        os.link(tmp, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp)
+
+
+class CircuitBreaker:
+    """单把密钥的熔断器：closed -> open -> half_open -> closed/open"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+        max_reset_timeout: float = 120.0,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.timeout = reset_timeout
+        self.open_until = 0.0
+        self._trial_started = 0.0
+
+    def available(self, now: float) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return now >= self.open_until
+        # 半开时只放行一个试探请求；超过冷却时间仍没有结果，视为丢失，再放行一个
+        return now - self._trial_started >= self.reset_timeout
+
+    def wait(self, now: float) -> float:
+        """距离可以再次选用的秒数"""
+        if self.state == self.OPEN:
+            return max(0.0, self.open_until - now)
+        if self.state == self.HALF_OPEN:
+            return max(0.0, self._trial_started + self.reset_timeout - now)
+        return 0.0
+
+    def acquire(self, now: float):
+        if self.state != self.CLOSED:
+            self.state = self.HALF_OPEN
+            self._trial_started = now
+
+    def success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.timeout = self.reset_timeout
+
+    def failure(self, now: float, trip: bool = False, retry_after: float | None = None):
+        self.failures += 1
+        if self.state == self.HALF_OPEN:
+            # 试探失败，冷却时间翻倍
+            self.timeout = min(self.timeout * 2, self.max_reset_timeout)
+            trip = True
+        if trip or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.open_until = now + (
+                self.timeout if retry_after is None else retry_after
+            )
+            self.trips += 1
+
+
+@dataclass
+class PooledKey:
+    id: int
+    provider: str
+    name: str
+    secret: str = field(repr=False)
+    priority: int = 1
+    active: bool = True
+    monthly_limit: int | None = None
+    rate_limit: int | None = None  # 每分钟请求数，None 表示不限
+    usage: int = 0  # 表中记录的本月用量，不含尚未写入的增量
+    updated_ts: int = 0
+    tokens: float = 0.0
+    refilled_at: float = 0.0
+    selected: int = 0
+    breaker: CircuitBreaker = field(default_factory=CircuitBreaker)
+
+    def refill(self, now: float):
+        if self.rate_limit:
+            rate = self.rate_limit / 60
+            self.tokens = min(
+                self.rate_limit, self.tokens + (now - self.refilled_at) * rate
+            )
+            self.refilled_at = now
+
+    def headroom(self) -> float:
+        """剩余速率额度的比例（0~1），不限速时为 1"""
+        return self.tokens / self.rate_limit if self.rate_limit else 1.0
+
+
+class ProviderKeyPool:
+    """
+    进程内的密钥池，由应用的 lifespan 启停
+
+    acquire() 选一把密钥用于新请求；get() 按 id 取指定密钥（查询某个请求的状态时
+    必须使用提交它的密钥，已停用、已轮换的密钥仍可取到）；请求结束后调用 report()
+    更新熔断器，计费的调用再调用 record_usage()。
+    """
+
+    def __init__(
+        self,
+        database: Database | None = None,
+        static: dict[str, str] | None = None,
+        interval: float | None = None,
+        clock=time.time,
+    ):
+        if interval is None:
+            interval = float(os.getenv("API_KEY_RELOAD_INTERVAL", "5"))
+        self.database = database
+        self.interval = interval
+        self.clock = clock
+        self._keys: dict[int, PooledKey] = {}
+        self._static = {
+            provider: PooledKey(0, provider, f"env:{provider}", secret)
+            for provider, secret in (static or {}).items()
+            if secret
+        }
+        self._usage = CounterBuffer(self._flush_usage, interval=5.0)
+        self._refreshed_at: float | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.database is None:
+            return
+        self.refresh()
+        self._usage.start()
+        if self.running or self.interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="provider-keys", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float | None = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self.database is not None:
+            self._usage.stop(timeout)
+
+    def refresh(self):
+        """重新读取密钥表；只解密新增或变更过的行，熔断状态和速率额度保留"""
+        if self.database is None:
+            return
+        with self.database.connection() as conn:
+            rows = conn.execute("""
+                SELECT id, provider, key_name, encrypted_key, is_active, priority,
+                       monthly_limit, rate_limit_per_minute, current_usage,
+                       usage_month, updated_ts
+                FROM api_keys
+                """).fetchall()
+        month = _month(self.clock())
+        with self._lock:
+            keys = {}
+            for row in rows:
+                key = self._keys.get(row[0])
+                if key is None or key.updated_ts != row[10]:
+                    try:
+                        secret = cipher().decrypt(row[3].encode()).decode()
+                    except Exception as e:
+                        print(f"API密钥 {row[0]} 解密失败，已跳过: {e}")
+                        continue
+                    if key is None:
+                        key = PooledKey(row[0], row[1], row[2], secret)
+                    key.secret = secret
+                key.name = row[2]
+                key.active = bool(row[4])
+                key.priority = max(0, row[5])
+                key.monthly_limit = row[6] or None
+                if key.rate_limit != row[7]:
+                    key.rate_limit = row[7] or None
+                    key.tokens = float(key.rate_limit or 0)
+                    key.refilled_at = self.clock()
+                key.usage = row[8] if row[9] == month else 0
+                key.updated_ts = row[10]
+                keys[key.id] = key
+            self._keys = keys
+            self._refreshed_at = time.monotonic()
+
+    def available(self, provider: str) -> bool:
+        """是否配置了该服务商的密钥（不论当前是否熔断）"""
+        self._maybe_refresh()
+        return bool(self._candidates(provider))
+
+    def acquire(self, provider: str) -> PooledKey:
+        """按 优先级 × 剩余请求数 加权随机选一把可用的密钥"""
+        self._maybe_refresh()
+        now = self.clock()
+        with self._lock:
+            candidates = self._candidates(provider)
+            if not candidates:
+                raise NoKeyAvailable(provider)
+            pending = self._usage.pending
+            usable, waits = [], []
+            for key in candidates:
+                key.refill(now)
+                wait = key.breaker.wait(now) if not key.breaker.available(now) else 0
+                if key.rate_limit and key.tokens < 1:
+                    wait = max(wait, (1 - key.tokens) * 60 / key.rate_limit)
+                used = key.usage + pending.get((key.id, _month(now)), 0)
+                if key.monthly_limit and used >= key.monthly_limit:
+                    continue
+                if wait:
+                    waits.append(wait)
+                elif key.priority > 0:
+                    usable.append(key)
+            if not usable:
+                raise NoKeyAvailable(provider, min(waits) if waits else None)
+            # 权重按剩余请求数（而不是比例）计，限额大的密钥分到的请求相应更多；
+            # 不限速的密钥按候选中最大的限额计
+            scale = max((key.rate_limit or 0 for key in candidates), default=0) or 1
+            key = random.choices(
+                usable,
+                [
+                    key.priority * max(key.tokens if key.rate_limit else scale, 0.01)
+                    for key in usable
+                ],
+            )[0]
+            key.breaker.acquire(now)
+            if key.rate_limit:
+                key.tokens -= 1
+            key.selected += 1
+            return key
+
+    def get(self, provider: str, key_id: int) -> PooledKey:
+        """按 id 取密钥，不检查熔断和额度"""
+        key = self._static.get(provider) if key_id == 0 else self._keys.get(key_id)
+        if key is None and key_id != 0:
+            # 可能是其他进程刚添加的密钥
+            self.refresh()
+            key = self._keys.get(key_id)
+        if key is None or key.provider != provider:
+            raise NoKeyAvailable(provider)
+        return key
+
+    def report(
+        self,
+        key: PooledKey,
+        status_code: int,
+        retry_after: float | None = None,
+        remaining: int | None = None,
+    ):
+        """
+        记录一次调用的结果
+
+        Args:
+            retry_after: 429 响应的 Retry-After 秒数
+            remaining: 响应头中服务端告知的剩余请求数，用于校正本地的速率额度
+        """
+        now = self.clock()
+        with self._lock:
+            if remaining is not None and key.rate_limit:
+                key.refill(now)
+                key.tokens = min(key.tokens, float(remaining))
+            if status_code == 429:
+                key.tokens = min(key.tokens, 0.0)
+                if retry_after is None and key.rate_limit:
+                    # 没有 Retry-After 时按本地额度恢复一个请求所需的时间冷却
+                    retry_after = 60 / key.rate_limit
+                key.breaker.failure(now, trip=True, retry_after=retry_after)
+            elif status_code in (401, 403):
+                # 密钥失效或被吊销，按最长冷却时间熔断，等待管理员轮换
+                key.breaker.failure(
+                    now, trip=True, retry_after=key.breaker.max_reset_timeout
+                )
+            elif status_code >= 500:
+                key.breaker.failure(now)
+            else:
+                key.breaker.success()
+
+    def record_usage(self, key: PooledKey, n: int = 1):
+        if key.id and self.database is not None:
+            self._usage.add((key.id, _month(self.clock())), n)
+
+    def keys(self, provider: str | None = None) -> list[PooledKey]:
+        with self._lock:
+            keys = list(self._keys.values()) + list(self._static.values())
+        return [k for k in keys if provider is None or k.provider == provider]
+
+    def state(self, key_id: int) -> dict | None:
+        """密钥在本进程中的运行状态，供管理后台展示"""
+        key = self._keys.get(key_id)
+        if key is None:
+            return None
+        return {
+            "breaker": key.breaker.state,
+            "breaker_trips": key.breaker.trips,
+            "rate_headroom": round(key.headroom(), 2),
+            "selected": key.selected,
+        }
+
+    def metrics(self) -> dict:
+        return {
+            f"{key.provider}:{key.id}": {
+                "active": key.active,
+                "priority": key.priority,
+                **self.state(key.id),
+            }
+            for key in self.keys()
+            if key.id
+        } | {
+            f"{key.provider}:env": {"breaker": key.breaker.state}
+            for key in self._static.values()
+        }
+
+    # 管理后台
+    def create(
+        self,
+        provider: str,
+        key_name: str,
+        secret: str,
+        created_by: int,
+        priority: int = 1,
+        monthly_limit: int | None = 10000,
+        rate_limit_per_minute: int | None = None,
+        is_active: bool = True,
+    ) -> int:
+        if provider not in PROVIDERS:
+            raise ValueError(f"不支持的服务商: {provider}")
+        try:
+            with self.database.connection() as conn:
+                key_id = conn.execute(
+                    """
+                    INSERT INTO api_keys (
+                        key_name, provider, encrypted_key, key_hash, is_active,
+                        priority, monthly_limit, rate_limit_per_minute,
+                        created_by, updated_ts
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    RETURNING id
+                    """,
+                    (
+                        key_name,
+                        provider,
+                        cipher().encrypt(secret.encode()).decode(),
+                        key_hash(secret),
+                        int(is_active),
+                        priority,
+                        monthly_limit,
+                        rate_limit_per_minute,
+                        created_by,
+                        int(time.time()),
+                    ),
+                ).fetchone()[0]
+        except sqlite3.IntegrityError:
+            raise DuplicateKey("该API密钥已存在")
+        self.refresh()
+        return key_id
+
+    def rotate(self, key_id: int, secret: str, created_by: int) -> int:
+        """
+        用新密钥替换旧密钥，返回新密钥id
+
+        新密钥沿用旧密钥的名称、优先级、额度和本月用量；旧密钥停用，
+        不再分配给新请求，但已经用它提交的请求仍用它查询状态。
+        """
+        # 先写入缓冲中的用量，新密钥拿到的本月用量才是准确的
+        self._usage.flush()
+        now = int(time.time())
+        try:
+            with self.database.connection() as conn:
+                old = conn.execute(
+                    "SELECT replaced_by FROM api_keys WHERE id = ?", (key_id,)
+                ).fetchone()
+                if old is None:
+                    raise KeyError(key_id)
+                if old[0] is not None:
+                    raise KeyAlreadyRotated("该密钥已被轮换，请轮换最新的密钥")
+                new_id = conn.execute(
+                    """
+                    INSERT INTO api_keys (
+                        key_name, provider, encrypted_key, key_hash, is_active,
+                        priority, monthly_limit, rate_limit_per_minute,
+                        current_usage, usage_month, last_rotated_at,
+                        created_by, updated_ts
+                    )
+                    SELECT key_name, provider, ?, ?, is_active,
+                           priority, monthly_limit, rate_limit_per_minute,
+                           current_usage, usage_month, CURRENT_TIMESTAMP,
+                           ?, ?
+                    FROM api_keys WHERE id = ?
+                    RETURNING id
+                    """,
+                    (
+                        cipher().encrypt(secret.encode()).decode(),
+                        key_hash(secret),
+                        created_by,
+                        now,
+                        key_id,
+                    ),
+                ).fetchone()[0]
+                # 条件更新：并发轮换同一把密钥时只有一个成功，另一个整体回滚
+                rotated = conn.execute(
+                    """
+                    UPDATE api_keys SET is_active = 0, replaced_by = ?, updated_ts = ?
+                    WHERE id = ? AND replaced_by IS NULL
+                    """,
+                    (new_id, now, key_id),
+                ).rowcount
+                if not rotated:
+                    raise KeyAlreadyRotated("该密钥已被轮换，请轮换最新的密钥")
+        except sqlite3.IntegrityError:
+            raise DuplicateKey("该API密钥已存在")
+        self.refresh()
+        return new_id
+
+    def list_keys(self) -> list[dict]:
+        with self.database.connection() as conn:
+            cursor = conn.execute("""
+                SELECT id, key_name, provider, is_active, priority, monthly_limit,
+                       rate_limit_per_minute, current_usage, usage_month,
+                       replaced_by, created_at, last_rotated_at
+                FROM api_keys ORDER BY id
+                """)
+            columns = [c[0] for c in cursor.description]
+            rows = cursor.fetchall()
+        month = _month(self.clock())
+        result = []
+        for row in rows:
+            item = dict(zip(columns, row))
+            item["is_active"] = bool(item["is_active"])
+            if item.pop("usage_month") != month:
+                item["current_usage"] = 0
+            item["runtime"] = self.state(item["id"])
+            result.append(item)
+        return result
+
+    def _candidates(self, provider: str) -> list[PooledKey]:
+        keys = [
+            key
+            for key in self._keys.values()
+            if key.provider == provider and key.active
+        ]
+        if not keys and provider in self._static:
+            keys = [self._static[provider]]
+        return keys
+
+    def _maybe_refresh(self):
+        # 后台线程未运行时（脚本、测试）按同样的间隔同步刷新
+        if self.database is None or self.running:
+            return
+        if (
+            self._refreshed_at is None
+            or time.monotonic() - self._refreshed_at >= self.interval
+        ):
+            self.refresh()
+
+    def _flush_usage(self, batch: dict):
+        with self.database.connection() as conn:
+            conn.executemany(
+                """
+                UPDATE api_keys SET
+                    current_usage = CASE WHEN usage_month = ?
+                        THEN current_usage + ? ELSE ? END,
+                    usage_month = ?
+                WHERE id = ?
+                """,
+                [(month, n, n, month, key_id) for (key_id, month), n in batch.items()],
+            )
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"刷新API密钥失败，稍后重试: {e}")
+
+
+def _month(ts: float) -> str:
+    return time.strftime("%Y-%m", time.gmtime(ts))
+
+
+provider_keys = ProviderKeyPool(
+    db,
+    static={
+        "siliconflow": os.getenv("SILICONFLOW_API_KEY", ""),
+        "gemini": os.getenv("GEMINI_API_KEY", ""),
+    },
+)
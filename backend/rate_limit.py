@@ -0,0 +1,376 @@
+"""
+接口限流
+
+令牌桶限流中间件：按客户端IP、登录账号（请求体中的手机号/邮箱）或 token 中的用户限流，
+超限直接返回 429，不访问数据库。令牌桶默认存放在进程内存中，
+过期的桶由时间轮回收；设置 RATE_LIMIT_STORE 后改用 mmap 文件，
+同一台机器上的多个 worker 共享限额。
+"""
+
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Iterator, Optional
+
+from starlette.responses import JSONResponse
+
+from auth import verify_token
+from identifiers import normalize_identifier
+
+# 读取请求体取账号时的大小上限，超过则只按IP限流
+MAX_BODY_SIZE = 64 * 1024
+
+
+class RateLimitRule:
+    """
+    一条限流规则：匹配的请求按 key 分桶，每个桶 period 秒内最多 limit 次
+
+    paths 以 * 结尾表示前缀匹配；key 为 "ip"、"user"（token 中的用户，无有效 token 时按IP）
+    或 "body:<字段名>"（请求体JSON中的账号字段）。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        paths: list[str],
+        limit: int,
+        period: float,
+        key: str = "ip",
+        methods: tuple[str, ...] = ("POST",),
+    ):
+        self.name = name
+        self.exact = {p for p in paths if not p.endswith("*")}
+        self.prefixes = tuple(p[:-1] for p in paths if p.endswith("*"))
+        self.limit = limit
+        self.period = period
+        self.rate = limit / period
+        self.key = key
+        self.methods = methods
+        self.rejected = 0
+
+    def matches(self, method: str, path: str) -> bool:
+        return method in self.methods and (
+            path in self.exact or path.startswith(self.prefixes)
+        )
+
+
+class TimingWheel:
+    """
+    按到期时间分槽的过期队列
+
+    每个槽对应 resolution 秒，advance 只取出已经到期的槽，不需要扫描全部桶；
+    超出一圈的到期时间先放进最远的槽，取出后由调用方按实际到期时间重新安排。
+    """
+
+    def __init__(self, resolution: float = 1.0, slots: int = 512):
+        self.resolution = resolution
+        self._slots: list[set] = [set() for _ in range(slots)]
+        self._tick: int | None = None
+
+    def schedule(self, key, when: float):
+        tick = int(when / self.resolution)
+        if self._tick is not None:
+            tick = min(max(tick, self._tick + 1), self._tick + len(self._slots))
+        self._slots[tick % len(self._slots)].add(key)
+
+    def advance(self, now: float) -> Iterator:
+        current = int(now / self.resolution)
+        if self._tick is None:
+            self._tick = current
+            return
+        # 长时间没有推进时最多转一圈
+        first = max(self._tick + 1, current - len(self._slots) + 1)
+        self._tick = current
+        for tick in range(first, current + 1):
+            slot = self._slots[tick % len(self._slots)]
+            if slot:
+                keys = list(slot)
+                slot.clear()
+                yield from keys
+
+
+class MemoryStore:
+    """进程内令牌桶：key -> [剩余令牌, 更新时间, 桶重新装满的时间]"""
+
+    def __init__(self, wheel: TimingWheel | None = None):
+        self._buckets: dict[str, list[float]] = {}
+        self._wheel = wheel or TimingWheel()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: str, capacity: float, rate: float, now: float) -> float:
+        """取一个令牌，成功返回 0，否则返回需要等待的秒数"""
+        with self._lock:
+            self._expire(now)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens, scheduled = float(capacity), False
+            else:
+                tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                scheduled = True
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            # 桶装满后与不存在等价，可以回收
+            self._buckets[key] = [tokens, now, now + (capacity - tokens) / rate]
+            if not scheduled:
+                self._wheel.schedule(key, self._buckets[key][2])
+            return wait
+
+    def refund(self, key: str, capacity: float, rate: float, now: float):
+        """退还 take() 取走的一个令牌"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate + 1)
+            # 装满时间只会提前，时间轮中原有的安排仍然有效
+            self._buckets[key] = [tokens, now, now + (capacity - tokens) / rate]
+
+    def _expire(self, now: float):
+        for key in self._wheel.advance(now):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                continue
+            if bucket[2] <= now:
+                del self._buckets[key]
+            else:
+                # 期间又被使用过，按新的装满时间重新安排
+                self._wheel.schedule(key, bucket[2])
+
+
+class FileStore:
+    """
+    多个 worker 共享的令牌桶，存放在 mmap 文件的定长槽位中
+
+    key 哈希到槽位后线性探测 PROBES 个槽；都被占用时覆盖最早装满的桶。
+    进程间用 flock 互斥（仅支持 Linux/macOS）。
+    """
+
+    RECORD = struct.Struct("<Qddd")  # key哈希, 剩余令牌, 更新时间, 桶重新装满的时间
+    PROBES = 8
+
+    def __init__(self, path: str, slots: int = 65536):
+        import fcntl
+
+        self._fcntl = fcntl
+        self.slots = slots
+        size = slots * self.RECORD.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        # flock 只在进程之间互斥，同一进程的线程另用锁
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, rate: float, now: float) -> float:
+        key_hash = self._hash(key)
+        with self._lock:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+            try:
+                offset, bucket = self._find(key_hash, now)
+                if bucket is None:
+                    tokens = float(capacity)
+                else:
+                    tokens = min(capacity, bucket[1] + (now - bucket[2]) * rate)
+                wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+                if not wait:
+                    tokens -= 1
+                self.RECORD.pack_into(
+                    self._map,
+                    offset,
+                    key_hash,
+                    tokens,
+                    now,
+                    now + (capacity - tokens) / rate,
+                )
+                return wait
+            finally:
+                self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+
+    def refund(self, key: str, capacity: float, rate: float, now: float):
+        key_hash = self._hash(key)
+        with self._lock:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+            try:
+                offset, bucket = self._find(key_hash, now)
+                if bucket is None:
+                    return
+                tokens = min(capacity, bucket[1] + (now - bucket[2]) * rate + 1)
+                self.RECORD.pack_into(
+                    self._map,
+                    offset,
+                    key_hash,
+                    tokens,
+                    now,
+                    now + (capacity - tokens) / rate,
+                )
+            finally:
+                self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little") or 1
+
+    def _find(self, key_hash: int, now: float) -> tuple[int, Optional[tuple]]:
+        """返回 (槽位偏移, 已有的桶或 None)"""
+        free = oldest = None
+        for i in range(self.PROBES):
+            offset = (key_hash + i) % self.slots * self.RECORD.size
+            record = self.RECORD.unpack_from(self._map, offset)
+            if record[0] == key_hash:
+                return offset, record if record[3] > now else None
+            if free is None and (record[0] == 0 or record[3] <= now):
+                free = offset
+            if oldest is None or record[3] < oldest[1]:
+                oldest = (offset, record[3])
+        return (free if free is not None else oldest[0]), None
+
+
+def default_store():
+    path = os.getenv("RATE_LIMIT_STORE")
+    if path:
+        return FileStore(path, int(os.getenv("RATE_LIMIT_STORE_SLOTS", "65536")))
+    workers = int(os.getenv("API_WORKERS", "1"))
+    if workers > 1:
+        print(
+            f"警告: API_WORKERS={workers} 但未设置 RATE_LIMIT_STORE，"
+            f"各 worker 分别计数，实际限额为文档中的 {workers} 倍"
+        )
+    return MemoryStore()
+
+
+class RateLimitMiddleware:
+    """
+    ASGI限流中间件
+
+    只在命中规则的请求上工作；按账号限流的规则会先读出请求体，
+    再原样交给后面的应用。
+    """
+
+    def __init__(self, app, rules: list[RateLimitRule], store=None):
+        self.app = app
+        self.rules = rules
+        self.store = store if store is not None else default_store()
+        self.trust_proxy = os.getenv("RATE_LIMIT_TRUST_PROXY", "0") == "1"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        method, path = scope["method"], scope["path"]
+        rules = [rule for rule in self.rules if rule.matches(method, path)]
+        if not rules:
+            return await self.app(scope, receive, send)
+
+        body = None
+        if any(rule.key.startswith("body:") for rule in rules):
+            body = await self._read_body(receive)
+            if body is None:
+                # 客户端在发送请求体途中断开
+                return
+            receive = self._replay(body, receive)
+
+        now = time.time()
+        taken = []
+        for rule in rules:
+            key = self._key(rule, scope, body)
+            if key is None:
+                continue
+            bucket = f"{rule.name}:{key}"
+            wait = self.store.take(bucket, rule.limit, rule.rate, now)
+            if wait:
+                rule.rejected += 1
+                # 被拒绝的请求不消耗其他规则的限额
+                for earlier, name in taken:
+                    self.store.refund(name, earlier.limit, earlier.rate, now)
+                response = JSONResponse(
+                    {"detail": "请求过于频繁，请稍后再试"},
+                    status_code=429,
+                    headers={"Retry-After": str(math.ceil(wait))},
+                )
+                return await response(scope, receive, send)
+            taken.append((rule, bucket))
+
+        await self.app(scope, receive, send)
+
+    def _key(self, rule: RateLimitRule, scope, body: bytes | None) -> str | None:
+        if rule.key == "user":
+            user_id = self._user(scope)
+            if user_id is not None:
+                return f"u{user_id}"
+        elif rule.key.startswith("body:"):
+            return self._body_field(body, rule.key[5:])
+        return self._client_ip(scope)
+
+    def _client_ip(self, scope) -> str:
+        if self.trust_proxy:
+            for name, value in scope["headers"]:
+                if name == b"x-forwarded-for":
+                    return value.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    @staticmethod
+    def _user(scope) -> int | None:
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() != "bearer":
+                    return None
+                # 已验证 token 有缓存，这里通常不需要重新校验签名
+                payload = verify_token(token)
+                return payload.get("sub") if payload else None
+        return None
+
+    @staticmethod
+    def _body_field(body: bytes | None, field: str) -> str | None:
+        if not body or len(body) > MAX_BODY_SIZE:
+            return None
+        try:
+            value = json.loads(body).get(field)
+        except (ValueError, AttributeError):
+            return None
+        return normalize_identifier(value) if isinstance(value, str) else None
+
+    @staticmethod
+    async def _read_body(receive) -> bytes | None:
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                return None
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    @staticmethod
+    def _replay(body: bytes, receive):
+        sent = False
+
+        async def replay():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return replay
+
+
+def rate_limit_metrics(rules: list[RateLimitRule]) -> dict:
+    return {
+        rule.name: {
+            "limit": rule.limit,
+            "period": rule.period,
+            "rejected": rule.rejected,
+        }
+        for rule in rules
+    }
@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+
+from database import Database
+
+
+class RevocationList:
+    """
+    内存中的 token 吊销表：user_id -> 吊销时间戳
+
+    签发时间不晚于吊销时间的 token 一律拒绝。后台线程每隔 interval 秒
+    从 token_revocations 增量加载，所有 worker 在 interval 秒内看到新的吊销；
+    请求路径只做一次字典查找，不访问数据库。后台线程未运行时（脚本、测试）
+    在检查时按同样的间隔同步刷新。
+    """
+
+    # 增量加载时回看的秒数，覆盖多台机器之间的时钟偏差和晚提交的事务
+    OVERLAP = 60
+
+    def __init__(
+        self,
+        database: Database,
+        retention: int,
+        interval: float | None = None,
+    ):
+        if interval is None:
+            interval = float(os.getenv("TOKEN_REVOCATION_REFRESH_INTERVAL", "2"))
+        self.database = database
+        # 吊销早于 token 有效期的记录已经没有 token 可拦，不再保留在内存中
+        self.retention = retention
+        self.interval = interval
+        self._revoked: dict[int, int] = {}
+        self._since = 0
+        self._refreshed_at: float | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """先同步加载一次，保证开始处理请求时吊销表已就绪"""
+        self.refresh()
+        if self.running or self.interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="token-revocations", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float | None = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def refresh(self):
+        with self._lock:
+            rows = self.database.get_token_revocations(self._since - self.OVERLAP)
+            cutoff = int(time.time()) - self.retention
+            # 整体替换而不是原地修改，请求线程读取时无需加锁
+            revoked = {
+                user_id: ts for user_id, ts in self._revoked.items() if ts >= cutoff
+            }
+            for user_id, ts in rows:
+                if ts > revoked.get(user_id, -1):
+                    revoked[user_id] = ts
+                self._since = max(self._since, ts)
+            self._revoked = revoked
+            self._refreshed_at = time.monotonic()
+
+    def add(self, user_id: int, revoked_ts: int):
+        """本进程刚写入的吊销立即生效，不等下一次刷新"""
+        with self._lock:
+            revoked = dict(self._revoked)
+            revoked[user_id] = max(revoked_ts, revoked.get(user_id, -1))
+            self._revoked = revoked
+
+    def is_revoked(self, user_id: int, issued_at: int) -> bool:
+        if not self.running and (
+            self._refreshed_at is None
+            or time.monotonic() - self._refreshed_at >= self.interval
+        ):
+            self.refresh()
+        revoked_ts = self._revoked.get(user_id)
+        return revoked_ts is not None and issued_at <= revoked_ts
+
+    def metrics(self) -> dict:
+        return {
+            "running": self.running,
+            "revoked_users": len(self._revoked),
+            "refresh_interval_seconds": self.interval,
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"token 吊销表刷新失败: {e}")
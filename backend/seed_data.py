@@ -0,0 +1,436 @@
+"""
+生成用于容量规划和压测的合成数据库
+
+使用方法：
+    python seed_data.py --users 1000000                  # 生成 loadtest.db
+    python seed_data.py --users 200000 --seed 7 --db /tmp/x.db --force
+
+相同的 --seed、--users、--days、--end-date 生成的数据完全一致。
+各表按较真实的分布生成：注册量随时间增长，少数用户贡献大部分生成次数，
+约一成用户付费。写入期间暂时删除二级索引，全部插入后再重建。
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from array import array
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator
+
+from daily_stats import backfill_daily_statistics
+from identifiers import backfill_user_identifiers
+from database import Database
+from init_db import init_database
+
+SEED_TABLES = ("users", "user_quotas", "verification_codes", "generations", "orders")
+
+# 每批生成的用户数；属于可复现的一部分，修改后相同种子生成的数据会变化
+SHARD_USERS = 50000
+
+# 任意固定的bcrypt哈希，合成用户不用于登录
+PASSWORD_HASH = "$2b$12$C6UzMDM.H6dfI/f/IKcEeO5uXz5aO5Fbfyq5g.kCQm5A2sa0qEYDK"
+
+# (地区, 区号, 权重)
+REGIONS = [
+    ("CN", "+86", 85),
+    ("US", "+1", 6),
+    ("JP", "+81", 4),
+    ("GB", "+44", 3),
+    ("DE", "+49", 2),
+]
+EMAIL_DOMAINS = ["qq.com", "163.com", "gmail.com", "outlook.com", "icloud.com"]
+PHONE_PREFIXES = ["13", "15", "17", "18", "19"]
+
+# (订阅等级, 免费次数, 价格(分), 权重)，与 init_db 中的套餐一致
+PLANS = [
+    ("free", 5, 0, 900),
+    ("basic", 50, 499, 60),
+    ("professional", 200, 999, 30),
+    ("lifetime", 999999, 19900, 10),
+]
+
+ORDER_STATUSES = [("paid", 85), ("pending", 10), ("failed", 5)]
+
+
+def weighted(rng: random.Random, items: list[tuple], k: int) -> list[tuple]:
+    """按每项最后一个元素作为权重抽样 k 次"""
+    return rng.choices(items, weights=[item[-1] for item in items], k=k)
+
+
+class SyntheticData:
+    """
+    按固定种子生成一批用户（全局序号 first 起的 count 个）及其关联数据
+
+    users()、user_quotas() 必须最先按顺序消费，它们记录的注册时间、
+    登录方式、套餐和已用次数供其他表引用。
+    所有时间以UNIX秒传给SQLite，由 datetime(?, 'unixepoch') 转成文本，
+    避免在Python中逐行格式化时间。
+    """
+
+    def __init__(self, first: int, count: int, seed: int, days: int, end: float):
+        self.first = first
+        self.count = count
+        self.seed = seed
+        self.end = end
+        self.start = end - days * 86400
+        self.created = array("d")
+        self.by_phone = bytearray()
+        self.plan = bytearray()
+        self.used = array("l")
+
+    def rng(self, table: str) -> random.Random:
+        # 每批、每张表独立的随机序列，增减一张表不影响其他表的数据
+        return random.Random(f"{self.seed}:{table}:{self.first}")
+
+    def users(self) -> Iterator[tuple]:
+        rng = self.rng("users")
+        span = self.end - self.start
+        regions = weighted(rng, REGIONS, 1024)
+        for i in range(self.first, self.first + self.count):
+            # 注册时间密度随时间线性增长（取平方根）
+            created = self.start + span * rng.random() ** 0.5
+            self.created.append(created)
+            region, country_code, _ = regions[i & 1023]
+            by_phone = region == "CN" and rng.random() < 0.7
+            self.by_phone.append(by_phone)
+            identifier = self.identifier(i, by_phone)
+            phone, email = (identifier, None) if by_phone else (None, identifier)
+            # 六成用户有登录记录，偏向最近
+            r = rng.random()
+            last_login = (
+                created + (self.end - created) * (r / 0.6) ** 0.3 if r < 0.6 else None
+            )
+            yield (
+                i + 1,
+                phone,
+                email,
+                PASSWORD_HASH,
+                country_code,
+                region,
+                created,
+                last_login,
+            )
+
+    @staticmethod
+    def identifier(i: int, by_phone: bool) -> str:
+        if by_phone:
+            return f"{PHONE_PREFIXES[i % 5]}{i:09d}"
+        return f"user{i}@{EMAIL_DOMAINS[i % 5]}"
+
+    def user_quotas(self) -> Iterator[tuple]:
+        rng = self.rng("user_quotas")
+        plans = rng.choices(
+            range(len(PLANS)), weights=[p[-1] for p in PLANS], k=self.count
+        )
+        for j in range(self.count):
+            self.plan.append(plans[j])
+            level, free, _, _ = PLANS[plans[j]]
+            # 指数分布的使用次数：多数用户只用几次，少数重度用户
+            used = min(int(rng.expovariate(0.5 if level == "free" else 0.05)), free)
+            self.used.append(used)
+            expiry = None
+            if level in ("basic", "professional"):
+                expiry = self.created[j] + rng.randint(1, 60) * 86400
+            yield (self.first + j + 1, free, used, level, expiry)
+
+    def verification_codes(self) -> Iterator[tuple]:
+        rng = self.rng("verification_codes")
+        for j in range(self.count):
+            created = self.created[j]
+            identifier = self.identifier(self.first + j, self.by_phone[j])
+            # 注册验证码 + 部分用户的登录/重置验证码
+            for code_type in ("register", "login", "reset"):
+                if code_type != "register" and rng.random() > 0.3:
+                    continue
+                sent = created if code_type == "register" else created + 3600
+                yield (
+                    identifier,
+                    f"{rng.randrange(1000000):06d}",
+                    code_type,
+                    sent + 300,
+                    rng.random() < 0.9,
+                    sent,
+                )
+
+    def generations(self) -> Iterator[tuple]:
+        # 每个用户的生成记录数等于已用次数，与配额表一致
+        rng = self.rng("generations")
+        for j in range(self.count):
+            user_id = self.first + j + 1
+            created = self.created[j]
+            window = self.end - created
+            for _ in range(self.used[j]):
+                at = created + window * rng.random()
+                yield (
+                    user_id,
+                    rng.randrange(8),
+                    "system",
+                    rng.choice((0.0, 45.0, 90.0, 180.0, 270.0, 315.0)),
+                    rng.choice((-30.0, 0.0, 30.0, 60.0)),
+                    rng.choice((0.6, 1.0, 1.4)),
+                    f"outputs/{user_id}_{int(at)}.jpg",
+                    round(0.75 + 0.25 * rng.random(), 3),
+                    at,
+                    at + 7 * 86400,
+                )
+
+    def orders(self) -> Iterator[tuple]:
+        rng = self.rng("orders")
+        statuses = weighted(rng, ORDER_STATUSES, 1024)
+        for j in range(self.count):
+            level, _, price, _ = PLANS[self.plan[j]]
+            if not price:
+                continue
+            i = self.first + j
+            created = min(self.created[j] + 86400 * rng.random(), self.end - 5)
+            status = statuses[i & 1023][0]
+            yield (
+                i + 1,
+                level,
+                price,
+                status,
+                "alipay" if i % 3 else "stripe",
+                f"pay_{self.seed}_{i}" if status == "paid" else None,
+                created,
+                created + 5 if status == "paid" else None,
+            )
+
+
+# 每张表写入的列；时间列以UNIX秒传入，在SQL中转成文本
+COLUMNS = {
+    "users": [
+        "id",
+        "phone_number",
+        "email",
+        "password_hash",
+        "country_code",
+        "region",
+        "created_at",
+        "last_login",
+    ],
+    "user_quotas": [
+        "user_id",
+        "free_generations",
+        "used_generations",
+        "subscription_level",
+        "subscription_expiry",
+    ],
+    "verification_codes": [
+        "identifier",
+        "code",
+        "code_type",
+        "expires_at",
+        "used",
+        "created_at",
+    ],
+    "generations": [
+        "user_id",
+        "pose_id",
+        "pose_type",
+        "azimuth",
+        "elevation",
+        "distance",
+        "result_url",
+        "face_similarity",
+        "created_at",
+        "expires_at",
+    ],
+    "orders": [
+        "user_id",
+        "order_type",
+        "amount_cents",
+        "status",
+        "payment_method",
+        "payment_id",
+        "created_at",
+        "paid_at",
+    ],
+}
+TIME_COLUMNS = {
+    "created_at",
+    "last_login",
+    "subscription_expiry",
+    "expires_at",
+    "paid_at",
+}
+
+
+# 同时写入整数时间戳的列：TEXT列 -> 对应的UNIX秒列
+EPOCH_COLUMNS = {
+    "verification_codes": {"created_at": "created_ts", "expires_at": "expires_ts"},
+    "generations": {"created_at": "created_ts", "expires_at": "expires_ts"},
+}
+
+
+def table_columns(table: str) -> list[str]:
+    return COLUMNS[table] + list(EPOCH_COLUMNS.get(table, {}).values())
+
+
+def insert_sql(table: str) -> str:
+    columns = COLUMNS[table]
+    values = [
+        f"datetime(?{n}, 'unixepoch')" if c in TIME_COLUMNS else f"?{n}"
+        for n, c in enumerate(columns, 1)
+    ]
+    # 整数时间戳复用同一个参数
+    for column in EPOCH_COLUMNS.get(table, {}):
+        values.append(f"CAST(?{columns.index(column) + 1} AS INTEGER)")
+    return (
+        f"INSERT INTO {table} ({', '.join(table_columns(table))}) "
+        f"VALUES ({', '.join(values)})"
+    )
+
+
+def build_shard(job: tuple) -> tuple[str, dict]:
+    """
+    子进程中生成一批用户及其关联数据，写入独立的临时库
+
+    每批的随机序列只由种子和批次起点决定，与进程数无关。
+    """
+    path, schema, first, count, seed, days, end = job
+    data = SyntheticData(first, count, seed, days, end)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    # 与主库相同的表结构，但不建二级索引
+    for sql in schema:
+        conn.execute(sql)
+    counts = {}
+    for table in SEED_TABLES:
+        cursor = conn.executemany(insert_sql(table), getattr(data, table)())
+        counts[table] = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return path, counts
+
+
+def merge_shard(conn: sqlite3.Connection, path: str):
+    """把临时库中的数据整表复制到主库（在SQLite内部完成，不经过Python）"""
+    conn.execute("ATTACH DATABASE ? AS shard", (path,))
+    try:
+        for table in SEED_TABLES:
+            columns = ", ".join(table_columns(table))
+            conn.execute(f"""
+                INSERT INTO main.{table} ({columns})
+                SELECT {columns} FROM shard.{table} ORDER BY rowid
+                """)
+        conn.commit()
+    finally:
+        conn.execute("DETACH DATABASE shard")
+
+
+def seed(
+    db_path: str,
+    users: int,
+    seed: int = 42,
+    days: int = 365,
+    end: float = 0,
+    workers: int | None = None,
+) -> dict:
+    """
+    向新数据库写入合成数据，返回 {表名: 行数}
+
+    用户按 SHARD_USERS 分批，多个进程并行生成并写入各自的临时库，
+    主进程按批次顺序合并，因此结果与进程数无关、可以复现。
+    """
+    init_database(db_path)
+    # 一次性的压测库：关闭同步写盘换取写入速度
+    database = Database(db_path, pool_size=1, pragmas={"synchronous": "OFF"})
+    totals = dict.fromkeys(SEED_TABLES, 0)
+
+    with database.connection() as conn:
+        placeholders = ", ".join("?" for _ in SEED_TABLES)
+        indexes = conn.execute(
+            f"""
+            SELECT name, sql FROM sqlite_master
+            WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})
+            """,
+            SEED_TABLES,
+        ).fetchall()
+        for name, _ in indexes:
+            conn.execute(f"DROP INDEX {name}")
+        conn.commit()
+        schema = [
+            row[0]
+            for row in conn.execute(
+                f"""
+                SELECT sql FROM sqlite_master
+                WHERE type = 'table' AND name IN ({placeholders})
+                """,
+                SEED_TABLES,
+            )
+        ]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            jobs = [
+                (
+                    str(Path(tmp) / f"shard{first}.db"),
+                    schema,
+                    first,
+                    min(SHARD_USERS, users - first),
+                    seed,
+                    days,
+                    end,
+                )
+                for first in range(0, users, SHARD_USERS)
+            ]
+            workers = workers or os.cpu_count() or 1
+            with multiprocessing.Pool(min(workers, len(jobs) or 1)) as pool:
+                for path, counts in pool.imap(build_shard, jobs):
+                    merge_shard(conn, path)
+                    os.unlink(path)
+                    for table, n in counts.items():
+                        totals[table] += n
+
+        for _, sql in indexes:
+            conn.execute(sql)
+        backfill_user_identifiers(conn)
+        conn.execute("DELETE FROM daily_statistics")
+        backfill_daily_statistics(conn)
+
+    database.close()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成压测数据")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--days", type=int, default=365, help="注册时间分布的天数")
+    parser.add_argument(
+        "--end-date",
+        default="2025-01-01",
+        help="数据的截止日期（UTC），固定该值才能复现相同数据",
+    )
+    parser.add_argument("--db", default=str(Path(__file__).parent / "loadtest.db"))
+    parser.add_argument("--force", action="store_true", help="覆盖已存在的数据库")
+    parser.add_argument("--workers", type=int, default=None, help="默认CPU核数")
+    args = parser.parse_args()
+
+    path = Path(args.db)
+    if path.exists():
+        if not args.force:
+            parser.error(f"{path} 已存在，使用 --force 覆盖")
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+    end = datetime.strptime(args.end_date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    started = time.perf_counter()
+    totals = seed(
+        str(path), args.users, args.seed, args.days, end.timestamp(), args.workers
+    )
+    elapsed = time.perf_counter() - started
+
+    for table, rows in totals.items():
+        print(f"{table:<20} {rows:10d} 行")
+    total = sum(totals.values())
+    print(f"合计 {total} 行，{elapsed:.1f}s，{total / elapsed:.0f} 行/秒 -> {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+JWT签名密钥环
+
+所有 worker 进程（以及共享同一密钥文件的多台机器）使用同一组密钥，
+任一进程签发的 token 在其他进程都能校验。token 头部带 kid，
+按 kid 选择校验密钥，因此可以同时存在多把有效的校验密钥。
+
+密钥来源（按优先级）：
+    1. 环境变量 JWT_SIGNING_KEYS="kid1:secret1,kid2:secret2"，JWT_ACTIVE_KEY 指定签发用的 kid
+       （默认第一把）；适合由配置系统统一下发，不会重新加载
+    2. 密钥文件 JWT_KEYS_PATH（默认 backend/jwt_keys.json）；不存在时自动生成，
+       文件变化后各进程自动重新加载
+
+不停机轮换：
+    python signing_keys.py rotate      # 生成新密钥并用于签发，旧密钥继续用于校验
+    python signing_keys.py prune       # 删除创建早于 token 有效期的非当前密钥
+    python signing_keys.py list
+"""
+
+import argparse
+import json
+import os
+import secrets
+import threading
+import time
+from pathlib import Path
+
+
+class UnknownKey(KeyError):
+    """token 的 kid 不在密钥环中"""
+
+
+def _new_key() -> dict:
+    return {"secret": secrets.token_urlsafe(32), "created_at": int(time.time())}
+
+
+def _new_kid() -> str:
+    return time.strftime("%Y%m%d%H%M%S") + "-" + secrets.token_hex(2)
+
+
+class KeyRing:
+    """
+    签名密钥环
+
+    校验时遇到未知 kid 会先检查密钥文件是否有更新，
+    所以一个进程轮换密钥后，其他进程无需重启即可校验新 token。
+    """
+
+    def __init__(self, path: str | None = None, reload_interval: float = 5.0):
+        if path is None:
+            path = os.getenv(
+                "JWT_KEYS_PATH", str(Path(__file__).parent / "jwt_keys.json")
+            )
+        self.path = Path(path)
+        self.reload_interval = reload_interval
+        self.active: str | None = None
+        self.keys: dict[str, dict] = {}
+        self._static = False
+        self._mtime: float | None = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        configured = os.getenv("JWT_SIGNING_KEYS")
+        if configured:
+            keys = {}
+            for item in configured.split(","):
+                kid, _, secret = item.strip().partition(":")
+                if not kid or not secret:
+                    raise ValueError("JWT_SIGNING_KEYS 格式应为 kid:secret,kid:secret")
+                keys[kid] = {"secret": secret, "created_at": 0}
+            active = os.getenv("JWT_ACTIVE_KEY", next(iter(keys)))
+            if active not in keys:
+                raise ValueError(f"JWT_ACTIVE_KEY {active} 不在 JWT_SIGNING_KEYS 中")
+            self.active, self.keys, self._static = active, keys, True
+            return
+
+        if not self.path.exists():
+            self._create()
+        self._read()
+
+    def signing_key(self) -> tuple[str, str]:
+        """签发用的 (kid, secret)"""
+        self._maybe_reload()
+        return self.active, self.keys[self.active]["secret"]
+
+    def verification_key(self, kid: str) -> str:
+        """kid 对应的校验密钥，找不到时抛出 UnknownKey"""
+        self._maybe_reload(force=kid not in self.keys)
+        try:
+            return self.keys[kid]["secret"]
+        except KeyError:
+            raise UnknownKey(kid)
+
+    def rotate(self) -> str:
+        """生成新密钥并设为签发密钥，返回新 kid"""
+        kid = _new_kid()
+        self._update(lambda data: data["keys"].__setitem__(kid, _new_key()), kid)
+        return kid
+
+    def prune(self, max_age: float) -> list[str]:
+        """删除创建时间早于 max_age 秒的非签发密钥，返回被删除的 kid"""
+        cutoff = time.time() - max_age
+        removed = []
+
+        def drop(data):
+            for kid, key in list(data["keys"].items()):
+                if kid != data["active"] and key["created_at"] < cutoff:
+                    del data["keys"][kid]
+                    removed.append(kid)
+
+        self._update(drop)
+        return removed
+
+    def _maybe_reload(self, force: bool = False):
+        if self._static:
+            return
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = self.path.stat().st_mtime
+        except FileNotFoundError:
+            return
+        if mtime != self._mtime:
+            self._read()
+
+    def _read(self):
+        with self._lock:
+            mtime = self.path.stat().st_mtime
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            if data["active"] not in data["keys"]:
+                raise ValueError(f"{self.path} 中的 active 密钥不存在")
+            self.active, self.keys, self._mtime = data["active"], data["keys"], mtime
+
+    def _create(self):
+        """首次启动时生成密钥文件；多个 worker 同时启动时只有一个能创建成功"""
+        kid = _new_kid()
+        tmp = self._write_tmp({"active": kid, "keys": {kid: _new_key()}})
+        try:
+            # 硬链接在目标已存在时失败，保证文件一出现就是完整内容
+            os.link(tmp, self.path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp)
+
+    def _update(self, change, active: str | None = None):
+        if self._static:
+            raise RuntimeError("密钥来自 JWT_SIGNING_KEYS，请在配置中修改")
+        data = json.loads(self.path.read_text(encoding="utf-8"))
+        change(data)
+        if active is not None:
+            data["active"] = active
+        os.replace(self._write_tmp(data), self.path)
+        self._read()
+
+    def _write_tmp(self, data: dict) -> str:
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        return tmp
+
+
+def main():
+    from auth import ACCESS_TOKEN_EXPIRE_MINUTES
+
+    parser = argparse.ArgumentParser(description="JWT签名密钥管理")
+    parser.add_argument("command", choices=["list", "rotate", "prune"])
+    args = parser.parse_args()
+
+    ring = KeyRing()
+    if args.command == "rotate":
+        print(f"新的签发密钥: {ring.rotate()}")
+    elif args.command == "prune":
+        # 多保留一天，覆盖时钟偏差和刚签发的 token
+        removed = ring.prune(ACCESS_TOKEN_EXPIRE_MINUTES * 60 + 86400)
+        print(f"已删除: {', '.join(removed) or '无'}")
+    for kid, key in ring.keys.items():
+        mark = "*" if kid == ring.active else " "
+        created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(key["created_at"]))
+        print(f"{mark} {kid}  {created}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,652 @@
+"""
+硅基流动（SiliconFlow）图生视频客户端
+
+提交 -> 轮询状态 -> 下载视频。所有调用共用一个 httpx.AsyncClient 连接池
+（安装 h2 时使用HTTP/2），由一个后台事件循环线程持有；worker 线程通过 run() 调用。
+同时进行中的生成任务数受 max_inflight 限制，与账号的并发额度一致。
+状态查询由 PollScheduler 集中安排，首次查询在按历史耗时预测的完成时间附近。
+
+重试规则：查询状态是只读的，任何网络错误、429、5xx 都会退避重试；
+提交不带幂等键，只在请求确定没有到达服务端（连接失败、429、503）时重试，
+请求可能已被受理时抛出 SubmitUncertain，由调用方决定，避免重复提交和重复计费。
+
+下载按块流式写入 .part 临时文件，中断后用 Range 从已写入的位置续传，
+校验大小（和可选的SHA-256）后原子改名；同时进行的下载数受 max_downloads 限制，
+占用的内存不超过 max_downloads 个块。
+
+API密钥来自 provider_keys 密钥池：每次提交按优先级和剩余速率额度选一把密钥，
+提交被 429/503 拒绝时换一把重试；查询状态使用提交该请求的密钥。
+"""
+
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import httpx
+
+from database import db
+from poll_scheduler import DurationModel, PollScheduler, duration_key
+from provider_keys import NoKeyAvailable, PooledKey, ProviderKeyPool, provider_keys
+
+T = TypeVar("T")
+
+PROVIDER = "siliconflow"
+DEFAULT_BASE_URL = "https://api.siliconflow.cn/v1"
+DEFAULT_VIDEO_MODEL = "Wan-AI/Wan2.2-I2V-A14B"
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+
+class SiliconFlowError(RuntimeError):
+    """调用失败；retryable 表示稍后整体重试是安全的"""
+
+    def __init__(self, message: str, status_code: int | None = None, retryable=False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+
+
+class SubmitUncertain(SiliconFlowError):
+    """提交请求已发出但没有拿到结果，服务端可能已经受理"""
+
+
+class GenerationFailed(SiliconFlowError):
+    """服务端返回生成失败"""
+
+
+class PollTimeout(SiliconFlowError):
+    """超过截止时间仍未生成完成，可以稍后用同一个 request_id 继续等待"""
+
+    def __init__(self, message: str):
+        super().__init__(message, retryable=True)
+
+
+class DownloadError(SiliconFlowError):
+    """下载的内容与预期的大小或校验和不一致"""
+
+    def __init__(self, message: str):
+        super().__init__(message, retryable=True)
+
+
+@dataclass(frozen=True)
+class VideoRequest:
+    image: str  # data URL 或 base64（按JPEG处理）
+    prompt: str
+    image_size: str = "1280x720"
+    num_frames: int = 81
+    frames_per_second: int = 16
+    model: str = DEFAULT_VIDEO_MODEL
+    negative_prompt: Optional[str] = None
+    seed: Optional[int] = None
+
+    def to_json(self) -> dict:
+        image = self.image
+        if not image.startswith("data:"):
+            image = f"data:image/jpeg;base64,{image}"
+        body = {
+            "model": self.model,
+            "prompt": self.prompt,
+            "image_size": self.image_size,
+            "image": image,
+            "num_frames": self.num_frames,
+            "frames_per_second": self.frames_per_second,
+        }
+        if self.negative_prompt:
+            body["negative_prompt"] = self.negative_prompt
+        if self.seed is not None:
+            body["seed"] = self.seed
+        return body
+
+
+@dataclass(frozen=True)
+class VideoStatus:
+    request_id: str
+    status: str  # InQueue / InProgress / Succeed / Failed
+    reason: Optional[str] = None
+    video_url: Optional[str] = None
+    seed: Optional[int] = None
+    inference_seconds: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("Succeed", "Failed")
+
+    @classmethod
+    def from_json(cls, request_id: str, data: dict) -> "VideoStatus":
+        results = data.get("results") or {}
+        videos = results.get("videos") or []
+        timings = results.get("timings") or {}
+        return cls(
+            request_id=request_id,
+            status=data.get("status") or "Unknown",
+            reason=data.get("reason") or None,
+            video_url=videos[0].get("url") if videos else None,
+            seed=results.get("seed"),
+            inference_seconds=timings.get("inference"),
+        )
+
+
+@dataclass(frozen=True)
+class Submission:
+    request_id: str
+    submitted_at: float  # time.time()
+    key_id: int | None = None  # 提交所用的密钥，查询状态时必须用同一把
+
+
+@dataclass(frozen=True)
+class VideoResult:
+    request_id: str
+    video_url: str
+    seed: Optional[int]
+    inference_seconds: Optional[float]
+    polls: int
+    elapsed_seconds: float
+
+
+@dataclass(frozen=True)
+class DownloadResult:
+    path: str
+    size: int
+    sha256: str
+    resumed_bytes: int  # 续传时沿用的已下载字节数
+    attempts: int
+
+
+def parse_image_size(image_size: str) -> tuple[int, int]:
+    width, _, height = image_size.lower().partition("x")
+    return int(width), int(height)
+
+
+def estimate_seconds(num_frames: int, image_size: str) -> float:
+    """
+    按帧数和分辨率估算生成耗时：固定排队开销 + 每百万像素帧的推理时间
+
+    只在该类请求还没有历史耗时数据时使用。
+    """
+    width, height = parse_image_size(image_size)
+    megapixel_frames = num_frames * width * height / 1e6
+    return 20.0 + 1.5 * megapixel_frames
+
+
+def _retry_after(response: httpx.Response, default: float) -> float:
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", "")))
+    except ValueError:
+        return default
+
+
+class SiliconFlowClient:
+    """
+    连接池化的异步客户端，由应用的 lifespan 启停
+
+    协程方法（submit/status/wait/generate）在客户端自己的事件循环中执行，
+    同步代码用 run(client.generate(...)) 调用。
+    """
+
+    # 提交/查询的最大重试次数，退避从 backoff 秒起翻倍并加随机抖动
+    MAX_RETRIES = 3
+
+    def __init__(
+        self,
+        api_key: str | None = None,
+        base_url: str | None = None,
+        max_inflight: int | None = None,
+        max_connections: int | None = None,
+        max_downloads: int | None = None,
+        http2: bool | None = None,
+        durations: DurationModel | None = None,
+        max_polls: int | None = None,
+        keys: ProviderKeyPool | None = None,
+        timeout: float = 30.0,
+        backoff: float = 1.0,
+    ):
+        if keys is None:
+            # 不使用密钥池时只有一把密钥
+            if api_key is None:
+                api_key = os.getenv("SILICONFLOW_API_KEY", "")
+            keys = ProviderKeyPool(static={PROVIDER: api_key})
+        if base_url is None:
+            base_url = os.getenv("SILICONFLOW_BASE_URL", DEFAULT_BASE_URL)
+        if max_inflight is None:
+            max_inflight = int(os.getenv("SILICONFLOW_MAX_INFLIGHT", "4"))
+        if max_connections is None:
+            max_connections = int(os.getenv("SILICONFLOW_MAX_CONNECTIONS", "10"))
+        if max_downloads is None:
+            max_downloads = int(os.getenv("SILICONFLOW_MAX_DOWNLOADS", "4"))
+        if http2 is None:
+            http2 = os.getenv("SILICONFLOW_HTTP2", "1") == "1"
+        if max_polls is None:
+            max_polls = int(os.getenv("SILICONFLOW_MAX_POLLS", "8"))
+        self.keys = keys
+        self.base_url = base_url.rstrip("/")
+        self.max_inflight = max_inflight
+        self.max_connections = max_connections
+        self.max_downloads = max_downloads
+        self.http2 = http2 and _h2_available()
+        self.timeout = timeout
+        self.backoff = backoff
+        self.inflight = 0
+        self.submitted = 0
+        self.polls = 0
+        self.retries = 0
+        self.downloading = 0
+        self.downloaded_bytes = 0
+        self.scheduler = PollScheduler(
+            self.status, durations or DurationModel(), max_concurrent_polls=max_polls
+        )
+        self._request_keys: dict[str, int | None] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._client: httpx.AsyncClient | None = None
+        self._inflight_slots: asyncio.Semaphore | None = None
+        self._download_slots: asyncio.Semaphore | None = None
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def configured(self) -> bool:
+        return self.keys.available(PROVIDER)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run_loop,
+                args=(loop, ready),
+                name="siliconflow",
+                daemon=True,
+            )
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+
+    def stop(self, timeout: float | None = 5.0):
+        with self._lock:
+            if not self.running:
+                return
+            loop, thread = self._loop, self._thread
+            asyncio.run_coroutine_threadsafe(self._close(), loop).result(timeout)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout)
+            self._loop = self._thread = None
+
+    def run(self, coro: Awaitable[T], timeout: float | None = None) -> T:
+        """在客户端的事件循环中执行协程并等待结果（供同步代码调用，按需启动）"""
+        if not self.running:
+            self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    async def submit(self, request: VideoRequest) -> Submission:
+        """提交生成请求，返回 request_id 和所用的密钥"""
+        submitted_at = time.time()
+        response, key = await self._request(
+            "/video/submit", request.to_json(), idempotent=False
+        )
+        request_id = response.get("requestId")
+        if not request_id:
+            raise SiliconFlowError(f"提交响应缺少 requestId: {response}")
+        self.submitted += 1
+        self.keys.record_usage(key)
+        return Submission(request_id, submitted_at, key.id)
+
+    async def status(self, request_id: str, key_id: int | None = None) -> VideoStatus:
+        """
+        Args:
+            key_id: 提交该请求的密钥；不传时使用 wait() 登记的密钥，都没有时任选一把
+        """
+        if key_id is None:
+            key_id = self._request_keys.get(request_id)
+        self.polls += 1
+        data, _ = await self._request(
+            "/video/status", {"requestId": request_id}, idempotent=True, key_id=key_id
+        )
+        return VideoStatus.from_json(request_id, data)
+
+    def estimate(self, request: VideoRequest) -> float:
+        """预计生成耗时（秒）：有历史数据时用学到的均值，否则按帧数和分辨率估算"""
+        return self.scheduler.estimate(
+            duration_key(request.model, request.num_frames, request.image_size),
+            estimate_seconds(request.num_frames, request.image_size),
+        )
+
+    def eta(self, request_id: str) -> float | None:
+        """本进程正在等待的请求的预计完成时间（time.time()）"""
+        return self.scheduler.eta(request_id)
+
+    async def wait(
+        self,
+        request_id: str,
+        request: VideoRequest | None = None,
+        submitted_at: float | None = None,
+        deadline: float | None = None,
+        key_id: int | None = None,
+        on_eta: Callable[[float], None] | None = None,
+    ) -> VideoResult:
+        """
+        等待生成结束，查询时间由调度器安排
+
+        Args:
+            request: 提交时的参数，用于预测耗时；续等时不知道参数可以不传（按默认参数估计）
+            submitted_at: 提交时间（time.time()），不传时从现在算起
+            deadline: 从现在起最长等待秒数，默认为预计耗时的4倍（不少于5分钟）
+            key_id: 提交该请求的密钥，状态查询使用同一把
+            on_eta: 超过预计时间后以推后的预计完成时间调用（在线程池中执行）
+        """
+        if request is None:
+            request = VideoRequest(image="", prompt="")
+        started = time.time()
+        self._request_keys[request_id] = key_id
+        try:
+            status, polls = await self.scheduler.track(
+                request_id,
+                duration_key(request.model, request.num_frames, request.image_size),
+                estimate_seconds(request.num_frames, request.image_size),
+                submitted_at,
+                deadline,
+                on_eta,
+            )
+        except TimeoutError:
+            raise PollTimeout(f"等待视频生成超时: {request_id}")
+        finally:
+            self._request_keys.pop(request_id, None)
+        if status.status == "Failed":
+            raise GenerationFailed(status.reason or f"视频生成失败: {request_id}")
+        if not status.video_url:
+            raise GenerationFailed(f"生成完成但没有视频链接: {request_id}")
+        return VideoResult(
+            request_id=request_id,
+            video_url=status.video_url,
+            seed=status.seed,
+            inference_seconds=status.inference_seconds,
+            polls=polls,
+            elapsed_seconds=time.time() - (submitted_at or started),
+        )
+
+    async def generate(
+        self,
+        request: VideoRequest,
+        submission: Submission | None = None,
+        on_submit: Callable[[Submission], None] | None = None,
+        deadline: float | None = None,
+        on_eta: Callable[[float], None] | None = None,
+    ) -> VideoResult:
+        """
+        提交并等待生成完成，整个过程占用一个并发名额
+
+        Args:
+            submission: 之前已提交的请求，传入时只继续等待，不重新提交
+            on_submit: 提交成功后以 Submission 调用（在线程池中执行），
+                用于持久化以便中断后续等
+            on_eta: 见 wait()
+        """
+        async with self._inflight():
+            if submission is None:
+                submission = await self.submit(request)
+                if on_submit is not None:
+                    await asyncio.to_thread(on_submit, submission)
+            return await self.wait(
+                submission.request_id,
+                request,
+                submission.submitted_at,
+                deadline,
+                submission.key_id,
+                on_eta,
+            )
+
+    async def download(
+        self,
+        url: str,
+        path: str | Path,
+        sha256: str | None = None,
+        chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+    ) -> DownloadResult:
+        """
+        流式下载视频到 path
+
+        数据先写入 path.part，中断（网络错误、连接提前关闭）后按已写入的长度
+        发 Range 请求续传；上次进程退出留下的 .part 同样会续传。
+        完成后校验 Content-Length/Content-Range 给出的总大小和 sha256（如果传入），
+        不一致时删除临时文件重新下载，通过后 fsync 并原子改名为 path。
+        """
+        path = Path(path)
+        part = path.with_name(path.name + ".part")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        resumed = part.stat().st_size if part.exists() else 0
+        async with self._download_slots:
+            self.downloading += 1
+            try:
+                for attempt in range(1, self.MAX_RETRIES + 2):
+                    try:
+                        total = await self._download_part(url, part, chunk_size)
+                        digest = await asyncio.to_thread(
+                            _finish_download, part, path, total, sha256
+                        )
+                    except SiliconFlowError as e:
+                        if not e.retryable or attempt > self.MAX_RETRIES:
+                            raise
+                        self.retries += 1
+                        await asyncio.sleep(
+                            self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1)
+                        )
+                        continue
+                    return DownloadResult(
+                        path=str(path),
+                        size=path.stat().st_size,
+                        sha256=digest,
+                        resumed_bytes=resumed,
+                        attempts=attempt,
+                    )
+            finally:
+                self.downloading -= 1
+
+    async def _download_part(self, url: str, part: Path, chunk_size: int) -> int | None:
+        """把 url 的内容续写到 part，返回文件总大小（服务端未给出时为 None）"""
+        offset = part.stat().st_size if part.exists() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            async with self._client.stream("GET", url, headers=headers) as response:
+                code = response.status_code
+                if code == 206 and offset:
+                    start, total = _content_range(response)
+                    if start != offset:
+                        part.unlink(missing_ok=True)
+                        raise DownloadError(f"续传位置不一致: {start} != {offset}")
+                    mode = "ab"
+                elif code == 200:
+                    # 首次下载，或服务端不支持 Range，从头开始
+                    length = response.headers.get("Content-Length")
+                    total = int(length) if length else None
+                    mode = "wb"
+                elif code == 416:
+                    # 临时文件比服务端的内容还长（内容已变化），从头下载
+                    part.unlink(missing_ok=True)
+                    raise DownloadError("断点位置无效")
+                else:
+                    message = f"下载失败 HTTP {code}"
+                    raise SiliconFlowError(
+                        message, code, retryable=code == 429 or code >= 500
+                    )
+                with open(part, mode) as f:
+                    async for chunk in response.aiter_bytes(chunk_size):
+                        # 写盘放到线程中，不阻塞事件循环里其他任务的轮询
+                        await asyncio.to_thread(f.write, chunk)
+                        self.downloaded_bytes += len(chunk)
+                return total
+        except httpx.TransportError as e:
+            raise SiliconFlowError(f"下载中断: {e}", retryable=True) from e
+
+    def metrics(self) -> dict:
+        return {
+            "configured": self.configured,
+            "running": self.running,
+            "http2": self.http2,
+            "inflight": self.inflight,
+            "max_inflight": self.max_inflight,
+            "submitted": self.submitted,
+            "polls": self.polls,
+            "retries": self.retries,
+            "scheduler": self.scheduler.metrics(),
+            "downloading": self.downloading,
+            "max_downloads": self.max_downloads,
+            "downloaded_bytes": self.downloaded_bytes,
+        }
+
+    def _run_loop(self, loop: asyncio.AbstractEventLoop, ready: threading.Event):
+        asyncio.set_event_loop(loop)
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=self.http2,
+            timeout=httpx.Timeout(self.timeout, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+        )
+        self._inflight_slots = asyncio.Semaphore(self.max_inflight)
+        self._download_slots = asyncio.Semaphore(self.max_downloads)
+        loop.call_soon(ready.set)
+        loop.run_forever()
+        loop.close()
+
+    async def _close(self):
+        await self.scheduler.close()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @asynccontextmanager
+    async def _inflight(self):
+        async with self._inflight_slots:
+            self.inflight += 1
+            try:
+                yield
+            finally:
+                self.inflight -= 1
+
+    def _key(self, key_id: int | None) -> PooledKey:
+        if key_id is not None:
+            try:
+                return self.keys.get(PROVIDER, key_id)
+            except NoKeyAvailable:
+                pass  # 密钥已不在池中（例如改了环境变量），任选一把
+        return self.keys.acquire(PROVIDER)
+
+    async def _request(
+        self, path: str, body: dict, idempotent: bool, key_id: int | None = None
+    ) -> tuple[dict, PooledKey]:
+        """
+        发送请求，返回 (响应JSON, 所用的密钥)
+
+        key_id 为 None 时每次尝试都从密钥池重新选择，被熔断的密钥不会再被选中。
+        """
+        for attempt in range(self.MAX_RETRIES + 1):
+            delay = self.backoff * 2**attempt * random.uniform(0.5, 1.0)
+            try:
+                key = self._key(key_id)
+            except NoKeyAvailable as e:
+                if not self.keys.available(PROVIDER):
+                    raise SiliconFlowError("未配置硅基流动API密钥") from e
+                # 所有密钥都在熔断中或额度用完；很快恢复时等一等，否则交给调用方稍后重试
+                error = SiliconFlowError(str(e), 429, retryable=True)
+                wait = e.retry_after
+                if wait is None or wait > 30 or attempt == self.MAX_RETRIES:
+                    raise error from e
+                self.retries += 1
+                await asyncio.sleep(max(delay, wait))
+                continue
+            headers = {"Authorization": f"Bearer {key.secret}"}
+            try:
+                response = await self._client.post(path, json=body, headers=headers)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                # 请求没有发出，重试不会重复提交
+                error = SiliconFlowError(f"连接失败: {e}", retryable=True)
+            except httpx.TransportError as e:
+                if not idempotent:
+                    raise SubmitUncertain(f"提交结果未知: {e}") from e
+                error = SiliconFlowError(f"请求失败: {e}", retryable=True)
+            else:
+                code = response.status_code
+                self.keys.report(
+                    key,
+                    code,
+                    _retry_after(response, 0.0) or None,
+                    _remaining_requests(response),
+                )
+                if code == 200:
+                    return response.json(), key
+                message = f"HTTP {code}: {response.text[:200]}"
+                if code in (429, 503) or (idempotent and code >= 500):
+                    error = SiliconFlowError(message, code, retryable=True)
+                    # 不限定密钥时被 429 的密钥已熔断，下次重新选择，不必等它的 Retry-After
+                    if key_id is not None or code != 429:
+                        delay = _retry_after(response, delay)
+                elif code >= 500:
+                    raise SubmitUncertain(message, code)
+                else:
+                    raise SiliconFlowError(message, code)
+            if attempt == self.MAX_RETRIES:
+                raise error
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+
+def _remaining_requests(response: httpx.Response) -> int | None:
+    value = response.headers.get("X-RateLimit-Remaining-Requests")
+    return int(value) if value and value.isdigit() else None
+
+
+def _content_range(response: httpx.Response) -> tuple[int, int | None]:
+    """解析 Content-Range: bytes start-end/total，返回 (start, total)"""
+    value = response.headers.get("Content-Range", "")
+    try:
+        _, _, spec = value.partition(" ")
+        span, _, total = spec.partition("/")
+        start = int(span.split("-")[0])
+    except ValueError:
+        raise DownloadError(f"无效的 Content-Range: {value!r}")
+    return start, int(total) if total.isdigit() else None
+
+
+def _finish_download(
+    part: Path, path: Path, total: int | None, sha256: str | None
+) -> str:
+    """校验临时文件的大小和校验和，通过后落盘并原子改名，返回SHA-256"""
+    size = part.stat().st_size
+    if total is not None and size != total:
+        # 不完整的文件保留，下一次从断点续传；超长说明内容有误，删除重下
+        if size > total:
+            part.unlink()
+        raise DownloadError(f"文件大小不一致: {size} != {total}")
+    digest = hashlib.sha256()
+    with open(part, "rb") as f:
+        while chunk := f.read(DOWNLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+        os.fsync(f.fileno())
+    if sha256 is not None and digest.hexdigest() != sha256.lower():
+        part.unlink()
+        raise DownloadError(f"校验和不一致: {digest.hexdigest()}")
+    os.replace(part, path)
+    return digest.hexdigest()
+
+
+def _h2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+siliconflow = SiliconFlowClient(durations=DurationModel(db), keys=provider_keys)
@@ -0,0 +1,267 @@
+import functools
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from database import ConnectionPool, Database, db
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有文件锁，各 worker 只靠快照文件的修改时间避免重复刷新
+    fcntl = None
+
+
+class BackupRestarted(Exception):
+    """增量备份期间源库被反复修改，备份不断从头开始"""
+
+
+def _connect_read_only(path: str) -> sqlite3.Connection:
+    uri = Path(path).resolve().as_uri() + "?mode=ro"
+    return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+
+class SnapshotReader:
+    """
+    快照库的只读连接池，提供管理后台用到的查询方法（与 Database 中的同名方法相同）
+
+    快照由备份生成、表结构与主库一致，不做初始化和迁移，也没有检查点线程。
+    每个快照文件对应一个读取器：文件被替换后已打开的连接仍读取旧文件，
+    正在流式导出的请求因此读到一致的数据，读取器释放后连接随之关闭。
+    """
+
+    def __init__(self, path: str, pool_size: int = 4):
+        self.path = path
+        self.pool = ConnectionPool(
+            functools.partial(_connect_read_only, path), max_size=pool_size
+        )
+
+    def connection(self):
+        return self.pool.connection()
+
+    def close(self):
+        self.pool.close()
+
+    ADMIN_USER_COLUMNS = Database.ADMIN_USER_COLUMNS
+    encode_user_cursor = staticmethod(Database.encode_user_cursor)
+    decode_user_cursor = staticmethod(Database.decode_user_cursor)
+    list_users_page = Database.list_users_page
+    iter_users = Database.iter_users
+    get_daily_statistics = Database.get_daily_statistics
+    sum_daily_statistics = Database.sum_daily_statistics
+
+
+class SnapshotReplica:
+    """
+    管理后台使用的只读快照库
+
+    通过SQLite在线备份API把主库按 pages 页一批复制到临时文件，
+    批次之间释放源库的读锁并休眠 step_sleep 秒，不阻塞业务写入；
+    复制完成后原子替换快照文件，文件修改时间即快照时间。
+    后台线程每隔 interval 秒刷新一次，读取时快照早于 max_staleness 秒则先同步刷新。
+
+    多个 worker 共享同一个快照文件：刷新前先取得 <path>.lock 文件锁，
+    拿到锁后若快照文件已被其他 worker 刷新得足够新，则直接改读该文件，
+    同一时刻只有一个 worker 执行备份。
+    """
+
+    def __init__(
+        self,
+        source: Database,
+        path: str | None = None,
+        interval: float | None = None,
+        max_staleness: float | None = None,
+        pages: int | None = None,
+        pool_size: int | None = None,
+        step_sleep: float = 0.001,
+        max_restarts: int = 5,
+    ):
+        if path is None:
+            source_path = Path(source.db_path)
+            path = os.getenv(
+                "ADMIN_SNAPSHOT_PATH",
+                str(source_path.with_name(f"{source_path.stem}.snapshot.db")),
+            )
+        if interval is None:
+            interval = float(os.getenv("ADMIN_SNAPSHOT_INTERVAL", "60"))
+        if max_staleness is None:
+            max_staleness = float(os.getenv("ADMIN_SNAPSHOT_MAX_STALENESS", "300"))
+        if pages is None:
+            pages = int(os.getenv("ADMIN_SNAPSHOT_PAGES", "256"))
+        if pool_size is None:
+            # Windows 下被打开的文件无法替换，不保留空闲连接
+            default = "0" if os.name == "nt" else "4"
+            pool_size = int(os.getenv("ADMIN_SNAPSHOT_POOL_SIZE", default))
+
+        self.source = source
+        self.path = path
+        self.interval = interval
+        self.max_staleness = max_staleness
+        self.pages = pages
+        self.pool_size = pool_size
+        self.step_sleep = step_sleep
+        self.max_restarts = max_restarts
+        self.as_of: float | None = None
+        self.last_duration: float | None = None
+        self.refreshes = 0
+        self.database: SnapshotReader | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def staleness(self) -> float | None:
+        return None if self.as_of is None else time.time() - self.as_of
+
+    def start(self):
+        """启动后台刷新线程；interval <= 0 时只在读取时按需刷新"""
+        if self.running or self.interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="admin-snapshot", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float | None = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def refresh(self, max_age: float | None = None) -> float:
+        """
+        复制一份新快照，返回耗时（秒）
+
+        指定 max_age 时，若等锁期间本进程的其他线程或其他 worker 已刷新出
+        足够新的快照，则改读该快照并返回 0。
+        """
+        with self._lock:
+            if self._fresh_enough(max_age):
+                return 0.0
+            with self._writer_lock():
+                as_of = self._file_as_of()
+                if (
+                    max_age is not None
+                    and as_of is not None
+                    and time.time() - as_of <= max_age
+                ):
+                    self._open(as_of)
+                    return 0.0
+
+                started = time.time()
+                tmp = f"{self.path}.{os.getpid()}.tmp"
+                src = self.source.get_connection()
+                dst = sqlite3.connect(tmp)
+                try:
+                    try:
+                        self._backup(src, dst, self.pages)
+                    except BackupRestarted:
+                        # 写入频繁时分批复制会不断重来；WAL模式下一次性复制只持有读快照，同样不阻塞写入
+                        self._backup(src, dst, -1)
+                    # 快照只读，不需要WAL
+                    dst.execute("PRAGMA journal_mode = DELETE")
+                finally:
+                    dst.close()
+                    src.close()
+                os.utime(tmp, (started, started))
+                os.replace(tmp, self.path)
+
+            self._open(started)
+            self.refreshes += 1
+            self.last_duration = time.time() - started
+            return self.last_duration
+
+    @contextmanager
+    def _writer_lock(self):
+        """跨进程互斥：持有期间其他 worker 不会同时备份"""
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            # 关闭文件描述符即释放锁
+            os.close(fd)
+
+    def _file_as_of(self) -> float | None:
+        try:
+            return os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _open(self, as_of: float):
+        """改读 as_of 时刻的快照文件；旧读取器不关闭，仍在使用它的请求读完为止"""
+        if self.database is None or as_of != self.as_of:
+            self.database = SnapshotReader(self.path, self.pool_size)
+        self.as_of = as_of
+
+    def _backup(self, src: sqlite3.Connection, dst: sqlite3.Connection, pages: int):
+        restarts = 0
+        last_remaining = None
+
+        def progress(status, remaining, total):
+            nonlocal restarts, last_remaining
+            # 源库被其他连接修改后备份从头开始，剩余页数会重新变大
+            if last_remaining is not None and remaining > last_remaining:
+                restarts += 1
+                if restarts > self.max_restarts:
+                    raise BackupRestarted()
+            last_remaining = remaining
+
+        src.backup(dst, pages=pages, progress=progress, sleep=self.step_sleep)
+
+    def _fresh_enough(self, max_age: float | None) -> bool:
+        return (
+            max_age is not None
+            and self.database is not None
+            and self.staleness <= max_age
+        )
+
+    def reader(self) -> SnapshotReader:
+        """返回快照库；快照不存在或超过 max_staleness 时先同步刷新"""
+        if not self._fresh_enough(self.max_staleness):
+            self.refresh(self.max_staleness)
+        return self.database
+
+    def freshness(self) -> dict:
+        """当前快照的时间信息，附在管理后台的响应中"""
+        as_of = (
+            datetime.fromtimestamp(self.as_of, timezone.utc).isoformat()
+            if self.as_of is not None
+            else None
+        )
+        staleness = self.staleness
+        return {
+            "as_of": as_of,
+            "staleness_seconds": round(staleness, 3) if staleness is not None else None,
+            "max_staleness_seconds": self.max_staleness,
+        }
+
+    def _run(self):
+        while True:
+            try:
+                # 其他 worker 在本周期内已刷新过时直接改读它的快照
+                self.refresh(self.interval)
+            except (sqlite3.Error, OSError) as e:
+                # Windows 下快照文件正被读取时无法替换，下次再试
+                print(f"管理后台快照刷新失败: {e}")
+            if self._stop.wait(self.interval):
+                break
+
+
+admin_snapshot = SnapshotReplica(db)
+
+
+async def get_admin_snapshot() -> SnapshotReplica:
+    """FastAPI依赖：管理后台分析查询使用的快照库"""
+    return admin_snapshot
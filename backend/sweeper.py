@@ -0,0 +1,392 @@
+"""
+过期数据清理
+
+后台线程定期删除过期的验证码和生成记录（每批一个小事务，批次之间让出写锁），
+删除对应及超过保留期的输出文件，回收没有被引用的源图片，
+并在数据库启用增量VACUUM时把空闲页归还给文件系统。
+
+使用方法：
+    python sweeper.py             # 立即清理一次 app.db 并打印指标
+    python sweeper.py --vacuum    # 一次性开启增量VACUUM（需要完整VACUUM，请停服执行）
+"""
+
+import argparse
+import os
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+from database import GENERATION_TTL, Database, db
+
+
+class Sweeper:
+    """
+    过期数据清理器，由应用的 lifespan 启停
+
+    - verification_codes：过期超过 code_retention 秒后删除（保留一段时间便于排查）
+    - generations：过期即删除，同时删除 result_url 指向的输出文件
+    - jobs：结束（成功/失败/取消）后保留与生成记录相同的时间
+    - output_dir 中修改时间早于生成记录保留期 + file_grace 的文件视为孤儿文件
+    - BlobStore 中没有被生成记录、用户姿势或排队/运行中的任务引用、
+      且修改时间早于 blob_grace 秒前的源图片（每 blob_interval 秒检查一次）
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        output_dir: str | None = None,
+        interval: float | None = None,
+        batch_size: int | None = None,
+        pause: float = 0.05,
+        code_retention: int = 24 * 3600,
+        file_grace: int = 24 * 3600,
+        blob_grace: int = 24 * 3600,
+        blob_interval: float | None = None,
+        vacuum_pages: int = 256,
+    ):
+        if output_dir is None:
+            output_dir = os.getenv("OUTPUT_DIR", "outputs")
+        if interval is None:
+            interval = float(os.getenv("SWEEPER_INTERVAL", "300"))
+        if batch_size is None:
+            batch_size = int(os.getenv("SWEEPER_BATCH_SIZE", "500"))
+        if blob_interval is None:
+            blob_interval = float(os.getenv("SWEEPER_BLOB_INTERVAL", "3600"))
+
+        self.database = database
+        self.output_dir = Path(output_dir)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.code_retention = code_retention
+        self.file_grace = file_grace
+        self.blob_grace = blob_grace
+        self.blob_interval = blob_interval
+        self.vacuum_pages = vacuum_pages
+
+        self.rows_deleted = {"verification_codes": 0, "generations": 0, "jobs": 0}
+        self.files_deleted = 0
+        self.blobs_deleted = 0
+        self.reclaimed_bytes = {"files": 0, "blobs": 0, "database": 0}
+        self._blobs_swept_at: float | None = None
+        self.lag_seconds = 0
+        self.sweeps = 0
+        self.last_sweep_at: float | None = None
+        self.last_duration: float | None = None
+        self.last_error: str | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running or self.interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = 10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def sweep(self) -> dict:
+        """执行一轮清理，返回本轮删除的行数和回收的字节数"""
+        started = time.time()
+        now = int(started)
+        result = {
+            "verification_codes": self._delete_batches(
+                "verification_codes", now - self.code_retention
+            ),
+            "generations": 0,
+            # 已结束的任务在 expires_ts 之后删除，未结束的任务 expires_ts 为 NULL
+            "jobs": self._delete_batches("jobs", now),
+            "files": 0,
+            "file_bytes": 0,
+            "blobs": 0,
+            "blob_bytes": 0,
+            "database_bytes": 0,
+        }
+
+        for urls in self._delete_generations(now):
+            result["generations"] += len(urls)
+            for url in filter(None, urls):
+                freed = self._remove_output(url)
+                if freed is not None:
+                    result["files"] += 1
+                    result["file_bytes"] += freed
+
+        files, freed = self._remove_orphans(now - GENERATION_TTL - self.file_grace)
+        result["files"] += files
+        result["file_bytes"] += freed
+        # 遍历整个 BlobStore 开销较大，按 blob_interval 降低频率
+        if (
+            self._blobs_swept_at is None
+            or started - self._blobs_swept_at >= self.blob_interval
+        ):
+            result["blobs"], result["blob_bytes"] = self._collect_blobs(
+                started - self.blob_grace
+            )
+            self._blobs_swept_at = started
+        result["database_bytes"] = self._incremental_vacuum()
+
+        self.rows_deleted["verification_codes"] += result["verification_codes"]
+        self.rows_deleted["generations"] += result["generations"]
+        self.rows_deleted["jobs"] += result["jobs"]
+        self.files_deleted += result["files"]
+        self.blobs_deleted += result["blobs"]
+        self.reclaimed_bytes["files"] += result["file_bytes"]
+        self.reclaimed_bytes["blobs"] += result["blob_bytes"]
+        self.reclaimed_bytes["database"] += result["database_bytes"]
+        self.lag_seconds = self._lag(int(time.time()))
+        self.sweeps += 1
+        self.last_sweep_at = started
+        self.last_duration = time.time() - started
+        return result
+
+    def metrics(self) -> dict:
+        return {
+            "running": self.running,
+            "sweeps": self.sweeps,
+            "last_sweep_at": self.last_sweep_at,
+            "last_duration_seconds": self.last_duration,
+            "last_error": self.last_error,
+            # 最早一条应删未删记录已超期的秒数，清理跟得上时为 0
+            "lag_seconds": self.lag_seconds,
+            "rows_deleted": dict(self.rows_deleted),
+            "files_deleted": self.files_deleted,
+            "blobs_deleted": self.blobs_deleted,
+            "reclaimed_bytes": dict(self.reclaimed_bytes),
+        }
+
+    def _pause(self) -> bool:
+        """批次之间让出写锁；返回 True 表示需要停止"""
+        return self._stop.wait(self.pause)
+
+    def _delete_batches(self, table: str, cutoff: int) -> int:
+        deleted = 0
+        while True:
+            with self.database.connection() as conn:
+                count = conn.execute(
+                    f"""
+                    DELETE FROM {table} WHERE rowid IN (
+                        SELECT rowid FROM {table} WHERE expires_ts < ? LIMIT ?
+                    )
+                    """,
+                    (cutoff, self.batch_size),
+                ).rowcount
+            deleted += count
+            if count < self.batch_size or self._pause():
+                return deleted
+
+    def _delete_generations(self, cutoff: int):
+        """分批删除过期生成记录，逐批产出被删除记录的 result_url"""
+        while True:
+            with self.database.connection() as conn:
+                rows = conn.execute(
+                    """
+                    DELETE FROM generations WHERE id IN (
+                        SELECT id FROM generations WHERE expires_ts < ? LIMIT ?
+                    )
+                    RETURNING result_url
+                    """,
+                    (cutoff, self.batch_size),
+                ).fetchall()
+            yield [url for (url,) in rows]
+            if len(rows) < self.batch_size or self._pause():
+                return
+
+    def _remove_output(self, url: str) -> int | None:
+        # result_url 可能是完整URL或 outputs/xxx.jpg，只删除输出目录下的同名文件
+        name = Path(urlparse(url).path).name
+        if not name:
+            return None
+        return self._unlink(self.output_dir / name)
+
+    def _remove_orphans(self, cutoff: float) -> tuple[int, int]:
+        if not self.output_dir.is_dir():
+            return 0, 0
+        files = freed = 0
+        with os.scandir(self.output_dir) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.stat().st_mtime >= cutoff:
+                    continue
+                size = self._unlink(Path(entry.path))
+                if size is not None:
+                    files += 1
+                    freed += size
+        return files, freed
+
+    def _collect_blobs(self, cutoff: float) -> tuple[int, int]:
+        """
+        标记-清除无引用的源图片，返回 (删除的文件数, 释放的字节数)
+
+        只处理修改时间早于 cutoff 的文件：刚写入或刚被 put() 复用、引用它的记录
+        还没提交的内容都在宽限期内；删除前再按修改时间检查一次。
+        """
+        live = self._live_job_images()
+        removed = freed = 0
+        batch: list[str] = []
+        for entry in self.database.blobs.scan():
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            if entry.name.startswith(".tmp-"):
+                # 写入中断留下的临时文件
+                size = self._unlink(Path(entry.path))
+                if size is not None:
+                    removed += 1
+                    freed += size
+            elif entry.name not in live:
+                batch.append(entry.name)
+            if len(batch) >= self.batch_size:
+                count, size = self._delete_unreferenced(batch, cutoff)
+                removed += count
+                freed += size
+                batch = []
+                if self._pause():
+                    return removed, freed
+        if batch:
+            count, size = self._delete_unreferenced(batch, cutoff)
+            removed += count
+            freed += size
+        return removed, freed
+
+    def _live_job_images(self) -> set[str]:
+        """排队/运行中任务的源图片；已结束的任务不再读取图片，成功的由生成记录引用"""
+        with self.database.connection() as conn:
+            rows = conn.execute("""
+                SELECT json_extract(payload, '$.source_image_hash') FROM jobs
+                WHERE state = 'queued'
+                UNION ALL
+                SELECT json_extract(payload, '$.source_image_hash') FROM jobs
+                WHERE state = 'running'
+                """).fetchall()
+        return {digest for (digest,) in rows if digest}
+
+    def _delete_unreferenced(
+        self, digests: list[str], cutoff: float
+    ) -> tuple[int, int]:
+        placeholders = ",".join("?" * len(digests))
+        with self.database.connection() as conn:
+            referenced = {
+                digest
+                for (digest,) in conn.execute(
+                    f"""
+                    SELECT source_image_hash FROM generations
+                    WHERE source_image_hash IN ({placeholders})
+                    UNION
+                    SELECT source_image_hash FROM user_poses
+                    WHERE source_image_hash IN ({placeholders})
+                    """,
+                    digests * 2,
+                )
+            }
+        removed = freed = 0
+        for digest in digests:
+            if digest in referenced:
+                continue
+            try:
+                size = self.database.blobs.delete(digest, older_than=cutoff)
+            except ValueError:
+                # 文件名不是合法的哈希，不是 BlobStore 写入的文件
+                continue
+            if size:
+                removed += 1
+                freed += size
+        return removed, freed
+
+    @staticmethod
+    def _unlink(path: Path) -> int | None:
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return None
+        return size
+
+    def _incremental_vacuum(self) -> int:
+        """auto_vacuum=INCREMENTAL 时分批释放空闲页，返回释放的字节数"""
+        freed = 0
+        while True:
+            with self.database.connection() as conn:
+                if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                    return 0
+                page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+                before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if not before:
+                    return freed
+                conn.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})")
+                after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            freed += (before - after) * page_size
+            if after == 0 or after >= before or self._pause():
+                return freed
+
+    def _lag(self, now: int) -> int:
+        with self.database.connection() as conn:
+            oldest = [
+                conn.execute(
+                    "SELECT MIN(expires_ts) FROM verification_codes WHERE expires_ts < ?",
+                    (now - self.code_retention,),
+                ).fetchone()[0],
+                conn.execute(
+                    "SELECT MIN(expires_ts) FROM generations WHERE expires_ts < ?",
+                    (now,),
+                ).fetchone()[0],
+            ]
+        lags = [
+            now - self.code_retention - oldest[0] if oldest[0] is not None else 0,
+            now - oldest[1] if oldest[1] is not None else 0,
+        ]
+        return max(lags)
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"过期数据清理失败: {e}")
+            if self._stop.wait(self.interval):
+                break
+
+
+sweeper = Sweeper(db)
+
+
+def enable_incremental_vacuum(database: Database):
+    """
+    已有数据库切换到增量VACUUM需要一次完整VACUUM（新库在创建时已开启）
+
+    请在服务停止时执行：已打开的连接会缓存旧的 auto_vacuum 设置。
+    """
+    conn = database.get_connection()
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="过期数据清理")
+    parser.add_argument("--vacuum", action="store_true", help="开启增量VACUUM")
+    args = parser.parse_args()
+
+    if args.vacuum:
+        enable_incremental_vacuum(db)
+        print("已开启增量VACUUM")
+    print(sweeper.sweep())
+    print(sweeper.metrics())
+
+
+if __name__ == "__main__":
+    main()
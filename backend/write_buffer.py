@@ -0,0 +1,106 @@
+import threading
+from collections import Counter
+from typing import Callable, Hashable
+
+
+class CounterBuffer:
+    """
+    计数器写缓冲
+
+    add() 只在内存中按 key 合并增量；后台线程每隔 interval 秒、
+    或累计增量达到 max_pending 时，把合并后的增量交给 flush 函数一次写入。
+    flush 失败时增量会合并回缓冲区，下次重试，因此不会丢失也不会重复计数。
+    start() 之前和 stop() 之后 add() 直接调用 flush 函数同步写入。
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[dict[Hashable, int]], None],
+        interval: float = 1.0,
+        max_pending: int = 1000,
+    ):
+        self._flush = flush
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending: Counter = Counter()
+        self._pending_total = 0
+        # 是否缓冲；与 _pending 一起由 _lock 保护，stop() 的最后一次写入不会漏掉并发的 add()
+        self._buffering = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.flushed_total = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def pending(self) -> dict[Hashable, int]:
+        with self._lock:
+            return dict(self._pending)
+
+    def add(self, key: Hashable, n: int = 1):
+        with self._lock:
+            buffering = self._buffering
+            if buffering:
+                self._pending[key] += n
+                self._pending_total += n
+                full = self._pending_total >= self.max_pending
+        if not buffering:
+            with self._flush_lock:
+                self._flush({key: n})
+                self.flushed_total += n
+        elif full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """立即写入当前缓冲的全部增量，返回写入的增量总数"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, Counter()
+                total, self._pending_total = self._pending_total, 0
+            if not batch:
+                return 0
+            try:
+                self._flush(dict(batch))
+            except BaseException:
+                with self._lock:
+                    self._pending.update(batch)
+                    self._pending_total += total
+                raise
+            self.flushed_total += total
+            return total
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        with self._lock:
+            self._buffering = True
+        self._thread = threading.Thread(
+            target=self._run, name="counter-buffer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float | None = 5.0):
+        """停止后台线程，并把剩余增量全部写入；之后的 add() 同步写入"""
+        with self._lock:
+            self._buffering = False
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"计数器写入失败，稍后重试: {e}")
@@ -1,7 +1,8 @@
+import os
 import requests
 import json
 
-url = "http://127.0.0.1:8045/v1beta/models/gemini-3-pro-image:generateContent?key=sk-9de6f510828b4f73a2acef35ed5f846b"
+url = "http://127.0.0.1:8045/v1beta/models/gemini-3-pro-image:generateContent?key=" + os.environ["GEMINI_API_KEY"]
 
 payload = {
     "contents": [{
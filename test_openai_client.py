@@ -4,7 +4,7 @@ import os
 print("Initializing OpenAI client...")
 client = OpenAI(
     base_url="http://127.0.0.1:8045/v1",
-    api_key="sk-9de6f510828b4f73a2acef35ed5f846b"
+    api_key=os.environ["GEMINI_API_KEY"]
 )
 
 print("Sending request to gemini-3-pro-image...")
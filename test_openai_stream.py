@@ -3,7 +3,7 @@ import os
 
 client = OpenAI(
     base_url="http://127.0.0.1:8045/v1",
-    api_key="sk-9de6f510828b4f73a2acef35ed5f846b"
+    api_key=os.environ["GEMINI_API_KEY"]
 )
 
 print("Testing STREAMING generation...")
@@ -3,7 +3,7 @@ import os
 
 # 配置 API
 genai.configure(
-    api_key="sk-9de6f510828b4f73a2acef35ed5f846b",
+    api_key=os.environ["GEMINI_API_KEY"],
     transport='rest',
     client_options={'api_endpoint': 'http://127.0.0.1:8045'}
 )